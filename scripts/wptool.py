@@ -7,6 +7,7 @@ Command line interface to wptools.
 from __future__ import print_function
 
 import argparse
+import json
 import sys
 import time
 import textwrap
@@ -128,6 +129,7 @@ def get(args):
     """
 
     html = args.H
+    infobox = args.i
     lang = args.l
     nowrap = args.n
     query = args.q
@@ -144,20 +146,27 @@ def get(args):
             return qobj.query(title)
         return qobj.random()
 
-    page = wptools.page(title, lang=lang, silent=silent,
+    page = wptools.page(title, lang=lang, parse='lead', silent=silent,
                         verbose=verbose, wiki=wiki)
 
     try:
-        page.get_query()
+        if infobox:
+            page.get_parse(False)
+        else:
+            page.get_query()
     except (StandardError, ValueError, LookupError):
         return "NOT_FOUND"
 
-    if not page.data.get('extext'):
-        out = page.cache['query']['query']
+    if infobox:
+        out = json.dumps(page.data.get('infobox'), ensure_ascii=False,
+                         indent=2, sort_keys=True)
+    else:
+        if not page.data.get('extext'):
+            out = page.cache['query']['query']
 
-    out = _page_text(page, nowrap)
-    if html:
-        out = _page_html(page)
+        out = _page_text(page, nowrap)
+        if html:
+            out = _page_html(page)
 
     print("%5.3f seconds" % (time.time() - start), file=sys.stderr)
 
@@ -184,6 +193,8 @@ def parse_args():
         epilog=epilog)
     argp.add_argument("-H", "-HTML", action='store_true',
                       help="output HTML extract")
+    argp.add_argument("-i", "-infobox", action='store_true',
+                      help="output infobox (JSON)")
     argp.add_argument("-l", "-lang", default='en',
                       help="language code")
     argp.add_argument("-n", "-nowrap", action='store_true',
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Benchmark WPTools
+~~~~~~~~~~~~~~~~~
+
+Time (offline) capture of recorded API responses (test fixtures) by
+the marshalling hot paths, report ops/sec and peak memory, and flag
+regressions against a baseline:
+
+    $ python -m tests.bench --save  # store baseline
+    $ python -m tests.bench         # compare to baseline
+
+Timings depend on the machine, so the baseline (tests/bench.json) is
+not committed. Without one, results are reported but not compared.
+"""
+
+# benchmarks call the private marshalling methods they time
+# pylint: disable=protected-access
+
+from __future__ import division, print_function
+
+import argparse
+import collections
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+
+try:  # python3.4+
+    import tracemalloc
+except ImportError:  # python2
+    tracemalloc = None
+
+import wptools
+
+from wptools import cache
+from wptools import utils
+
+from . import claims
+from . import mockwiki
+from . import parse
+from . import query
+from . import querymore
+from . import rest_lead
+from . import wikidata
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'bench.json')
+MINTIME = 0.2
+REPEAT = 5
+TOLERANCE = 0.2
+
+
+class Sink(object):
+    """
+    Discards output (of show)
+    """
+
+    @staticmethod
+    def flush():
+        """
+        nothing to flush
+        """
+
+    @staticmethod
+    def write(_):
+        """
+        discard text
+        """
+
+
+def _page(action, fixture):
+    """
+    returns page with fixture cached for action
+    """
+    page = wptools.page('TEST', skip=['imageinfo'], silent=True)
+    page.cache = {action: fixture.cache}
+    return page
+
+
+def _wikidata(fixture=wikidata):
+    """
+    returns wikidata object with fixture cached
+    """
+    page = wptools.wikidata('TEST', silent=True)
+    page.cache = {'wikidata': fixture.cache}
+    return page
+
+
+def bench_get():
+    """
+    WPToolsPage.get() replayed from a cassette recorded from mockwiki
+    """
+    def get(proxy=None):
+        """
+        get page (with http queries) replaying or recording cassette
+        """
+        previous, cache.CASSETTE = cache.CASSETTE, cassette
+        try:
+            wptools.page('TEST', silent=True,
+                         scheme=mockwiki.SCHEME).get(False, proxy)
+        finally:
+            cache.CASSETTE = previous
+
+    fd, path = tempfile.mkstemp('.tape')
+    os.close(fd)
+
+    server = mockwiki.MockWiki().start()
+    try:
+        cassette = cache.Cassette(path, record=True)
+        get(server.proxy)
+        cassette.close()
+    finally:
+        server.stop()
+
+    cassette = cache.Cassette(path)
+    os.remove(path)
+
+    return get
+
+
+def bench_infobox():
+    """
+    utils.get_infobox() of action=parse parsetree
+    """
+    ptree = utils.json_loads(parse.cache['response'])['parse']['parsetree']
+    return lambda: utils.get_infobox(ptree)
+
+
+def bench_parse():
+    """
+    WPToolsPage._set_parse_data() of action=parse
+    """
+    return lambda: _page('parse', parse)._set_parse_data()
+
+
+def bench_query():
+    """
+    WPToolsPage._set_query_data() of action=query
+    """
+    return lambda: _page('query', query)._set_query_data()
+
+
+def bench_querymore():
+    """
+    WPToolsPage._set_query_data() of action=query (more)
+    """
+    return lambda: _page('querymore', querymore)._set_query_data('querymore')
+
+
+def bench_restbase():
+    """
+    WPToolsRESTBase._set_restbase_data() of /page/mobile-sections-lead
+    """
+    def lead():
+        """
+        capture lead section
+        """
+        page = wptools.restbase(endpoint='mobile-sections-lead/TEST',
+                                silent=True)
+        page.cache['restbase'] = rest_lead.cache
+        page._set_restbase_data()
+    return lead
+
+
+def bench_show():
+    """
+    WPTools.show() of page with query, parse, wikidata and claims
+    """
+    page = _page('query', query)
+    page.cache.update({'claims': claims.cache,
+                       'parse': parse.cache,
+                       'wikidata': wikidata.cache})
+    for action in ('query', 'parse', 'wikidata', 'claims'):
+        page._set_data(action)
+    page.flags['silent'] = False
+
+    def show():
+        """
+        show page data (discarded)
+        """
+        stderr, sys.stderr = sys.stderr, Sink()
+        try:
+            page.show()
+        finally:
+            sys.stderr = stderr
+    return show
+
+
+def bench_wikidata():
+    """
+    WPToolsWikidata._set_wikidata() of wbgetentities
+    """
+    return lambda: _wikidata()._set_wikidata()
+
+
+def bench_wikidata_props():
+    """
+    WPToolsWikidata._wikidata_props() of wbgetentities claims
+    """
+    page = _wikidata()
+    entities = utils.json_loads(wikidata.cache['response'])['entities']
+    qclaims = entities[next(iter(entities))]['claims']
+    return lambda: page._wikidata_props(qclaims)
+
+
+CASES = collections.OrderedDict([
+    ('query', bench_query),
+    ('querymore', bench_querymore),
+    ('parse', bench_parse),
+    ('infobox', bench_infobox),
+    ('wikidata', bench_wikidata),
+    ('wikidata_props', bench_wikidata_props),
+    ('restbase', bench_restbase),
+    ('show', bench_show),
+    ('get', bench_get)])
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    returns {case: [reasons]} for results regressed by more than
+    tolerance (fraction) from baseline ops/sec or peak memory
+    """
+    regressions = {}
+    for case in results:
+        base = baseline.get('cases', {}).get(case)
+        if not base:
+            continue
+        reasons = []
+        if results[case]['ops'] < base['ops'] * (1 - tolerance):
+            reasons.append("ops/sec %.1f < %.1f"
+                           % (results[case]['ops'], base['ops']))
+        peak, bpeak = results[case].get('peak'), base.get('peak')
+        if peak and bpeak and peak > bpeak * (1 + tolerance):
+            reasons.append("peak %d > %d bytes" % (peak, bpeak))
+        if reasons:
+            regressions[case] = reasons
+    return regressions
+
+
+def measure(func, mintime=MINTIME, repeat=REPEAT):
+    """
+    returns {ops, peak} of func: best ops/sec of repeat runs (each
+    taking at least mintime), and peak memory allocated (bytes) by
+    one call (None without tracemalloc)
+    """
+    func()  # warm up
+
+    number = 1
+    while True:
+        start = timeit.default_timer()
+        for _ in range(number):
+            func()
+        elapsed = timeit.default_timer() - start
+        if elapsed >= mintime:
+            break
+        number *= 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = timeit.default_timer()
+        for _ in range(number):
+            func()
+        best = min(best, timeit.default_timer() - start)
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {'ops': number / best if best else float('inf'), 'peak': peak}
+
+
+def run(cases=None, mintime=MINTIME, repeat=REPEAT):
+    """
+    returns {case: {ops, peak}} for cases (default=all)
+    """
+    results = collections.OrderedDict()
+    for case in cases or CASES:
+        results[case] = measure(CASES[case](), mintime, repeat)
+    return results
+
+
+def main(args=None):
+    """
+    benchmark, print report, save or compare to baseline, returns 1
+    if there are regressions
+    """
+    argp = argparse.ArgumentParser(
+        description="Benchmark WPTools on recorded responses")
+    argp.add_argument('cases', nargs='*',
+                      help="cases to run: %s (default=all)"
+                      % ', '.join(CASES))
+    argp.add_argument('-b', '--baseline', default=BASELINE,
+                      help="baseline file (default=%(default)s)")
+    argp.add_argument('-m', '--mintime', type=float, default=MINTIME,
+                      help="seconds per timing run (default=%(default)s)")
+    argp.add_argument('-s', '--save', action='store_true',
+                      help="save results as baseline")
+    argp.add_argument('-t', '--tolerance', type=float, default=TOLERANCE,
+                      help="regression tolerance (default=%(default)s)")
+    args = argp.parse_args(args)
+
+    unknown = [x for x in args.cases if x not in CASES]
+    if unknown:
+        argp.error("unknown cases: %s" % ', '.join(unknown))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    elif not args.save:
+        print("+ no baseline %s, not comparing (save one with --save)"
+              % args.baseline, file=sys.stderr)
+
+    results = run(args.cases, args.mintime)
+    regressions = compare(results, baseline, args.tolerance)
+
+    print("%-16s %12s %12s %10s" % ('case', 'ops/sec', 'peak kB', 'change'))
+    for case, result in results.items():
+        change = ''
+        base = baseline.get('cases', {}).get(case)
+        if base:
+            change = "%+.1f%%" % (100 * (result['ops'] / base['ops'] - 1))
+        peak = result['peak'] / 1024.0 if result['peak'] else 0
+        flag = ' REGRESSED' if case in regressions else ''
+        print("%-16s %12.1f %12.1f %10s%s"
+              % (case, result['ops'], peak, change, flag))
+
+    for case in regressions:
+        print("+ %s: %s" % (case, '; '.join(regressions[case])),
+              file=sys.stderr)
+
+    if args.save:
+        cases = dict(baseline.get('cases', {}), **results)
+        with open(args.baseline, 'w') as fh:
+            json.dump({'cases': cases,
+                       'python': platform.python_version(),
+                       'wptools': wptools.__version__},
+                      fh, indent=2, sort_keys=True)
+        print("+ saved %s" % args.baseline, file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
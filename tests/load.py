@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Load-test WPTools
+~~~~~~~~~~~~~~~~~
+
+Drive wptools.page(...).get() at a target concurrency against a mock
+Wikimedia server (see mockwiki), and report throughput and latency
+percentiles of pages and of requests by action:
+
+    $ python -m tests.load -n 500 -c 16 --latency 0.05 --errors 0.01
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import threading
+import time
+
+try:  # python2
+    from Queue import Queue, Empty
+except ImportError:  # python3
+    from queue import Queue, Empty
+
+import wptools
+
+from wptools import metrics
+from wptools import throttle
+
+from . import mockwiki
+
+CONCURRENCY = 8
+PAGES = 100
+
+
+def report(result):
+    """
+    print load test result
+    """
+    latency = result['latency']
+    print("%d pages (%d errors) in %.2fs: %.1f pages/sec"
+          % (result['pages'], result['errors'], result['seconds'],
+             result['throughput']))
+    if latency['count']:
+        print("page latency p50 %.3fs p95 %.3fs p99 %.3fs max %.3fs"
+              % (latency['p50'], latency['p95'], latency['p99'],
+                 latency['max']))
+
+    actions = result['requests']['action']
+    for action in sorted(actions):
+        stats = actions[action]
+        total = stats['total']
+        if not total['count']:
+            continue
+        print("  %-12s %6d requests %4d errors %8.1f kB/req  p50 %.3fs "
+              "p95 %.3fs p99 %.3fs"
+              % (action, stats['requests'], stats['errors'],
+                 stats['bytes'] / 1024.0 / stats['requests'],
+                 total['p50'], total['p95'], total['p99']))
+
+
+def run(proxy, pages=PAGES, concurrency=CONCURRENCY, timeout=0,
+        paced=True, **kwargs):
+    """
+    returns {pages, errors, seconds, throughput, latency, requests}
+    getting pages (titles) with concurrency threads via proxy (HTTP),
+    requests being metrics.METRICS of the run
+
+    Optional keyword {params} and {flags} are passed on to each
+    wptools.page, e.g. skip, scheme (default=mockwiki.SCHEME). Requests
+    are paced (throttle.SCHEDULER) unless paced is False.
+    """
+    hist = metrics.Histogram()
+    titles = Queue()
+    for i in range(pages):
+        titles.put("Page_%d" % i)
+
+    lock = threading.Lock()
+    errors = []
+    kwargs.setdefault('silent', True)
+    kwargs.setdefault('scheme', mockwiki.SCHEME)
+
+    def work():
+        """
+        get pages until there are none left
+        """
+        while True:
+            try:
+                title = titles.get_nowait()
+            except Empty:
+                return
+            start = time.time()
+            try:
+                wptools.page(title, **kwargs).get(False, proxy, timeout)
+            except Exception as exc:  # pylint: disable=broad-except
+                with lock:
+                    errors.append(exc)
+            with lock:
+                hist.add(time.time() - start)
+
+    scheduler = throttle.SCHEDULER
+    metrics.METRICS.clear()
+    throttle.SCHEDULER = (throttle.Scheduler() if paced
+                          else throttle.Scheduler(rates={}))
+
+    start = time.time()
+    try:
+        workers = [threading.Thread(target=work) for _ in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        throttle.SCHEDULER = scheduler
+    elapsed = time.time() - start
+
+    return {'errors': len(errors),
+            'latency': hist.summary(),
+            'pages': pages,
+            'requests': metrics.METRICS.summary(),
+            'seconds': elapsed,
+            'throughput': pages / elapsed if elapsed else 0}
+
+
+def main(args=None):
+    """
+    run load test against a mock server (started here unless --proxy)
+    """
+    argp = argparse.ArgumentParser(description="Load-test WPTools")
+    argp.add_argument('-c', '--concurrency', type=int, default=CONCURRENCY,
+                      help="pages got at once (default=%(default)s)")
+    argp.add_argument('-n', '--pages', type=int, default=PAGES,
+                      help="pages to get (default=%(default)s)")
+    argp.add_argument('--parse', choices=['full', 'lead', 'lean'],
+                      default='full',
+                      help="action=parse profile (default=%(default)s)")
+    argp.add_argument('--proxy',
+                      help="running mock server URL (see mockwiki)")
+    argp.add_argument('--unpaced', action='store_true',
+                      help="do not pace requests (see throttle)")
+    mockwiki.options(argp)
+    args = argp.parse_args(args)
+
+    server = None
+    proxy = args.proxy
+    if not proxy:
+        server = mockwiki.MockWiki(0, args.latency, args.jitter,
+                                   args.errors, args.rate, args.seed).start()
+        proxy = server.proxy
+
+    try:
+        report(run(proxy, args.pages, args.concurrency,
+                   paced=not args.unpaced, parse=args.parse))
+    finally:
+        if server:
+            print("server: %s" % server.stats())
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
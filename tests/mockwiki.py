@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Mock Wikimedia APIs
+~~~~~~~~~~~~~~~~~~~
+
+Local stand-in for MediaWiki (api.php), Wikidata (wbgetentities) and
+RESTBase (/api/rest_v1/page/*) replaying recorded responses (test
+fixtures) for any title, with injected latency, errors and throttling.
+
+It also serves as an HTTP proxy for all Wikimedia hosts, so requests
+reach it with plain HTTP queries (scheme=http) and the proxy argument,
+e.g.
+
+    $ python -m tests.mockwiki -p 8080 --latency 0.05 --errors 0.01
+
+    >>> wptools.page('TEST', scheme=mockwiki.SCHEME).get(
+    ...     proxy='http://127.0.0.1:8080')
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import math
+import random
+import threading
+import time
+
+try:  # python2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:  # python3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+from wptools.throttle import TokenBucket
+
+from . import category
+from . import claims
+from . import imageinfo
+from . import parse
+from . import query
+from . import querymore
+from . import rest
+from . import rest_html
+from . import rest_lead
+from . import rest_summary
+from . import siteinfo
+from . import sitematrix
+from . import siteviews
+from . import wikidata
+
+# of queries (plain HTTP) to reach MockWiki as proxy
+SCHEME = 'http'
+
+FIXTURES = {'category': category,
+            'claims': claims,
+            'imageinfo': imageinfo,
+            'parse': parse,
+            'query': query,
+            'querymore': querymore,
+            'rest': rest,
+            'rest_html': rest_html,
+            'rest_lead': rest_lead,
+            'rest_summary': rest_summary,
+            'siteinfo': siteinfo,
+            'sitematrix': sitematrix,
+            'siteviews': siteviews,
+            'wikidata': wikidata}
+
+# action=query fixture by (param, value in param)
+QUERIES = (('prop', 'imageinfo', 'imageinfo'),
+           ('list', 'categorymembers', 'category'),
+           ('meta', 'siteinfo', 'siteinfo'),
+           ('meta', 'siteviews', 'siteviews'),
+           ('prop', 'pageviews', 'querymore'))
+
+RESTBASE = {'': 'rest',
+            'html': 'rest_html',
+            'mobile-sections-lead': 'rest_lead',
+            'summary': 'rest_summary'}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves fixtures (or injected faults) for GET requests
+    """
+
+    protocol_version = 'HTTP/1.1'  # keep connections alive
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        respond to GET after latency, with fault or fixture
+        """
+        name = route(self.path)
+        status, headers, body = self.server.respond(name, self.path)
+
+        self.send_response(status)
+        for header in sorted(headers):
+            self.send_header(header, headers[header])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """
+        quiet
+        """
+
+
+class MockWiki(ThreadingMixIn, HTTPServer):
+    """
+    Threaded mock Wikimedia API server
+
+    Each response is delayed by latency (plus up to jitter) seconds. A
+    fraction of requests (errors) fail with 503, and requests over rate
+    per second are throttled (429 with Retry-After).
+    """
+
+    daemon_threads = True
+    request_queue_size = 128  # listen backlog, for many clients at once
+
+    counts = None
+    errors = 0
+    jitter = 0
+    latency = 0
+    lock = None
+    rate = None
+    rng = None
+    thread = None
+
+    def __init__(self, port=0, latency=0, jitter=0, errors=0, rate=None,
+                 seed=None):
+        """
+        Returns a MockWiki object (call start() to serve)
+
+        Arguments:
+        - [port]: <int> port to listen on 127.0.0.1 (0=any free port)
+        - [latency]: <float> seconds to delay each response
+        - [jitter]: <float> most random seconds added to latency
+        - [errors]: <float> fraction of requests failing with 503
+        - [rate]: <float> requests per second before throttling (429)
+        - [seed]: <int> random seed, for reproducible faults
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+        self.rate = TokenBucket(rate) if rate else None
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    @property
+    def proxy(self):
+        """
+        returns URL of server, to use as proxy
+        """
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def respond(self, name, url=None):
+        """
+        returns (status, headers, body) of response for route name
+        (of request url), after latency
+        """
+        with self.lock:
+            self.counts['requests'] += 1
+            delay = self.latency + self.rng.random() * self.jitter
+            wait = self.rate.take() if self.rate else 0
+            failed = self.rng.random() < self.errors
+
+        if delay:
+            time.sleep(delay)
+
+        ctype = {'Content-Type': 'application/json; charset=utf-8'}
+
+        if wait:
+            self.tally('throttled')
+            retry = {'Retry-After': str(int(math.ceil(wait)))}
+            return (429, dict(ctype, **retry),
+                    error_body('ratelimited', 'Too many requests'))
+
+        if failed:
+            self.tally('errors')
+            return 503, ctype, error_body('unavailable', 'Injected error')
+
+        if name is None:
+            self.tally('missing')
+            return 404, ctype, error_body('notfound', 'No fixture')
+
+        self.tally(name)
+        body = fixture_body(name, url).encode('utf-8')
+        if name == 'rest_html':
+            ctype = {'Content-Type': 'text/html; charset=utf-8'}
+        return 200, ctype, body
+
+    def start(self):
+        """
+        serve in a (daemon) thread, returns self
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stats(self):
+        """
+        returns counts of requests, errors, throttled and responses by
+        fixture
+        """
+        with self.lock:
+            return dict(self.counts)
+
+    def stop(self):
+        """
+        stop serving and close
+        """
+        self.shutdown()
+        self.server_close()
+
+    def tally(self, name):
+        """
+        count response
+        """
+        with self.lock:
+            self.counts[name] += 1
+
+
+def error_body(code, info):
+    """
+    returns MediaWiki API error body
+    """
+    return json.dumps({'error': {'code': code, 'info': info}}).encode('utf-8')
+
+
+def fixture_body(name, url=None):
+    """
+    returns fixture response for route name, shaped by request url:
+    action=parse with only its props, and categorymembers in batches
+    of cmlimit (after cmcontinue)
+    """
+    response = FIXTURES[name].response
+    if name not in ('category', 'parse') or not url:
+        return response
+
+    params = parse_qs(urlparse(url).query)
+    data = json.loads(response)
+
+    if name == 'category':
+        members = data['query']['categorymembers']
+        limit = int((params.get('cmlimit') or ['500'])[0])
+        start = int((params.get('cmcontinue') or ['page|0'])[0]
+                    .split('|')[-1])
+        data['query']['categorymembers'] = members[start:start + limit]
+        if start + limit < len(members):
+            data['continue'] = {'cmcontinue': "page|%d" % (start + limit),
+                                'continue': '-||'}
+        return json.dumps(data)
+
+    if params.get('prop'):
+        keep = set(params['prop'][0].split('|')) | set(['pageid', 'title'])
+        data['parse'] = dict((x, data['parse'][x]) for x in data['parse']
+                             if x in keep)
+    return json.dumps(data)
+
+
+def options(argp):
+    """
+    add fault injection options to argparse parser
+    """
+    argp.add_argument('--errors', type=float, default=0,
+                      help="fraction of requests failing (503)")
+    argp.add_argument('--jitter', type=float, default=0,
+                      help="most random seconds added to latency")
+    argp.add_argument('--latency', type=float, default=0,
+                      help="seconds to delay each response")
+    argp.add_argument('--rate', type=float,
+                      help="requests per second before throttling (429)")
+    argp.add_argument('--seed', type=int, help="random seed")
+
+
+def route(url):
+    """
+    returns fixture name for request URL (or proxy request path), or
+    None
+    """
+    parts = urlparse(url)
+    params = parse_qs(parts.query)
+
+    def param(name):
+        """
+        returns first value of query param
+        """
+        return (params.get(name) or [''])[0]
+
+    if '/api/rest_v1/page/' in parts.path:
+        endpoint = parts.path.split('/api/rest_v1/page/', 1)[1]
+        return RESTBASE.get(endpoint.split('/')[0])
+
+    if not parts.path.endswith('/w/api.php'):
+        return
+
+    action = param('action')
+
+    if action == 'wbgetentities':
+        return 'wikidata' if 'claims' in param('props') else 'claims'
+
+    if action == 'query':
+        for name, value, fixture in QUERIES:
+            if value in param(name):
+                return fixture
+        return 'query'
+
+    return {'parse': 'parse', 'sitematrix': 'sitematrix'}.get(action)
+
+
+def main(args=None):
+    """
+    serve until interrupted
+    """
+    argp = argparse.ArgumentParser(description="Mock Wikimedia APIs")
+    argp.add_argument('-p', '--port', type=int, default=8080,
+                      help="port (default=%(default)s)")
+    options(argp)
+    args = argp.parse_args(args)
+
+    server = MockWiki(args.port, args.latency, args.jitter, args.errors,
+                      args.rate, args.seed)
+    print("Serving on %s (use as proxy)" % server.proxy)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats(), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -44,7 +44,7 @@ def main(delay=1):
         elapsed = int(time.time()) - start
 
         lang = random.choice(LANGUAGES)
-        page = wptools.page(lang=lang, silent=True)
+        page = wptools.page(lang=lang, reservoir=True, silent=True)
         page.get()
 
         print("[%d](%d) %s" % (count, elapsed, page.data.get('url')))
@@ -132,9 +132,10 @@ class WPToolsToolTest(unittest.TestCase):
         '''
         from scripts.wptool import main
         from collections import namedtuple
-        args = namedtuple('Args', ['H', 'l', 'n', 'q', 's', 't', 'v', 'w'])
-        cli = {'H': False, 'l': 'en', 'n': False, 'q': False, 's': True,
-               't': '', 'v': False, 'w': ''}
+        args = namedtuple('Args',
+                          ['H', 'i', 'l', 'n', 'q', 's', 't', 'v', 'w'])
+        cli = {'H': False, 'i': False, 'l': 'en', 'n': False, 'q': False,
+               's': True, 't': '', 'v': False, 'w': ''}
         main(args(**cli))
 
 
@@ -5,9 +5,24 @@
 Basic tests for WPTools.
 """
 
+import contextlib
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import zlib
+
 import wptools
 
+try:  # python2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # python3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
 from . import category
 from . import claims
 from . import imageinfo
@@ -23,22 +38,380 @@ from . import siteviews
 from . import wikidata
 
 
+def http_server(handler):
+    """
+    returns local HTTPServer serving handler in a daemon thread
+    """
+    handler.log_message = lambda *args: None
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@contextlib.contextmanager
+def file_wiki(cls, fixtures=None):
+    """
+    context yielding (subclass of cls getting each action from a local
+    file, tmpdir) with fixture {action: cache} responses written to
+    tmpdir, removed on exit
+    """
+    tmpdir = tempfile.mkdtemp()
+    for action in fixtures or {}:
+        with open(os.path.join(tmpdir, action), 'wb') as fh:
+            fh.write(fixtures[action]['response'].encode('utf-8'))
+
+    class FileWiki(cls):
+        LABEL_CACHE = wptools.cache.LRUCache()
+
+        def _query(self, action, qobj):
+            qobj.set_status(action, 'TEST')
+            return 'file://' + os.path.join(tmpdir, action)
+
+    try:
+        yield FileWiki, tmpdir
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 class WPToolsTestCase(unittest.TestCase):
 
     @staticmethod
     def test_entry_points():
+        wptools.batch
+        wptools.cache
         wptools.core
+        wptools.metrics
         wptools.query
         wptools.request
+        wptools.reservoir
+        wptools.throttle
+        wptools.tracing
         wptools.utils
 
         wptools.page
+        wptools.pages
         wptools.category
         wptools.restbase
         wptools.site
         wptools.wikidata
 
 
+@unittest.skipIf(wptools.aio is None, "needs python3.5+ asyncio")
+class WPToolsAsyncTestCase(unittest.TestCase):
+
+    def test_aio_fetch(self):
+        import asyncio
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+        server = http_server(Handler)
+        url = 'http://127.0.0.1:%d/%%d' % server.server_port
+
+        loop = asyncio.new_event_loop()
+        multi = wptools.aio.AsyncMulti(
+            wptools.request.WPToolsRequest(silent=True), maxconn=4,
+            loop=loop)
+        results = loop.run_until_complete(asyncio.gather(
+            *[multi.fetch(url % i) for i in range(10)]))
+        loop.close()
+        server.shutdown()
+        server.server_close()
+
+        self.assertEqual([x[0] for x in results], [b'{}'] * 10)
+        self.assertEqual([x[1]['url'] for x in results],
+                         [url % i for i in range(10)])
+
+    def test_aio_page_aget(self):
+        import asyncio
+
+        fixtures = {'claims': claims.cache,
+                    'parse': parse.cache,
+                    'query': query.cache,
+                    'wikidata': wikidata.cache}
+
+        with file_wiki(wptools.page, fixtures) as (FilePage, _):
+            pages = [FilePage('TEST', skip=['imageinfo', 'restbase'],
+                              silent=True) for _ in range(3)]
+            loop = asyncio.new_event_loop()
+            pages = loop.run_until_complete(asyncio.gather(
+                *[loop.create_task(x.aget()) for x in pages]))
+            loop.close()
+
+        serial = wptools.page('TEST', skip=['imageinfo'], silent=True)
+        serial.cache = dict(fixtures)
+        for action in ['query', 'parse', 'wikidata', 'claims']:
+            serial._set_data(action)
+        for page in pages:
+            self.assertEqual(page.data, serial.data)
+            self.assertFalse(page.flags['defer_claims'])
+
+    def test_aio_transport(self):
+        import asyncio
+
+        page = wptools.page('TEST', silent=True)
+
+        def transport(future):
+            """
+            AsyncMulti of the running loop
+            """
+            future.set_result(wptools.aio.transport(page))
+
+        multis = []
+        for _ in range(3):
+            loop = asyncio.new_event_loop()
+            future = loop.create_future()
+            loop.call_soon(transport, future)
+            multis.append(loop.run_until_complete(future))
+            self.assertTrue(wptools.aio.TRANSPORTS[loop][
+                (True, False, None, 0)] is multis[-1])
+            loop.close()
+
+        # those of closed loops are dropped
+        self.assertEqual(len(wptools.aio.TRANSPORTS), 1)
+        self.assertEqual(len(set(multis)), 3)
+
+    def test_aio_page_aget_actions(self):
+        import asyncio
+
+        rand = {'query': {'random': [{'id': 1, 'title': 'RANDOM'}]}}
+        fixtures = {'parse': parse.cache,
+                    'query': query.cache,
+                    'random': {'response': json.dumps(rand)}}
+
+        with file_wiki(wptools.page, fixtures) as (FilePage, _):
+            page = FilePage('TEST', skip=['imageinfo', 'wikidata'],
+                            silent=True)
+            loop = asyncio.new_event_loop()
+            for coro in (page.aget_query, page.aget_parse):
+                loop.run_until_complete(loop.create_task(coro(False)))
+            other = FilePage(skip=['imageinfo'], silent=True)
+            for _ in range(2):  # not cached
+                loop.run_until_complete(
+                    loop.create_task(other.aget_random(False)))
+            loop.close()
+
+        self.assertEqual(sorted(page.cache), ['imageinfo', 'parse', 'query'])
+        self.assertEqual(page.data['wikibase'], 'Q42')
+        self.assertTrue(page.data['infobox'])
+        self.assertEqual(other.data['title'], 'RANDOM')
+        self.assertTrue('random' not in other.cache)
+
+        self.assertTrue(wptools.core.AIO is wptools.aio)
+        wptools.core.AIO = None
+        try:
+            self.assertRaises(RuntimeError, page.aget_query)
+        finally:
+            wptools.core.AIO = wptools.aio
+
+
+class WPToolsBatchTestCase(unittest.TestCase):
+
+    def test_batch_split_query(self):
+        responses = [
+            {'continue': {'excontinue': 1, 'continue': '||info'},
+             'query': {'normalized': [{'from': 'a_1', 'to': 'A 1'}],
+                       'redirects': [{'from': 'A 1', 'to': 'A'}],
+                       'pages': [{'pageid': 1, 'title': 'A', 'extract': 'X'},
+                                 {'pageid': 2, 'title': 'B'},
+                                 {'missing': True, 'title': 'C'}]}},
+            {'query': {'pages': [{'pageid': 1, 'title': 'A'},
+                                 {'pageid': 2, 'title': 'B',
+                                  'extract': 'Y'}]}}]
+        pages = wptools.batch.split_query(responses)
+        self.assertEqual(list(pages), ['A', 'B', 'a_1', 'A 1'])
+        self.assertEqual(pages['a_1']['pageid'], 1)
+        self.assertEqual(pages['A']['extract'], 'X')
+        self.assertEqual(pages['B']['extract'], 'Y')
+
+        responses = [{'error': {'code': 'TEST'}}]
+        self.assertRaises(LookupError, wptools.batch.split_query, responses)
+
+    def test_batch_pages(self):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            first chunk with extracts continued, second an API error
+            """
+            def do_GET(self):
+                query = self.path.split('?', 1)[1]
+                requests.append(query)
+                titles = query.split('&titles=')[1].split('&')[0]
+                if 'T50' in titles.split('|'):
+                    data = {'error': {'code': 'TEST'}}
+                elif 'excontinue' in query:
+                    data = {'query': {'pages': [
+                        {'pageid': 1, 'title': 'T0', 'extract': 'X'}]}}
+                else:
+                    data = {'continue': {'excontinue': 1, 'continue': '||'},
+                            'query': {'random': [{'title': 'R'}],
+                                      'pages': [{'pageid': 1,
+                                                 'title': 'T0'}]}}
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http_server(Handler)
+        try:
+            pages = wptools.batch.pages(
+                ['T%d' % x for x in range(60)], silent=True,
+                wiki="http://127.0.0.1:%d" % server.server_port)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual([x.data['title'] for x in pages], ['T0'])
+        self.assertEqual(pages[0].data['extext'], 'X')
+        self.assertEqual(len(requests), 3)
+        cont = [x for x in requests if 'excontinue' in x][0]
+        self.assertTrue('list=random' not in cont)
+
+    def test_batch_query(self):
+        qobj = wptools.query.WPToolsQuery()
+        qstr = qobj.query(titles=['A B', 'C'])
+        self.assertTrue('&titles=A%20B|C' in qstr)
+        self.assertTrue('&exlimit=max' in qstr)
+
+        chunks = wptools.utils.chunks(range(120), qobj.MAXTITLES)
+        self.assertEqual([len(x) for x in chunks], [50, 50, 20])
+
+    def test_batch_wikidata(self):
+        qobj = wptools.query.WPToolsQuery()
+        qstr = qobj.wikidata(None, ['Q1', 'Q2'])
+        self.assertTrue('&ids=Q1|Q2' in qstr)
+        qstr = qobj.wikidata(['A B', 'C'])
+        self.assertTrue('&sites=enwiki&titles=A%20B|C' in qstr)
+
+        self.assertEqual(wptools.batch.wikititle('douglas_Adams'),
+                         'Douglas Adams')
+
+        entities = json.loads(wikidata.cache['response'])['entities']
+        page = wptools.page('Douglas_Adams', skip=['imageinfo'], silent=True)
+        page.set_entity(entities['Q42'], {'query': 'QUERY'})
+        self.assertEqual(page.params['wikibase'], 'Q42')
+        self.assertEqual(page.data['label'], 'Douglas Adams')
+        self.assertEqual(len(page.data['claims']), 11)
+        self.assertEqual(page.query('wikidata'), 'QUERY')
+
+    def test_batch_wikidata_redirects(self):
+        from tests import mockwiki
+        server = mockwiki.MockWiki().start()  # Q42 for any title
+        try:
+            items = [wptools.page(x, silent=True, scheme=mockwiki.SCHEME)
+                     for x in ('Adams, Douglas', 'Douglas Adams')]
+            found = wptools.batch.get_wikidata(items, server.proxy,
+                                               silent=True)
+            self.assertEqual(server.stats()['requests'], 2)  # again alone
+
+            alone = wptools.batch.get_wikidata(items[:1], server.proxy,
+                                               silent=True)
+        finally:
+            server.stop()
+
+        self.assertEqual([x.params['wikibase'] for x in found],
+                         ['Q42', 'Q42'])
+        self.assertEqual(alone[0].data['label'], 'Douglas Adams')
+
+
+class WPToolsCacheTestCase(unittest.TestCase):
+
+    def test_cache_lru(self):
+        lru = wptools.cache.LRUCache(maxsize=2)
+        lru.set('A', 1)
+        lru.set('B', 2)
+        self.assertEqual(lru.get('A'), 1)
+        lru.set('C', 3)
+        self.assertTrue('A' in lru)
+        self.assertTrue('B' not in lru)
+        self.assertEqual(lru.get('B', 'DEFAULT'), 'DEFAULT')
+        self.assertEqual(lru.stats(), {'evictions': 1, 'hits': 1,
+                                       'maxsize': 2, 'misses': 1,
+                                       'size': 2})
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test_cache_cassette(self):
+        from tests import mockwiki
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'TEST.tape')
+
+        try:
+            server = mockwiki.MockWiki().start()
+            with wptools.cache.Cassette(path, record=True) as cassette:
+                self.assertTrue(wptools.cache.CASSETTE is cassette)
+                page = wptools.page('TEST', skip=['imageinfo'], silent=True,
+                                    scheme=mockwiki.SCHEME)
+                page.get(False, server.proxy)
+            self.assertEqual(wptools.cache.CASSETTE, None)
+            self.assertEqual(cassette.stats()['writes'],
+                             server.stats()['requests'])
+            server.stop()
+
+            with open(path, 'ab') as fh:
+                fh.write(b'999\nTRUNCATED')
+
+            # replay with no server
+            with wptools.cache.Cassette(path) as cassette:
+                replay = wptools.page('TEST', skip=['imageinfo'],
+                                      silent=True, scheme=mockwiki.SCHEME)
+                replay.get(False, server.proxy)
+                self.assertRaises(LookupError, wptools.page(
+                    'OTHER', skip=['imageinfo'], silent=True,
+                    scheme=mockwiki.SCHEME).get_query)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(replay.data, page.data)
+        self.assertEqual(replay.info('parse')['cache'], 'replay')
+        self.assertEqual(cassette.stats()['misses'], 1)
+
+    def test_cache_disk(self):
+        tmpdir = tempfile.mkdtemp()
+        url = 'HTTPS://en.wikipedia.org/w/api.php?b=2&a=1#frag'
+        self.assertEqual(wptools.cache.url_key(url),
+                         'https://en.wikipedia.org/w/api.php?a=1&b=2')
+
+        for disk in (wptools.cache.DirCache(os.path.join(tmpdir, 'dir'),
+                                            maxbytes=540),
+                     wptools.cache.SQLiteCache(os.path.join(tmpdir, 'db'),
+                                               maxbytes=540)):
+            disk.set(url, b'BODY', {'status': 200})
+            entry = disk.get('https://en.wikipedia.org/w/api.php?a=1&b=2')
+            self.assertEqual(entry['body'], b'BODY')
+            self.assertEqual(entry['info'], {'status': 200})
+
+            disk.set('STALE', b'BODY', {}, ttl=-1)
+            self.assertEqual(disk.get('STALE'), None)
+            self.assertEqual(disk.get('STALE', stale=True)['body'], b'BODY')
+            stats = disk.stats()
+            self.assertEqual((stats['hits'], stats['stale'],
+                              stats['expired']), (1, 1, 1))
+
+            disk.get(url)  # STALE is now least recently used
+            disk.set('BIG', os.urandom(500), {})
+            self.assertEqual(disk.get('STALE', stale=True), None)
+            self.assertTrue(disk.size() <= 540)
+            self.assertTrue(disk.stats()['evictions'] > 0)
+
+            disk.set(url, b'BODY', {'status': 200})  # replaced
+            reopened = type(disk)(disk.path)
+            self.assertEqual(reopened.size(), disk.size())
+
+            disk.clear()
+            self.assertEqual(disk.size(), 0)
+
+        shutil.rmtree(tmpdir)
+
+
 class WPToolsCategoryTestCase(unittest.TestCase):
 
     def test_category_init(self):
@@ -53,6 +426,70 @@ class WPToolsCategoryTestCase(unittest.TestCase):
         cat.get_members()
         self.assertEqual(len(cat.data), 0)
 
+    def test_category_crawl(self):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            tree of Category:N with subcategories 2N, 2N+1 (and 1, a
+            cycle) and articles N and Shared, in two batches
+            """
+            def do_GET(self):
+                query = self.path.split('?', 1)[1]
+                requests.append(query)
+                node = int(query.split('cmtitle=Category%3A')[1]
+                           .split('&')[0])
+                members = [{'ns': 14, 'title': "Category:%d" % x}
+                           for x in (2 * node, 2 * node + 1, 1)]
+                data = {'continue': {'cmcontinue': 'page|1'}}
+                if 'cmcontinue' in query:
+                    members = [{'ns': 0, 'title': "Article %d" % node},
+                               {'ns': 0, 'title': 'Shared'}]
+                    data = {}
+                data['query'] = {'categorymembers': members}
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http_server(Handler)
+        try:
+            wiki = "http://127.0.0.1:%d" % server.server_port
+            cat = wptools.category('Category:1', silent=True, wiki=wiki)
+            cat.params.pop('title')
+            self.assertRaises(LookupError, cat.crawl)
+            cat.params['title'] = 'Category:1'
+
+            found = list(cat.crawl(depth=2))
+            self.assertTrue('cmnamespace=0|14' in requests[0])
+            self.assertEqual(len(requests), 14)
+
+            del requests[:]
+            bounded = list(cat.crawl(depth=10, maxnodes=5))
+            self.assertEqual(len(requests), 10)
+
+            del requests[:]
+            stream = cat.crawl(depth=10, buffer=1)
+            self.assertEqual(next(stream)['depth'], 0)
+            stream.close()
+            time.sleep(0.1)
+            stopped = len(requests)
+            time.sleep(0.1)
+            self.assertEqual(len(requests), stopped)
+            self.assertTrue(stopped < 100)  # of 2000
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        titles = [x['title'] for x in found]
+        self.assertEqual(sorted(titles), ['Article %d' % x
+                                          for x in range(1, 8)] + ['Shared'])
+        self.assertEqual(titles[:2], ['Article 1', 'Shared'])
+        self.assertEqual(found[-1]['depth'], 2)
+        self.assertEqual(found[-1]['category'], 'Category:7')
+        self.assertEqual(len(bounded), 6)
+
     def test_category_get_members(self):
         cat = wptools.category('TEST')
         cat.cache['category'] = category.cache
@@ -65,17 +502,116 @@ class WPToolsCategoryTestCase(unittest.TestCase):
         cat._set_data('category')
         self.assertTrue(len(cat.data['members']), 92)
 
+    def test_category_iter_members(self):
+        from tests import mockwiki
+        cat = wptools.category('TEST', silent=True)
+        cat.params.pop('title')
+        self.assertRaises(LookupError, cat.iter_members)
+
+        def failing():
+            yield 1
+            raise LookupError('TEST')
+        stream = wptools.utils.prefetch(failing())
+        self.assertEqual(next(stream), 1)
+        self.assertRaises(LookupError, next, stream)
+
+        server = mockwiki.MockWiki().start()
+        try:
+            cat = wptools.category('TEST', silent=True, scheme=mockwiki.SCHEME)
+            members = list(cat.iter_members(server.proxy, limit=10))
+            serial = list(cat.iter_members(server.proxy, limit=50,
+                                           prefetch=0))
+            self.assertEqual(server.stats()['category'], 12)
+
+            # closing stops prefetching (one batch ahead)
+            stream = cat.iter_members(server.proxy, limit=10)
+            self.assertEqual(next(stream), members[0])
+            stream.close()
+            time.sleep(0.1)
+            self.assertEqual(server.stats()['category'], 14)
+        finally:
+            server.stop()
+
+        self.assertEqual(len(members), 92)
+        self.assertEqual(members, serial)
+        self.assertEqual(members, json.loads(
+            category.cache['response'])['query']['categorymembers'])
+        self.assertTrue('members' not in cat.data)
+
+    def test_category_iter_pages(self):
+        requests = []
+
+        def page(title, extract=True):
+            """
+            action=query page, with extract if true
+            """
+            data = {'pageid': len(title), 'title': title, 'ns': 0,
+                    'fullurl': "https://en.wikipedia.org/wiki/%s" % title,
+                    'pageprops': {'wikibase_item': "Q%d" % len(title)},
+                    'terms': {'label': [title]}}
+            if extract:
+                data['extract'] = "<p><b>%s</b></p>" % title
+            return data
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            members A, BB (first batch, extracts continued) and CCC
+            """
+            def do_GET(self):
+                query = self.path.split('?', 1)[1]
+                requests.append(query)
+                if 'excontinue' in query:
+                    data = {'continue': {'gcmcontinue': 'page|C',
+                                         'continue': '-||'},
+                            'query': {'pages': [page('A', False),
+                                                page('BB')]}}
+                elif 'gcmcontinue' in query:
+                    data = {'query': {'pages': [page('CCC')]}}
+                else:
+                    data = {'continue': {'excontinue': '1',
+                                         'gcmcontinue': 'page|C',
+                                         'continue': 'gcmcontinue||'},
+                            'query': {'pages': [page('A'),
+                                                page('BB', False)]}}
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http_server(Handler)
+        try:
+            wiki = "http://127.0.0.1:%d" % server.server_port
+            cat = wptools.category('Category:TEST', silent=True, wiki=wiki)
+            pages = list(cat.iter_pages(limit=2))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(requests), 3)
+        self.assertTrue('generator=categorymembers' in requests[0])
+        self.assertTrue('&gcmlimit=2&gcmnamespace=0' in requests[0])
+        self.assertTrue('list=random' not in requests[0])
+        self.assertEqual([x.data['title'] for x in pages], ['A', 'BB', 'CCC'])
+        self.assertEqual([x.data['extext'] for x in pages],
+                         ['**A**', '**BB**', '**CCC**'])
+        self.assertEqual(pages[1].data['wikibase'], 'Q2')
+        self.assertEqual(pages[2].data['label'], 'CCC')
+        self.assertTrue(pages[2].data['url'].endswith('/CCC'))
+        self.assertTrue('gcmcontinue' in pages[2].cache['query']['query'])
+
     def test_category_query(self):
         cat = wptools.category('TEST')
         qobj = wptools.query.WPToolsQuery()
         self.assertEqual(cat._query('random', qobj),
                          ('https://en.wikipedia.org/w/api.php?'
                           'action=query&format=json&formatversion=2'
-                          '&list=random&rnlimit=1&rnnamespace=14'))
+                          '&maxlag=5&list=random&rnlimit=1&rnnamespace=14'))
         self.assertEqual(cat._query('category', qobj),
                          ('https://en.wikipedia.org/w/api.php?'
                           'action=query&format=json&formatversion=2'
-                          '&list=categorymembers&cmlimit=500&cmtitle=TEST'))
+                          '&maxlag=5&list=categorymembers&cmlimit=500'
+                          '&cmtitle=TEST'))
 
 
 class WPToolsCoreTestCase(unittest.TestCase):
@@ -154,6 +690,47 @@ class WPToolsCoreTestCase(unittest.TestCase):
         self.assertTrue(isinstance(wptools.core.safestr(u'ü'), str))
 
 
+class WPToolsMetricsTestCase(unittest.TestCase):
+
+    def test_metrics_histogram(self):
+        hist = wptools.metrics.Histogram()
+        for i in range(1, 101):
+            hist.add(i / 100.0)
+        summary = hist.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['max'], 1.0)
+        self.assertAlmostEqual(summary['p50'], 0.5, delta=0.03)
+        self.assertAlmostEqual(summary['p95'], 0.95, delta=0.05)
+        self.assertAlmostEqual(summary['p99'], 0.99, delta=0.05)
+        self.assertEqual(wptools.metrics.Histogram().percentile(50), None)
+
+    def test_metrics_record(self):
+        metrics = wptools.metrics.Metrics()
+        timing = {'dns': 0.01, 'connect': 0.02, 'tls': 0.03,
+                  'ttfb': 0.2, 'transfer': 0.04, 'total': 0.3}
+        url = 'https://en.wikipedia.org/w/api.php?action=parse'
+        metrics.record({'url': url, 'status': 200, 'bytes': 100,
+                        'decoded': 400, 'timing': timing},
+                       'en.wikipedia.org (parse) Test')
+        metrics.record({'url': url, 'status': 503, 'bytes': 10},
+                       'en.wikipedia.org (parse) Test')
+        metrics.record({'url': url, 'cache': 'hit'}, 'TEST')
+
+        stats = metrics.summary()
+        parse = stats['action']['parse']
+        self.assertEqual(parse['requests'], 2)
+        self.assertEqual(parse['errors'], 1)
+        self.assertEqual(parse['bytes'], 110)
+        self.assertEqual(parse['decoded'], 400)
+        self.assertEqual(parse['ttfb']['count'], 1)
+        self.assertAlmostEqual(parse['ttfb']['p99'], 0.2)
+        self.assertEqual(stats['action']['other']['cached'], 1)
+        self.assertEqual(stats['host']['en.wikipedia.org']['requests'], 2)
+
+        metrics.clear()
+        self.assertEqual(metrics.summary(), {'action': {}, 'host': {}})
+
+
 class WPToolsPageTestCase(unittest.TestCase):
 
     def test_core_init(self):
@@ -207,6 +784,23 @@ class WPToolsPageTestCase(unittest.TestCase):
 
         self.assertEqual(len(page.data), 0)
 
+    def test_page_plan(self):
+        page = wptools.page('TEST', silent=True)
+        self.assertRaises(ValueError, page.plan, ['TEST'])
+        self.assertEqual(list(page.plan(['infobox', 'wikibase']).items()),
+                         [('parse', None)])
+        self.assertEqual(list(page.plan(['label', 'length']).items()),
+                         [('query', ['info', 'pageterms'])])
+        self.assertEqual(list(page.plan(['aliases', 'views'])),
+                         ['query', 'wikidata', 'querymore'])
+        self.assertEqual(page.plan(['aliases'])['query'], ['pageprops'])
+        self.assertEqual(list(page.plan(['what'])),
+                         ['query', 'wikidata', 'claims'])
+        page = wptools.page(wikibase='Q42', silent=True)
+        self.assertEqual(list(page.plan(['title', 'label'])), ['wikidata'])
+        self.assertEqual(list(page.plan(['title', 'length'])),
+                         ['wikidata', 'query'])
+
     def test_page_query(self):
         page = wptools.page('TEST')
 
@@ -255,6 +849,72 @@ class WPToolsPageTestCase(unittest.TestCase):
         page.cache = cache
         page.get()
 
+    def test_page_get_graph(self):
+        fixtures = {'claims': claims.cache,
+                    'parse': parse.cache,
+                    'query': query.cache,
+                    'wikidata': wikidata.cache}
+
+        with file_wiki(wptools.page, fixtures) as (FilePage, _):
+            page = FilePage('TEST', skip=['imageinfo', 'restbase'],
+                            silent=True)
+            page.get()
+
+        self.assertEqual(sorted(page.cache),
+                         ['claims', 'imageinfo', 'parse', 'query',
+                          'restbase', 'wikidata'])
+        self.assertEqual(page.data['wikibase'], 'Q42')
+        self.assertEqual(str(page.data['what']), 'human')
+
+        # same data as capturing responses one after another
+        serial = wptools.page('TEST', skip=['imageinfo'], silent=True)
+        serial.cache = dict(fixtures)
+        for action in ['query', 'parse', 'wikidata', 'claims']:
+            serial._set_data(action)
+        self.assertEqual(page.data, serial.data)
+
+    def test_page_get_graph_failed(self):
+        page = wptools.page('TEST', parse='bogus', skip=['imageinfo'],
+                            silent=True)
+        self.assertRaises(ValueError, page.get, False)  # after query added
+        self.assertEqual(wptools.request.FLIGHTS.stats()['active'], 0)
+
+    def test_page_get_fields(self):
+        with file_wiki(wptools.page, {'query': query.cache}) as (cls, _):
+            class FilePage(cls):
+                props = None
+
+                def _query(self, action, qobj):
+                    self.props = self.params.get('query_props')
+                    return super(FilePage, self)._query(action, qobj)
+
+            page = FilePage('TEST', skip=['imageinfo'], silent=True)
+            page.get(False, fields=['extract', 'wikibase'])
+
+        self.assertEqual(list(page.planned), ['query'])
+        self.assertEqual(page.props, ['extracts', 'pageprops'])
+        self.assertEqual(list(page.cache), ['query'])
+        self.assertEqual(page.data['wikibase'], 'Q42')
+        self.assertTrue('query_props' not in page.params)
+
+    def test_page_get_claims_cached(self):
+        page = wptools.page('TEST', skip=['imageinfo'], silent=True)
+        page.LABEL_CACHE = wptools.cache.LRUCache(maxsize=20)
+        page.cache = {'claims': claims.cache, 'wikidata': wikidata.cache}
+        page._set_data('wikidata')
+        page._set_data('claims')
+        self.assertEqual(len(page.LABEL_CACHE), 11)
+        self.assertEqual(page.LABEL_CACHE.stats()['misses'], 11)
+
+        # labels now come from cache, without a claims request
+        other = wptools.page('TEST', skip=['imageinfo'], silent=True)
+        other.LABEL_CACHE = page.LABEL_CACHE
+        other.cache = {'wikidata': wikidata.cache}
+        other._set_data('wikidata')
+        self.assertTrue('claims' not in other.cache)
+        self.assertEqual(other.data['wikidata'], page.data['wikidata'])
+        self.assertEqual(other.LABEL_CACHE.stats()['hits'], 11)
+
     def test_page_get_parse(self):
         page = wptools.page('TEST', skip=['imageinfo'], silent=True)
         page.cache = {'parse': parse.cache}
@@ -272,6 +932,27 @@ class WPToolsPageTestCase(unittest.TestCase):
         self.assertEqual(str(data['image'][0]['file']),
                          'Douglas adams portrait cropped.jpg')
 
+    def test_page_get_parse_lean(self):
+        from tests import mockwiki
+        server = mockwiki.MockWiki().start()
+        try:
+            full = wptools.page('TEST', skip=['imageinfo'], silent=True,
+                                scheme=mockwiki.SCHEME)
+            full.get_parse(False, server.proxy)
+            lean = wptools.page('TEST', parse='lean', skip=['imageinfo'],
+                                silent=True, scheme=mockwiki.SCHEME)
+            lean.get_parse(False, server.proxy)
+            batch = wptools.batch.pages(['Douglas Adams'], server.proxy,
+                                        silent=True, scheme=mockwiki.SCHEME)
+        finally:
+            server.stop()
+
+        self.assertEqual(lean.data, full.data)
+        self.assertTrue('&prop=iwlinks|' in lean.cache['parse']['query'])
+        self.assertTrue(lean.info('parse')['bytes']
+                        < full.info('parse')['bytes'] / 2)
+        self.assertEqual(batch[0].params['parse'], 'lean')
+
     def test_page_get_query(self):
         page = wptools.page('TEST', skip=['imageinfo'], silent=True)
         page.cache = {'query': query.cache}
@@ -440,6 +1121,16 @@ class WPToolsQueryTestCase(unittest.TestCase):
         self.assertTrue('&pageids=123' in qstr)
         self.assertEqual(qobj.status, 'en.wikipedia.org (query) 123')
 
+        qstr = qobj.query('TEST', props=['extracts', 'pageprops'])
+        self.assertTrue('&prop=extracts|pageprops&' in qstr)
+        self.assertTrue('&exintro' in qstr)
+        self.assertTrue('&ppprop=' in qstr)
+        self.assertTrue('pithumbsize' not in qstr)
+        self.assertTrue('list=random' not in qstr)
+
+        qstr = qobj.query('TEST', props=[])
+        self.assertTrue('prop=' not in qstr)
+
     def test_query_parse(self):
         qobj = wptools.query.WPToolsQuery()
 
@@ -456,6 +1147,18 @@ class WPToolsQueryTestCase(unittest.TestCase):
         self.assertTrue('&pageid=123' in qstr)
         self.assertEqual(qobj.status, 'en.wikipedia.org (parse) 123')
 
+    def test_query_parse_profile(self):
+        qobj = wptools.query.WPToolsQuery()
+        self.assertRaises(ValueError, qobj.parse, 'TEST', profile='TEST')
+        full = qobj.parse('TEST', profile='full')
+        self.assertEqual(full, qobj.parse('TEST'))
+        lean = qobj.parse('TEST', profile='lean')
+        self.assertTrue('&prop=iwlinks|parsetree|wikitext|properties' in lean)
+        self.assertTrue('&section' not in lean)
+        lead = qobj.parse('TEST', profile='lead')
+        self.assertTrue(lead.startswith(lean))
+        self.assertTrue(lead.endswith('&section=0'))
+
     def test_query_random(self):
         qobj = wptools.query.WPToolsQuery()
         qstr = qobj.random()
@@ -487,6 +1190,15 @@ class WPToolsQueryTestCase(unittest.TestCase):
         uri = qobj.wiki_uri(wiki='http://example.com/')
         self.assertEqual(uri, 'http://example.com/')
 
+    def test_query_scheme(self):
+        qobj = wptools.query.WPToolsQuery(wiki='http://example.com')
+        self.assertTrue(qobj.query('TEST').startswith('http://example.com'))
+        self.assertTrue(qobj.wikidata('TEST').startswith('https://www.'))
+
+        qobj = wptools.query.WPToolsQuery(scheme='http')
+        self.assertTrue(qobj.query('TEST').startswith('http://en.'))
+        self.assertTrue(qobj.claims(['Q1']).startswith('http://www.'))
+
     def test_query_wikidata(self):
         qobj = wptools.query.WPToolsQuery()
 
@@ -615,12 +1327,364 @@ class WPToolsRequestTestCase(unittest.TestCase):
         info = req.cobj.getinfo(wptools.request.pycurl.RESPONSE_CODE)
         self.assertEqual(info, 0)
 
+    def test_request_encoding(self):
+        body = json.dumps({'parse': {'text': 'x' * 10000}}).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = body
+                self.send_response(200)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    data = zlib.compress(body)
+                    self.send_header('Content-Encoding', 'deflate')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = http_server(Handler)
+        url = 'http://127.0.0.1:%d/w/api.php' % server.server_port
+
+        metrics = wptools.metrics.Metrics()
+        req = wptools.request.WPToolsRequest(silent=True, metrics=metrics)
+        self.assertEqual(req.get(url, 'TEST'), body)
+        self.assertEqual(req.info['encoding'], 'deflate')
+        self.assertEqual(req.info['decoded'], len(body))
+        self.assertTrue(req.info['bytes'] < req.info['decoded'])
+
+        timing = req.info['timing']
+        self.assertEqual(set(timing), set(wptools.metrics.PHASES))
+        self.assertTrue(timing['total'] >= timing['ttfb'] > 0)
+        self.assertEqual(metrics.summary()['action']['other']['decoded'],
+                         len(body))
+
+        server.shutdown()
+        server.server_close()
+
+    def test_request_flights(self):
+        hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                time.sleep(0.2)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+        server = http_server(Handler)
+        url = 'http://127.0.0.1:%d/w/api.php?b=2&a=1' % server.server_port
+        same = 'http://127.0.0.1:%d/w/api.php?a=1&b=2' % server.server_port
+
+        flights = wptools.request.Flights()
+        infos = []
+
+        def get(url):
+            req = wptools.request.WPToolsRequest(silent=True, flights=flights)
+            self.assertEqual(req.get(url, 'TEST'), b'{}')
+            infos.append(req.info)
+
+        threads = [threading.Thread(target=get, args=(x,))
+                   for x in (url, same, url)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(len([x for x in infos if x.get('coalesced')]), 2)
+        self.assertEqual(flights.stats(), {'active': 0, 'coalesced': 2,
+                                           'flights': 1})
+
+        req = wptools.request.WPToolsRequest(silent=True, flights=flights)
+        results = req.get_many([url, same])
+        self.assertEqual([x[0] for x in results], [b'{}', b'{}'])
+        self.assertTrue(results[1][1]['coalesced'])
+        self.assertEqual(len(hits), 2)
+
+        server.shutdown()
+        server.server_close()
+
+    def test_request_get_many(self):
+        req = wptools.request.WPToolsRequest(silent=True)
+
+        with tempfile.NamedTemporaryFile() as tmp1, \
+                tempfile.NamedTemporaryFile() as tmp2:
+            tmp1.write(b'ONE')
+            tmp1.flush()
+            tmp2.write(b'TWO')
+            tmp2.flush()
+            urls = ['file://' + tmp1.name,
+                    'file://' + tmp2.name,
+                    'file:///NONEXISTENT']
+            results = req.get_many(urls, maxconn=2)
+
+        self.assertEqual([x[0] for x in results], [b'ONE', b'TWO', None])
+        self.assertTrue(results[0][1]['url'].endswith(tmp1.name))
+        self.assertTrue('error' not in results[1][1])
+        self.assertTrue('error' in results[2][1])
+
+        # callbacks may queue dependent transfers
+        bodies = []
+        multi = wptools.request.WPToolsMulti(req)
+        multi.add('file:///NONEXISTENT',
+                  callback=lambda body, info: multi.add(
+                      'file:///NONEXISTENT',
+                      callback=lambda body, info: bodies.append(body)))
+        multi.run()
+        self.assertEqual(bodies, [None])
+
+    def test_request_pool(self):
+        pool = wptools.request.CurlPool(maxidle=1)
+
+        key = pool.key('https://en.wikipedia.org/w/api.php', 'PROXY', 5)
+        self.assertEqual(key, ('https://en.wikipedia.org', 'PROXY', 5, False))
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as tmp:
+            tmp.write(b'{}')
+            tmp.flush()
+            req = wptools.request.WPToolsRequest(silent=True, pool=pool)
+            self.assertEqual(req.get('file://' + tmp.name, 'TEST'), b'{}')
+            self.assertEqual(req.get('file://' + tmp.name, 'TEST'), b'{}')
+
+        stats = pool.stats()
+        self.assertEqual(stats['borrowed'], 2)
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+        pool.clear()
+        self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_request_disk_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        disk = wptools.cache.SQLiteCache(os.path.join(tmpdir, 'db'))
+        fname = os.path.join(tmpdir, 'response')
+        with open(fname, 'wb') as fh:
+            fh.write(b'{}')
+
+        req = wptools.request.WPToolsRequest(silent=True, disk=disk)
+        self.assertEqual(req.get('file://' + fname, 'TEST'), b'{}')
+        self.assertTrue('cache' not in req.info)
+
+        os.remove(fname)
+        self.assertEqual(req.get('file://' + fname, 'TEST'), b'{}')
+        self.assertEqual(req.info['cache'], 'hit')
+        results = req.get_many(['file://' + fname])
+        self.assertEqual(results[0][0], b'{}')
+
+        disk.offline = True
+        self.assertRaises(LookupError, req.get, 'file:///MISSING', 'TEST')
+        disk.close()
+        shutil.rmtree(tmpdir)
+
+    def test_request_headers(self):
+        raw = (b'HTTP/1.1 301 Moved\r\nLocation: /x\r\n\r\n'
+               b'HTTP/1.1 200 OK\r\nETag: "v1"\r\n'
+               b'Last-Modified: Mon, 01 Jan 2018 00:00:00 GMT\r\n\r\n')
+        headers = wptools.request.curl_headers(raw)
+        self.assertEqual(headers, {
+            'etag': '"v1"',
+            'last-modified': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        self.assertEqual(
+            wptools.request.conditions({'info': {'headers': headers}}),
+            ['If-None-Match: "v1"',
+             'If-Modified-Since: Mon, 01 Jan 2018 00:00:00 GMT'])
+        self.assertEqual(wptools.request.conditions(None), [])
+
+    def test_request_revalidate(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+        server = http_server(Handler)
+        url = 'http://127.0.0.1:%d/page/summary/TEST' % server.server_port
+
+        tmpdir = tempfile.mkdtemp()
+        disk = wptools.cache.SQLiteCache(os.path.join(tmpdir, 'db'), ttl=-1)
+        req = wptools.request.WPToolsRequest(silent=True, disk=disk)
+
+        self.assertEqual(req.get(url, 'TEST'), b'{}')
+        self.assertEqual(req.info['headers']['etag'], '"v1"')
+
+        # stale entry is revalidated, not downloaded again
+        self.assertEqual(req.get(url, 'TEST'), b'{}')
+        self.assertEqual(req.info['status'], 304)
+        self.assertEqual(req.info['cache'], 'revalidated')
+        results = req.get_many([url])
+        self.assertEqual(results[0][0], b'{}')
+        self.assertEqual(results[0][1]['cache'], 'revalidated')
+
+        server.shutdown()
+        server.server_close()
+        disk.close()
+        shutil.rmtree(tmpdir)
+
+    def test_request_retry(self):
+        responses = [(429, b'{}'),
+                     (200, b'{"error": {"code": "maxlag", "lag": 1}}'),
+                     (200, b'{"query": {}}')]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = responses.pop(0)
+                self.send_response(status)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http_server(Handler)
+        url = 'http://127.0.0.1:%d/w/api.php' % server.server_port
+
+        scheduler = wptools.throttle.Scheduler()
+        req = wptools.request.WPToolsRequest(silent=True, scheduler=scheduler)
+        self.assertEqual(req.get(url, 'TEST'), b'{"query": {}}')
+
+        server.shutdown()
+        server.server_close()
+
+        stats = scheduler.stats()['127.0.0.1']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['throttled'], 2)
+        self.assertEqual(stats['active'], 0)
+
+    def test_request_maxlag(self):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.path)
+                body = b'{"query": {}}'
+                if len(requests) == 1 and 'maxlag=5' in self.path:
+                    body = b'{"error": {"code": "maxlag", "lag": 7}}'
+                self.send_response(200)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http_server(Handler)
+        qobj = wptools.query.WPToolsQuery(
+            wiki='http://127.0.0.1:%d' % server.server_port)
+
+        scheduler = wptools.throttle.Scheduler()
+        req = wptools.request.WPToolsRequest(silent=True, scheduler=scheduler)
+        self.assertEqual(req.get(qobj.query('TEST'), qobj.status),
+                         b'{"query": {}}')
+
+        server.shutdown()
+        server.server_close()
+
+        self.assertEqual(len(requests), 2)
+        stats = scheduler.stats()['127.0.0.1']
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['throttled'], 1)
+
     def test_request_user_agent(self):
         agent = wptools.request.user_agent()
         self.assertTrue(agent.startswith('wptools'))
         self.assertTrue('(https://github.com/siznax/wptools)' in agent)
 
 
+class WPToolsReservoirTestCase(unittest.TestCase):
+
+    def test_reservoir(self):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            rnlimit random titles, or API error for namespace 99
+            """
+            def do_GET(self):
+                requests.append(self.path)
+                limit = int(self.path.split('rnlimit=')[1].split('&')[0])
+                first = len(requests) * 100
+                data = {'query': {'random': [
+                    {'id': x, 'ns': 0, 'title': "Page %d" % x}
+                    for x in range(first, first + limit)]}}
+                if 'rnnamespace=99' in self.path:
+                    data = {'error': {'code': 'badvalue'}}
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = http_server(Handler)
+        wiki = "http://127.0.0.1:%d" % server.server_port
+        try:
+            res = wptools.reservoir.Reservoir(wiki=wiki, limit=10, low=3)
+            titles = [res.get()['title'] for _ in range(8)]
+            self.assertEqual(titles[0], 'Page 100')
+            res.wait()  # refilled below low (3)
+            self.assertEqual(len(res), 12)
+            self.assertEqual(len(requests), 2)
+            self.assertTrue('rnlimit=10&rnnamespace=0' in requests[0])
+
+            bad = wptools.reservoir.Reservoir(wiki=wiki, namespace=99)
+            self.assertRaises(LookupError, bad.get)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_reservoir_empty(self):
+        fetched = []
+
+        class EmptyReservoir(wptools.reservoir.Reservoir):
+            def _fetch(self):
+                fetched.append(1)
+                return []
+
+        res = EmptyReservoir(namespace=99)
+        self.assertRaises(LookupError, res.get)
+        self.assertEqual(len(fetched), 1)
+
+    def test_reservoir_shared(self):
+        from tests import mockwiki
+        server = mockwiki.MockWiki().start()
+        try:
+            shared = wptools.reservoir.shared(scheme=mockwiki.SCHEME,
+                                              proxy=server.proxy)
+            self.assertTrue(wptools.reservoir.shared(
+                'en', scheme=mockwiki.SCHEME, proxy=server.proxy) is shared)
+            self.assertFalse(wptools.reservoir.shared(
+                proxy=server.proxy) is shared)  # https
+            self.assertFalse(wptools.reservoir.shared(
+                scheme=mockwiki.SCHEME) is shared)
+            self.assertFalse(wptools.reservoir.shared(
+                scheme=mockwiki.SCHEME, proxy=server.proxy,
+                variant='en-gb') is shared)
+
+            page = wptools.page('TEST', reservoir=True, silent=True,
+                                scheme=mockwiki.SCHEME)
+            page.get_random(False, server.proxy)
+            self.assertEqual(page.params['title'], '1990 NBL Finals')
+            self.assertEqual(page.params['pageid'], 45564415)
+            self.assertTrue('random' not in page.cache)
+
+            pages = wptools.reservoir.Reservoir(scheme=mockwiki.SCHEME,
+                                                pages=wptools.page, low=0,
+                                                proxy=server.proxy)
+            page = pages.get()
+            self.assertTrue(isinstance(page, wptools.page))
+            self.assertEqual(page.data['title'], 'Douglas Adams')
+            self.assertEqual(page.data['wikibase'], 'Q42')
+            self.assertTrue('generator=random&grnlimit=20'
+                            in page.cache['query']['query'])
+        finally:
+            wptools.reservoir.RESERVOIRS.clear()
+            server.stop()
+
+
 class WPToolsSiteTestCase(unittest.TestCase):
 
     def test_site_init(self):
@@ -662,6 +1726,83 @@ class WPToolsSiteTestCase(unittest.TestCase):
         data = site.data
         self.assertEqual(len(data['sites']), 290)
 
+    def test_site_matrix(self):
+        from wptools.site import SiteMatrix
+
+        matrix = json.loads(sitematrix.response)['sitematrix']
+        sites = SiteMatrix(matrix)
+        self.assertEqual(len(sites), 741)
+        self.assertEqual(len(sites.urls('wikipedia.org')), 290)
+        self.assertEqual(len(sites.urls('wikipedia')), 290)
+        self.assertEqual(sites.find('enwiki')['url'],
+                         'https://en.wikipedia.org')
+        self.assertEqual(sites.find('https://fr.wiktionary.org/wiki/X'),
+                         sites.dbnames['frwiktionary'])
+        self.assertTrue('https://en.wiktionary.org' in
+                        [x['url'] for x in sites.langs['en']])
+        self.assertTrue('en.wikipedia.org' in sites)
+        self.assertTrue('commons.wikimedia.org' in sites)
+        self.assertFalse('xx.wikipedia.org' in sites)
+
+        # closed
+        self.assertFalse('aa.wikipedia.org' in sites)
+        self.assertEqual(sites.find('aawiki'), None)
+
+        try:
+            wptools.query.WPToolsQuery.SITES = sites
+            self.assertRaises(ValueError, wptools.query.WPToolsQuery,
+                              lang='xx')
+            self.assertRaises(ValueError, wptools.query.WPToolsQuery,
+                              lang='aa')
+            page = wptools.page('TEST', lang='xx', silent=True)
+            self.assertRaises(ValueError, page.get_query)
+            qobj = wptools.query.WPToolsQuery(lang='fr')
+            self.assertEqual(qobj.domain, 'fr.wikipedia.org')
+        finally:
+            wptools.query.WPToolsQuery.SITES = None
+
+    def test_site_sitematrix(self):
+        from tests import mockwiki
+
+        module = importlib.import_module('wptools.site')
+        tmpdir = tempfile.mkdtemp()
+        server = mockwiki.MockWiki().start()
+        disk = wptools.cache.DISK
+        try:
+            wptools.cache.DISK = wptools.cache.DirCache(tmpdir)
+
+            sites = module.sitematrix(server.proxy, refresh=True,
+                                      scheme=mockwiki.SCHEME)
+            self.assertEqual(len(sites), 741)
+            self.assertTrue(module.sitematrix() is sites)
+
+            # parsed again from disk, fresh for MATRIX_TTL
+            again = module.sitematrix(server.proxy, refresh=True,
+                                      scheme=mockwiki.SCHEME)
+            self.assertEqual(len(again), 741)
+            self.assertEqual(server.stats()['requests'], 1)
+
+            qstr = wptools.query.WPToolsQuery(
+                wiki=module.WPToolsSite.COMMONS,
+                scheme=mockwiki.SCHEME).site('sitematrix')
+            entry = wptools.cache.DISK.get(qstr)
+            self.assertTrue(entry['expires'] > time.time() + 86400)
+
+            # shared by sites, cached as usual
+            site = wptools.site(silent=True)
+            site.get_sites(domain='wikipedia.org')
+            self.assertEqual(len(site.data['sites']), 290)
+            self.assertEqual(site.query('sitematrix'),
+                             qstr.replace('&format=json', ''))
+            self.assertTrue('sitematrix' in site.response('sitematrix'))
+            self.assertEqual(site.info('sitematrix')['cache'], 'hit')
+            self.assertEqual(server.stats()['requests'], 1)
+        finally:
+            wptools.cache.DISK = disk
+            module.MATRIX = None
+            server.stop()
+            shutil.rmtree(tmpdir)
+
     def test_site_get_siteinfo(self):
         site = wptools.site(silent=True)
         site.cache = {'siteinfo': siteinfo.cache,
@@ -713,6 +1854,44 @@ class WPToolsWikidataTestCase(unittest.TestCase):
                          'comic science fiction')
         self.assertTrue('Mostly Harmless' in data['wikidata']['work'])
 
+    def test_wikidata_get_claims_chunks(self):
+        qids = ['Q%d' % x for x in range(120)]
+
+        with file_wiki(wptools.wikidata) as (_, tmpdir):
+            class FileWikidata(wptools.wikidata):
+                LABEL_CACHE = wptools.cache.LRUCache()
+
+                def _claims_queries(self, qobj):
+                    for qid in qids[:10]:  # labelled meanwhile
+                        self.LABEL_CACHE.set((qid, 'en'), qid)
+                    queries = []
+                    chunks = super(FileWikidata, self)._claims_queries(qobj)
+                    for i, (qstr, status) in enumerate(chunks):
+                        ids = qstr.split('&ids=')[1].split('|')
+                        entities = dict(
+                            (x, {'labels': {'en': {'value': x}}})
+                            for x in ids)
+                        fname = os.path.join(tmpdir, str(i))
+                        with open(fname, 'w') as fh:
+                            fh.write(json.dumps({'entities': entities}))
+                        queries.append(('file://' + fname, status))
+                    return queries
+
+            page = FileWikidata(silent=True)
+            page.data = {'claims': dict((x, 'work') for x in qids),
+                         'wikidata': {}}
+            page.get_claims(show=False)
+
+        self.assertEqual(page.info('claims')['chunks'], 3)
+        queries = page.cache['claims']['queries']
+        self.assertEqual([len(x.split('&ids=')[1].split('|'))
+                          for x in queries], [50, 50, 20])
+        self.assertEqual(sum([x.split('&ids=')[1].split('|')
+                              for x in queries], []), qids)
+        self.assertEqual(page.cache['claims']['query'], queries[0])
+        self.assertEqual(page.data['wikidata']['work'], qids)
+        self.assertEqual(len(page.LABEL_CACHE), 120)
+
     def test_wikidata_get_wikidata(self):
         page = wptools.wikidata(silent=True)
         page.cache['wikidata'] = wikidata.cache
@@ -742,14 +1921,164 @@ class WPToolsWikidataTestCase(unittest.TestCase):
         self.assertEqual(str(page.params['title']), 'Douglas_Adams')
 
 
+class WPToolsThrottleTestCase(unittest.TestCase):
+
+    def test_throttle_bucket(self):
+        bucket = wptools.throttle.TokenBucket(2, burst=2)
+        now = bucket.stamp
+        self.assertEqual(bucket.take(now), 0)
+        self.assertEqual(bucket.take(now), 0)
+        self.assertEqual(bucket.take(now), 0.5)
+        self.assertEqual(bucket.take(now + 0.5), 0)
+
+    def test_throttle_backoff(self):
+        backoff = wptools.throttle.backoff
+        self.assertEqual(backoff({'status': 200}, b'{}'), None)
+        self.assertEqual(backoff({'status': 429}), 1.0)
+        self.assertEqual(backoff({'status': 503}, attempt=2), 4.0)
+        self.assertEqual(backoff({'status': 429,
+                                  'headers': {'retry-after': '7'}}), 7.0)
+        body = b'{"error": {"code": "maxlag", "info": "Waiting"}}'
+        self.assertEqual(backoff({'status': 200}, body), 1.0)
+        self.assertEqual(wptools.throttle.retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+    def test_throttle_scheduler(self):
+        sched = wptools.throttle.Scheduler(rates={'wikipedia.org': 1000},
+                                           startconn=2)
+        url = 'https://en.wikipedia.org/w/api.php'
+        self.assertEqual(sched.admit('file:///TEST'), 0)
+        self.assertEqual(sched.admit(url), 0)
+        self.assertEqual(sched.admit(url), 0)
+        self.assertTrue(sched.admit(url) > 0)  # at concurrency limit
+
+        # additive increase
+        sched.done(url, {'status': 200, 'seconds': '0.100'})
+        self.assertEqual(sched.stats()['en.wikipedia.org']['limit'], 2.5)
+
+        # multiplicative decrease, and blocked for Retry-After
+        delay = sched.done(url, {'status': 429,
+                                 'headers': {'retry-after': '30'}})
+        self.assertEqual(delay, 30)
+        stats = sched.stats()['en.wikipedia.org']
+        self.assertEqual(stats['limit'], 1.25)
+        self.assertEqual(stats['active'], 0)
+        self.assertTrue(sched.admit(url) > 29)
+
+
+class WPToolsTracingTestCase(unittest.TestCase):
+
+    def test_tracing_hooks(self):
+        tracer = wptools.tracing.Tracer()
+        with tracer.span('decode', 'parse') as event:
+            self.assertEqual(event, None)  # no hooks
+
+        events = []
+        tracer.register(events.append)
+        with tracer.span('decode', 'parse', 'TEST', 10) as event:
+            event['bytes'] = 20
+        tracer.stop('request', 0.5, 'parse', 'TEST', 30)
+        tracer.unregister(events.append)
+        tracer.stop('request', 0.5)
+
+        self.assertEqual([(x['stage'], x['phase']) for x in events],
+                         [('decode', 'start'), ('decode', 'stop'),
+                          ('request', 'stop')])
+        self.assertEqual(events[1]['bytes'], 20)
+        self.assertTrue(events[1]['duration'] >= 0)
+        self.assertEqual(events[2]['duration'], 0.5)
+
+    def test_tracing_chrome(self):
+        with file_wiki(wptools.page, {'query': query.cache}) as (
+                FilePage, tmpdir):
+            path = os.path.join(tmpdir, 'trace.json')
+            with wptools.tracing.ChromeTrace(path):
+                FilePage('TEST', skip=['imageinfo'], silent=True).get_query()
+
+            with open(path) as fh:
+                events = json.load(fh)['traceEvents']
+
+        names = [x['name'] for x in events]
+        for stage in ('query', 'request', 'decode', 'marshal'):
+            self.assertTrue("%s (query)" % stage in names)
+        request = events[names.index('request (query)')]
+        self.assertEqual(request['ph'], 'X')
+        self.assertEqual(request['args']['title'], 'TEST')
+        self.assertEqual(request['args']['bytes'],
+                         len(query.cache['response'].encode('utf-8')))
+        self.assertEqual(wptools.tracing.TRACER.hooks, [])
+
+
 class WPToolsToolTestCase(unittest.TestCase):
 
+    def test_bench(self):
+        from tests import bench
+        results = bench.run(mintime=0, repeat=1)
+        self.assertEqual(list(results), list(bench.CASES))
+        self.assertTrue(all(x['ops'] > 0 for x in results.values()))
+
+        baseline = {'cases': {'query': {'ops': results['query']['ops'] * 2,
+                                        'peak': None}}}
+        regressions = bench.compare(results, baseline)
+        self.assertEqual(list(regressions), ['query'])
+
+        # no baseline, nothing compared
+        missing = os.path.join(tempfile.gettempdir(), 'MISSING.json')
+        self.assertEqual(bench.main(['query', '-m', '0', '-b', missing]), 0)
+
+    def test_load(self):
+        from tests import load, mockwiki
+        server = mockwiki.MockWiki().start()
+        try:
+            result = load.run(server.proxy, pages=4, concurrency=2,
+                              paced=False, skip=['imageinfo'])
+        finally:
+            server.stop()
+        self.assertEqual(result['pages'], 4)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(result['latency']['count'], 4)
+        self.assertEqual(result['requests']['action']['parse']['requests'],
+                         4)
+
+    def test_mockwiki(self):
+        from tests import mockwiki
+        route = mockwiki.route
+        self.assertEqual(route(parse.query), 'parse')
+        qobj = wptools.query.WPToolsQuery()
+        self.assertEqual(route(qobj.query('TEST')), 'query')
+        self.assertEqual(route(qobj.querymore('TEST')), 'querymore')
+        self.assertEqual(route(qobj.category('TEST')), 'category')
+        self.assertEqual(route(imageinfo.query), 'imageinfo')
+        self.assertEqual(route(claims.query), 'claims')
+        self.assertEqual(route(wikidata.query), 'wikidata')
+        self.assertEqual(route(rest_html.query), 'rest_html')
+        self.assertEqual(route(rest_summary.query), 'rest_summary')
+        self.assertEqual(route('http://en.wikipedia.org/TEST'), None)
+
+        server = mockwiki.MockWiki(errors=1.0).start()
+        req = wptools.request.WPToolsRequest(silent=True, proxy=server.proxy)
+        req.scheduler = None  # no retries
+        req.get('http://en.wikipedia.org/w/api.php?action=parse', 'TEST')
+        self.assertEqual(req.info['status'], 503)
+        server.stop()
+
+        server = mockwiki.MockWiki(rate=1).start()
+        req.proxy = server.proxy
+        req.get('http://en.wikipedia.org/w/api.php?action=parse', 'TEST')
+        self.assertEqual(req.info['status'], 200)
+        req.get('http://en.wikipedia.org/w/api.php?action=parse', 'TEST')
+        self.assertEqual(req.info['status'], 429)
+        self.assertEqual(req.info['headers']['retry-after'], '1')
+        self.assertEqual(server.stats()['throttled'], 1)
+        server.stop()
+
     def test_wptool(self):
         from scripts.wptool import main
         from collections import namedtuple
-        args = namedtuple('Args', ['H', 'l', 'n', 'q', 's', 't', 'v', 'w'])
-        cli = {'H': False, 'l': 'en', 'n': False, 'q': True, 's': True,
-               't': '', 'v': False, 'w': ''}
+        args = namedtuple('Args', ['H', 'i', 'l', 'n', 'q', 's', 't', 'v',
+                                   'w'])
+        cli = {'H': False, 'i': False, 'l': 'en', 'n': False, 'q': True,
+               's': True, 't': '', 'v': False, 'w': ''}
         main(args(**cli))
 
 
@@ -7,6 +7,8 @@ Wikipedia tools (for Humans)
 Python and command-line MediaWiki access for Humans
 
 - get page extracts, image, Infobox data, Wikidata, and more
+- get many pages in batches
+- get pages concurrently with asyncio
 - get a random page, category, or site
 - get page statistics
 - get category members
@@ -20,14 +22,28 @@ __license__ = "MIT"
 __title__ = "wptools"
 __version__ = "0.4"
 
+from . import batch
+from . import cache
 from . import core
+from . import metrics
 from . import query
 from . import request
+from . import reservoir
 from . import site
+from . import throttle
+from . import tracing
 from . import utils
 
+from .batch import pages
 from .category import WPToolsCategory as category
 from .page import WPToolsPage as page
 from .restbase import WPToolsRESTBase as restbase
 from .site import WPToolsSite as site
 from .wikidata import WPToolsWikidata as wikidata
+
+try:  # python3.5+
+    from . import aio
+except (ImportError, SyntaxError):  # python2
+    aio = None
+
+core.AIO = aio
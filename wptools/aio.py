@@ -0,0 +1,446 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Asyncio module
+~~~~~~~~~~~~~~~~~~~~~~
+
+Awaitable counterparts of get methods (python 3.5+), e.g.
+
+    >>> page = await wptools.page('Gandhi').aget()
+    >>> page = await wptools.page('Gandhi').aget_parse()
+
+    >>> async for page in wptools.aio.pages(['Gandhi', 'Napoleon']):
+    ...     print(page.data['title'])
+
+Transfers of all coroutines on an event loop share one CurlMulti per
+request settings, driven by the loop (socket and timer callbacks), so
+many requests overlap in one thread. Responses are captured by the
+usual _set_data() methods.
+
+Takes from a reservoir (aget_random with the reservoir flag) and the
+process-wide sitematrix (site.aget_sites) may block, so they run in
+the loop's default executor instead (see call()).
+"""
+
+# coroutines here are the async halves of WPTools methods
+# pylint: disable=protected-access
+
+import asyncio
+import contextlib
+import weakref
+
+import pycurl
+
+from . import request
+from . import utils
+
+from .page import WPToolsPage
+
+MAXCONN = 32
+MAXPAGES = 100
+
+# AsyncMulti transports by event loop and request settings (dropped
+# by transport() once their loop is closed, as each refers to its loop)
+TRANSPORTS = weakref.WeakKeyDictionary()
+
+
+class AsyncMulti(request.WPToolsMulti):
+    """
+    WPToolsMulti driven by an asyncio event loop
+
+    Exceptions raised by a transfer callback are set on the future that
+    owned the transfer when it was added (see owned()).
+    """
+
+    fds = None
+    loop = None
+    owner = None
+    scheduled = False
+    timer = None
+    waker = None
+
+    def __init__(self, req, maxconn=MAXCONN, loop=None):
+        """
+        Returns an AsyncMulti object.
+
+        Arguments:
+        - req: <WPToolsRequest> request (settings, pool) to use
+        - [maxconn]: <int> maximum concurrent transfers
+        - [loop]: <asyncio loop> (default=current event loop)
+        """
+        super(AsyncMulti, self).__init__(req, maxconn)
+        self.loop = loop or asyncio.get_event_loop()
+        self.fds = {}
+        self.cmulti.setopt(pycurl.M_SOCKETFUNCTION, self._socket)
+        self.cmulti.setopt(pycurl.M_TIMERFUNCTION, self._timer)
+
+    def _action(self, sockfd, event):
+        """
+        let curl act on socket event (or timeout), then settle
+        """
+        while True:
+            ret, _ = self.cmulti.socket_action(sockfd, event)
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        self._pump()
+
+    def _pump(self):
+        """
+        call back finished transfers and start pending ones
+        """
+        self.scheduled = False
+        self._finish()
+        self._deliver()
+        self._start()
+
+        # pending transfers the scheduler holds back
+        if self.pending and self.wait and self.waker is None:
+            self.waker = self.loop.call_later(self.wait, self._wake)
+
+    def _schedule(self):
+        """
+        pump soon (once) on the loop
+        """
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self._pump)
+
+    def _socket(self, event, sockfd, *_):
+        """
+        (un)watch socket on the loop as curl asks
+        """
+        if sockfd in self.fds:
+            self.loop.remove_reader(sockfd)
+            self.loop.remove_writer(sockfd)
+
+        if event == pycurl.POLL_REMOVE:
+            self.fds.pop(sockfd, None)
+            return
+
+        self.fds[sockfd] = event
+        if event in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            self.loop.add_reader(sockfd, self._action, sockfd,
+                                 pycurl.CSELECT_IN)
+        if event in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            self.loop.add_writer(sockfd, self._action, sockfd,
+                                 pycurl.CSELECT_OUT)
+
+    def _timer(self, msecs):
+        """
+        (re)set curl timeout on the loop
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if msecs >= 0:
+            self.timer = self.loop.call_later(
+                msecs / 1000.0, self._action, pycurl.SOCKET_TIMEOUT, 0)
+
+    def _wake(self):
+        """
+        try to start held back transfers
+        """
+        self.waker = None
+        self._pump()
+
+    def add(self, url, status=None, callback=None):
+        """
+        queue GET url, callback(body, info) when finished
+        """
+        owner = self.owner
+
+        def guarded(body, info):
+            """
+            call back as owner, failing owner on exception
+            """
+            with self.owned(owner):
+                try:
+                    if callback:
+                        callback(body, info)
+                except Exception as exc:  # pylint: disable=broad-except
+                    if owner is None:
+                        raise
+                    if not owner.done():
+                        owner.set_exception(exc)
+
+        super(AsyncMulti, self).add(url, status, guarded)
+        self._schedule()
+
+    def fetch(self, url, status=None):
+        """
+        returns future (body, info) of GET url
+        """
+        future = self.loop.create_future()
+
+        def landed(body, info):
+            """
+            resolve future
+            """
+            request.curl_error(info)
+            if not future.done():
+                future.set_result((body, info))
+
+        with self.owned(future):
+            self.add(url, status, landed)
+
+        return future
+
+    def notify(self):
+        """
+        called (from any thread) when a followed request has landed
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._schedule)
+        except RuntimeError:  # loop closed
+            pass
+
+    @contextlib.contextmanager
+    def owned(self, future):
+        """
+        context in which added transfers are owned by future
+        """
+        previous, self.owner = self.owner, future
+        try:
+            yield future
+        finally:
+            self.owner = previous
+
+    def run(self):
+        """
+        not supported, transfers are driven by the event loop
+        """
+        raise RuntimeError("AsyncMulti runs on its event loop")
+
+
+class Pages(object):
+    """
+    Async iterator over pages with get() data for titles, yielded as
+    they complete, getting up to limit pages concurrently
+
+    Missing pages are left out.
+    """
+
+    done = None
+    kwargs = None
+    limit = MAXPAGES
+    proxy = None
+    tasks = None
+    timeout = 0
+    titles = None
+
+    def __init__(self, titles, limit=MAXPAGES, proxy=None, timeout=0,
+                 **kwargs):
+        """
+        Returns a Pages object.
+
+        Arguments:
+        - titles: <iterable> Mediawiki page titles
+        - [limit]: <int> maximum pages to get at once
+        - [proxy]: <str> use this HTTP proxy
+        - [timeout]: <int> timeout in seconds (0=wait forever)
+
+        Optional keyword {params} and {flags} are passed on to each
+        wptools.page, e.g. lang, silent, skip.
+        """
+        self.titles = iter(titles)
+        self.limit = limit
+        self.kwargs = kwargs
+        self.proxy = proxy
+        self.timeout = timeout
+        self.tasks = {}
+        self.done = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            while self.done:
+                task = self.done.pop(0)
+                title = self.tasks.pop(task)
+                try:
+                    return task.result()
+                except LookupError:
+                    utils.stderr("+ missing %s" % title,
+                                 self.kwargs.get('silent'))
+
+            self._fill()
+            if not self.tasks:
+                raise StopAsyncIteration
+
+            done, _ = await asyncio.wait(
+                list(self.tasks), return_when=asyncio.FIRST_COMPLETED)
+            self.done.extend(done)
+
+    def _fill(self):
+        """
+        start getting pages up to limit
+        """
+        while len(self.tasks) < self.limit:
+            title = next(self.titles, None)
+            if title is None:
+                break
+            page = WPToolsPage(title, **self.kwargs)
+            task = asyncio.ensure_future(
+                get_page(page, False, self.proxy, self.timeout))
+            self.tasks[task] = title
+
+
+def call(func, *args):
+    """
+    returns future of blocking func(*args) run in the default executor
+    of the current event loop
+    """
+    return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+@contextlib.contextmanager
+def deferred(obj):
+    """
+    context in which obj defers (blocking) claims and imageinfo
+    requests otherwise made while capturing a response
+    """
+    flags = dict((x, obj.flags.get(x))
+                 for x in ('defer_claims', 'defer_imageinfo'))
+    obj.flags.update({'defer_claims': True, 'defer_imageinfo': True})
+    try:
+        yield obj
+    finally:
+        obj.flags.update(flags)
+
+
+async def get(obj, actions, show=True, proxy=None, timeout=0):
+    """
+    Awaitable WPTools._get() for action, or list of actions (requested
+    concurrently and captured in order), then claims and imageinfo if
+    they are needed
+    """
+    if not isinstance(actions, list):
+        actions = [actions]
+
+    multi = transport(obj, proxy, timeout)
+
+    with deferred(obj):
+        futures = []
+        for action in actions:
+            qobj = obj._prepare(action)
+            if qobj is not None:
+                futures.append((action, multi.fetch(
+                    obj.cache[action]['query'], qobj.status)))
+
+        for action, future in futures:
+            obj._set_response(action, *(await future))
+
+    if 'wikidata' in actions and obj.data.get('claims'):
+        await get_claims(obj, False, proxy, timeout)
+
+    missing = getattr(obj, '_missing_imageinfo', None)
+    if 'imageinfo' not in actions and missing and missing():
+        await get(obj, 'imageinfo', False, proxy, timeout)
+
+    if show:
+        obj.show()
+
+    return obj
+
+
+async def get_claims(obj, show=True, proxy=None, timeout=0):
+    """
+    Awaitable WPToolsWikidata.get_claims()
+    """
+    if 'claims' not in obj.cache and not obj._missing_claims():
+        obj._set_claims_labels()
+    else:
+        qobj = obj._prepare('claims')
+        if qobj is not None:
+            multi = transport(obj, proxy, timeout)
+            future = multi.loop.create_future()
+
+            def landed(response, info):
+                """
+                capture merged response
+                """
+                obj._set_response('claims', response, info)
+                future.set_result(obj)
+
+            with multi.owned(future):
+                obj._add_claims(qobj, multi, landed)
+            await future
+
+    if show:
+        obj.show()
+
+    return obj
+
+
+async def get_page(page, show=True, proxy=None, timeout=0):
+    """
+    Awaitable WPToolsPage.get()
+    """
+    multi = transport(page, proxy, timeout)
+    future = multi.loop.create_future()
+
+    def done():
+        """
+        all actions captured
+        """
+        if not future.done():
+            future.set_result(page)
+
+    with deferred(page):
+        with multi.owned(future):
+            page._get_queue(page._get_order(), multi, done)
+        await future
+
+    if page._missing_imageinfo():
+        await get(page, 'imageinfo', False, proxy, timeout)
+
+    if show:
+        page.show()
+
+    return page
+
+
+async def get_random(obj, show=True, proxy=None, timeout=0):
+    """
+    Awaitable get_random() of a page or category, taking from its
+    reservoir (reservoir flag) in the executor, or else requesting a
+    random title (not cached, to allow repeated requests)
+    """
+    if obj.flags.get('reservoir'):
+        await call(obj.get_random, False, proxy, timeout)
+    else:
+        await get(obj, 'random', False, proxy, timeout)
+        del obj.cache['random']
+
+    if show:
+        obj.show()
+
+    return obj
+
+
+def pages(titles, limit=MAXPAGES, proxy=None, timeout=0, **kwargs):
+    """
+    Returns async iterator over pages with get() data for titles
+    (see Pages)
+    """
+    return Pages(titles, limit, proxy, timeout, **kwargs)
+
+
+def transport(obj, proxy=None, timeout=0):
+    """
+    returns AsyncMulti of the current event loop for request settings
+    (flags) of obj
+    """
+    loop = asyncio.get_event_loop()
+    key = (obj.flags['silent'], obj.flags['verbose'], proxy, timeout)
+
+    for closed in [x for x in TRANSPORTS if x.is_closed()]:
+        for multi in TRANSPORTS.pop(closed).values():
+            multi.abort()  # land any flights it leads
+
+    multis = TRANSPORTS.setdefault(loop, {})
+    if key not in multis:
+        multis[key] = AsyncMulti(obj._request(proxy, timeout), loop=loop)
+
+    return multis[key]
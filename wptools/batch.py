@@ -0,0 +1,270 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Batch module
+~~~~~~~~~~~~~~~~~~~~
+
+Support for getting data for many pages with few requests.
+
+MediaWiki and Wikidata APIs accept up to 50 titles (or ids) per
+request, so pages are fetched in chunks of WPToolsQuery.MAXTITLES,
+and the chunks are requested concurrently.
+"""
+
+import collections
+
+import pycurl
+
+try:  # python2
+    from urllib import urlencode
+except ImportError:  # python3
+    from urllib.parse import urlencode
+
+from . import request
+from . import utils
+
+from .page import WPToolsPage
+from .query import QUERY_PROPS, WPToolsQuery
+from .utils import split_query
+from .wikidata import WPToolsWikidata
+
+
+def _query_chunk(multi, qstr, status, found, silent=False):
+    """
+    queue action=query for a chunk of titles, following continue
+    (for extracts) before adding its pages to found. A chunk that
+    fails is reported, and its pages are left missing.
+    """
+    responses = []
+
+    # continued requests only need the props, not another random page
+    cstr = qstr
+    for param in QUERY_PROPS['random']:
+        cstr = cstr.replace(param, '')
+
+    def landed(response, info):
+        """
+        collect response, continue or split it into found pages
+        """
+        try:
+            request.curl_error(info)
+            data = utils.json_loads(response)
+            responses.append(data)
+
+            cont = data.get('continue')
+            if cont and cont.get('excontinue'):
+                multi.add(cstr + '&' + urlencode(sorted(cont.items())),
+                          status, landed)
+                return
+
+            chunk = split_query(responses, qstr)
+        except (LookupError, ValueError, pycurl.error) as exc:
+            utils.stderr("+ failed %s (%s)" % (status, exc), silent)
+            return
+
+        random = responses[0].get('query', {}).get('random')
+        for title, page in chunk.items():
+            found[title] = (page, random, qstr, info)
+
+    multi.add(qstr, status, landed)
+
+
+def _wikidata_chunk(multi, qobj, group, chunk, found):
+    """
+    queue wbgetentities for a chunk of ids or titles, adding entities
+    to found by (group, id) or (group, title). Titles resolved to an
+    entity of another sitelink (redirects) are matched by elimination,
+    or else looked up again one by one.
+    """
+    kind, site = group[2], "%swiki" % group[0]
+
+    if kind == 'ids':
+        qstr = qobj.wikidata(None, chunk)
+    else:
+        qstr = qobj.wikidata(chunk)
+    status = qobj.status
+
+    def landed(response, info):
+        """
+        index entities of response
+        """
+        data = response_data(response, info, qstr)
+
+        missing, unclaimed = set(), []
+        for entity in data.get('entities', {}).values():
+            if 'missing' in entity:
+                if entity.get('title'):
+                    missing.add(wikititle(entity['title']))
+                continue
+            keys = []
+            if kind == 'ids':
+                keys.append(entity.get('id'))
+                if entity.get('redirects'):
+                    keys.append(entity['redirects'].get('from'))
+            else:
+                link = entity.get('sitelinks', {}).get(site)
+                if link and wikititle(link['title']) in chunk:
+                    keys.append(wikititle(link['title']))
+                else:
+                    unclaimed.append(entity)
+            for key in keys:
+                found[(group, key)] = (entity, qstr, info)
+
+        if kind == 'ids':
+            return
+
+        left = [x for x in chunk
+                if (group, x) not in found and x not in missing]
+        if len(left) == 1 and len(unclaimed) == 1:
+            found[(group, left[0])] = (unclaimed[0], qstr, info)
+        elif len(chunk) > 1:
+            for title in left:
+                _wikidata_chunk(multi, qobj, group, [title], found)
+
+    multi.add(qstr, status, landed)
+
+
+def get_wikidata(items, proxy=None, timeout=0, **kwargs):
+    """
+    Returns list of objects with get_wikidata() data for items, getting
+    up to WPToolsQuery.MAXTITLES Wikidata entities per request
+
+    Required arguments:
+    - items: <list> wptools.page (or wptools.wikidata) objects with a
+      wikibase or title param, or Wikidata item IDs, e.g. 'Q42'
+
+    Optional arguments:
+    - [proxy]: <str> use this HTTP proxy
+    - [timeout]: <int> timeout in seconds (0=wait forever)
+
+    Optional keyword {params} and {flags} are passed on to each
+    wptools.wikidata made from an item ID, e.g. lang, silent.
+
+    Items are looked up by wikibase (ids=Q1|Q2|...) or else by title
+    (sites={lang}wiki&titles=A|B|...), grouped by lang, variant and
+    scheme.
+    Objects are returned in the order of items. Missing items are
+    left out. Claims are not resolved (see get_claims()).
+    """
+    silent = kwargs.get('silent') or False
+
+    entries = []
+    groups = collections.OrderedDict()
+    for item in items:
+        if utils.is_text(item):
+            item = WPToolsWikidata(wikibase=item, **kwargs)
+
+        lang = item.params['lang']
+        variant = item.params.get('variant')
+        scheme = item.params.get('scheme')
+        wikibase = item.params.get('wikibase')
+        title = item.params.get('title')
+
+        if wikibase:
+            group, key = (lang, variant, 'ids', scheme), wikibase
+        elif title:
+            group, key = (lang, variant, 'titles', scheme), wikititle(title)
+        else:
+            raise LookupError("get_wikidata needs wikibase or title")
+
+        entries.append((group, key, item))
+        groups.setdefault(group, collections.OrderedDict())[key] = True
+
+    req = request.WPToolsRequest(silent, kwargs.get('verbose') or False,
+                                 proxy, timeout)
+    multi = request.WPToolsMulti(req)
+
+    found = {}
+    for group in groups:
+        qobj = WPToolsQuery(lang=group[0], variant=group[1],
+                            scheme=group[3])
+        for chunk in utils.chunks(groups[group], WPToolsQuery.MAXTITLES):
+            _wikidata_chunk(multi, qobj, group, chunk, found)
+    multi.run()
+
+    objs = []
+    for group, key, item in entries:
+        if (group, key) not in found:
+            utils.stderr("+ missing %s" % key, silent)
+            continue
+        entity, qstr, info = found[(group, key)]
+        item.set_entity(entity, {'query': qstr, 'info': info})
+        objs.append(item)
+
+    return objs
+
+
+def pages(titles, proxy=None, timeout=0, **kwargs):
+    """
+    Returns list of WPToolsPage objects with get_query() data for
+    titles, getting up to WPToolsQuery.MAXTITLES pages per request
+
+    Required arguments:
+    - titles: <list> Mediawiki page titles
+
+    Optional arguments:
+    - [proxy]: <str> use this HTTP proxy
+    - [timeout]: <int> timeout in seconds (0=wait forever)
+
+    Optional keyword {params} and {flags} are passed on to each
+    wptools.page, e.g. lang, variant, wiki, silent, verbose, and parse
+    (default=lean) for any get_parse() later.
+
+    Pages are returned in the order of titles. Missing pages are
+    left out.
+    """
+    titles = list(collections.OrderedDict.fromkeys(titles))
+    kwargs.setdefault('parse', 'lean')
+    silent = kwargs.get('silent') or False
+
+    qobj = WPToolsQuery(lang=kwargs.get('lang') or 'en',
+                        variant=kwargs.get('variant'),
+                        wiki=kwargs.get('wiki'),
+                        scheme=kwargs.get('scheme'))
+
+    req = request.WPToolsRequest(silent, kwargs.get('verbose') or False,
+                                 proxy, timeout)
+    multi = request.WPToolsMulti(req)
+
+    found = {}
+    for chunk in utils.chunks(titles, WPToolsQuery.MAXTITLES):
+        qstr = qobj.query(chunk)
+        _query_chunk(multi, qstr, qobj.status, found, silent)
+    multi.run()
+
+    _pages = []
+    for title in titles:
+        if title not in found:
+            utils.stderr("+ missing %s" % title, silent)
+            continue
+
+        page, random, qstr, info = found[title]
+        data = {'query': {'pages': [page], 'random': random}}
+
+        _pages.append(WPToolsPage.from_query(
+            title, data, {'query': qstr, 'info': info}, **kwargs))
+
+    return _pages
+
+
+def response_data(response, info, query=None):
+    """
+    returns decoded API response of a (multi) transfer, raising
+    pycurl.error if it failed, or LookupError on API error
+    """
+    request.curl_error(info)
+    data = utils.json_loads(response)
+
+    if data.get('error'):
+        utils.stderr("API error: %s" % data.get('error'))
+        raise LookupError(query)
+
+    return data
+
+
+def wikititle(title):
+    """
+    returns title as Mediawiki sitelinks have it (spaces, first upper)
+    """
+    title = title.replace('_', ' ').strip()
+    return title[:1].upper() + title[1:]
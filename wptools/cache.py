@@ -0,0 +1,576 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Cache module
+~~~~~~~~~~~~~~~~~~~~
+
+Process-wide caches shared by WPTools objects.
+
+Responses are also kept on disk (across runs) when DISK is set to a
+persistent cache, e.g.
+
+    >>> wptools.cache.DISK = wptools.cache.SQLiteCache('wptools.db')
+
+Requests can be recorded to, and replayed from, a cassette (CASSETTE)
+with no network at all, e.g.
+
+    >>> with wptools.cache.Cassette('gandhi.tape', record=True):
+    ...     wptools.page('Gandhi').get()
+"""
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+try:  # python2
+    from urlparse import urlparse, urlunparse
+except ImportError:  # python3
+    from urllib.parse import urlparse, urlunparse
+
+MAXBYTES = 512 * 1024 * 1024
+MAXSIZE = 10000
+TTL = 24 * 60 * 60
+
+# record/replay archive used by all requests (if set)
+CASSETTE = None
+
+# persistent response cache used by all requests (if set)
+DISK = None
+
+
+class LRUCache(object):
+    """
+    Thread-safe, size-bounded, least-recently-used cache
+    """
+
+    counts = None
+    items = None
+    lock = None
+    maxsize = MAXSIZE
+
+    def __init__(self, maxsize=MAXSIZE):
+        """
+        Returns a LRUCache object.
+
+        Arguments:
+        - [maxsize]: <int> maximum number of items to keep
+        """
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {'evictions': 0, 'hits': 0, 'misses': 0}
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def clear(self):
+        """
+        forget all items and counts
+        """
+        with self.lock:
+            self.items.clear()
+            for item in self.counts:
+                self.counts[item] = 0
+
+    def get(self, key, default=None):
+        """
+        returns (most recently used) item for key, or default
+        """
+        with self.lock:
+            if key not in self.items:
+                self.counts['misses'] += 1
+                return default
+            self.counts['hits'] += 1
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        set item for key, evicting least recently used items
+        """
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def stats(self):
+        """
+        returns cache counters: evictions, hits, misses, size, maxsize
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats['maxsize'] = self.maxsize
+            stats['size'] = len(self.items)
+        return stats
+
+
+class Cassette(object):
+    """
+    Append-only archive of responses (URL, body and request info) to
+    record requests to, or replay them from with no network
+
+    Each record is a line with its size, then its (zlib) compressed
+    JSON head and body. Replay loads all records at once, the last for
+    a URL winning; a truncated last record (from an interrupted run)
+    is ignored. In context, the cassette is CASSETTE, used by all
+    requests.
+    """
+
+    counts = None
+    fh = None
+    lock = None
+    path = None
+    previous = None
+    recording = False
+    records = None
+
+    def __init__(self, path, record=False):
+        """
+        Returns a Cassette object.
+
+        Arguments:
+        - path: <str> archive file (made if missing when recording)
+        - [record]: <bool> record (append) responses, else replay them
+        """
+        self.path = path
+        self.recording = record
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'writes': 0}
+        self.records = {}
+
+        if record:
+            self.fh = open(path, 'ab')
+        else:
+            self._load()
+
+    def __enter__(self):
+        global CASSETTE  # pylint: disable=global-statement
+        self.previous, CASSETTE = CASSETTE, self
+        return self
+
+    def __exit__(self, *exc):
+        global CASSETTE  # pylint: disable=global-statement
+        CASSETTE, self.previous = self.previous, None
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _load(self):
+        """
+        read all records of archive
+        """
+        with open(self.path, 'rb') as fh:
+            while True:
+                try:
+                    size = int(fh.readline())
+                except ValueError:
+                    break
+                blob = fh.read(size)
+                if len(blob) < size:
+                    break
+                head, body = zlib.decompress(blob).split(b'\n', 1)
+                head = json.loads(head.decode('utf-8'))
+                self.records[url_key(head['url'])] = (body, head['info'])
+
+    def close(self):
+        """
+        close archive (being recorded)
+        """
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+    def get(self, url):
+        """
+        returns replayed (body, info) for url, or None
+        """
+        found = self.records.get(url_key(url))
+        with self.lock:
+            self.counts['hits' if found else 'misses'] += 1
+        if found:
+            return found[0], dict(found[1])
+
+    def record(self, url, body, info):
+        """
+        append response body (bytes) and info for url
+        """
+        if body is None:
+            body = b''
+        elif not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        info = dict(info)
+        info.pop('cache', None)
+
+        head = json.dumps({'info': info, 'url': url}, sort_keys=True)
+        blob = zlib.compress(head.encode('utf-8') + b'\n' + body)
+
+        with self.lock:
+            self.fh.write(("%d\n" % len(blob)).encode('ascii') + blob)
+            self.fh.flush()
+            self.counts['writes'] += 1
+            self.records[url_key(url)] = (body, info)
+
+    def stats(self):
+        """
+        returns cassette counters: hits, misses, writes, and records
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats['records'] = len(self.records)
+        return stats
+
+
+class DiskCache(object):
+    """
+    Abstract persistent response cache keyed by normalized URL
+
+    Entries hold a (zlib) compressed body with its request info, and
+    expire after ttl seconds. Least recently used entries are evicted
+    when the cache grows over maxbytes on disk. A readonly cache is
+    never written. An offline cache also serves expired entries, and
+    requests missing it fail instead of going to the network.
+    """
+
+    counts = None
+    lock = None
+    maxbytes = MAXBYTES
+    offline = False
+    readonly = False
+    ttl = TTL
+
+    def __init__(self, ttl=TTL, maxbytes=MAXBYTES, readonly=False,
+                 offline=False):
+        """
+        Abstract initialization for...
+        - cache.DirCache
+        - cache.SQLiteCache
+
+        Arguments:
+        - [maxbytes]: <int> maximum size on disk
+        - [offline]: <bool> serve expired entries, never request
+        - [readonly]: <bool> never write entries
+        - [ttl]: <int> seconds entries stay fresh (default=1 day)
+        """
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.offline = offline
+        self.readonly = readonly or offline
+        self.lock = threading.RLock()
+        self.counts = {'evictions': 0, 'expired': 0, 'hits': 0,
+                       'misses': 0, 'stale': 0, 'writes': 0}
+
+    def _delete(self, key):
+        """
+        Abstract method to remove entry for key
+        """
+        raise NotImplementedError("A subclass must implement this method.")
+
+    def _evict(self):
+        """
+        Abstract method to remove least recently used entries until
+        size() is at most maxbytes, returns number removed
+        """
+        raise NotImplementedError("A subclass must implement this method.")
+
+    def _read(self, key):
+        """
+        Abstract method that returns (blob, expires) for key, marking
+        it used, or None
+        """
+        raise NotImplementedError("A subclass must implement this method.")
+
+    def _write(self, key, blob, expires):
+        """
+        Abstract method to store blob for key
+        """
+        raise NotImplementedError("A subclass must implement this method.")
+
+    def clear(self):
+        """
+        Abstract method to remove all entries
+        """
+        raise NotImplementedError("A subclass must implement this method.")
+
+    def delete(self, url):
+        """
+        forget entry for url
+        """
+        if not self.readonly:
+            with self.lock:
+                self._delete(url_key(url))
+
+    def get(self, url, stale=False):
+        """
+        returns entry {body, info, expires} for url, or None if missing
+        or expired (unless stale or offline)
+        """
+        with self.lock:
+            found = self._read(url_key(url))
+
+            if found is None:
+                self.counts['misses'] += 1
+                return
+
+            blob, expires = found
+            if expires >= time.time():
+                self.counts['hits'] += 1
+            elif stale or self.offline:
+                self.counts['stale'] += 1
+            else:
+                self.counts['expired'] += 1
+                return
+
+        head, body = zlib.decompress(blob).split(b'\n', 1)
+
+        return {'body': body,
+                'expires': expires,
+                'info': json.loads(head.decode('utf-8'))}
+
+    def set(self, url, body, info, ttl=None):
+        """
+        store body (bytes) and info for url, fresh for ttl seconds
+        (default=self.ttl), evicting least recently used entries
+        """
+        if self.readonly:
+            return
+
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        head = json.dumps(info, sort_keys=True).encode('utf-8')
+        blob = zlib.compress(head + b'\n' + body)
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+
+        with self.lock:
+            self._write(url_key(url), blob, expires)
+            self.counts['writes'] += 1
+            if self.size() > self.maxbytes:
+                self.counts['evictions'] += self._evict()
+
+    def size(self):
+        """
+        Abstract method that returns size of entries on disk (bytes)
+        """
+        raise NotImplementedError("A subclass must implement this method.")
+
+    def stats(self):
+        """
+        returns cache counters: evictions, expired, hits, misses, stale
+        (expired entries served), writes, and size (bytes)
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats['size'] = self.size()
+        return stats
+
+
+class DirCache(DiskCache):
+    """
+    Persistent response cache as a directory of files
+
+    Each entry is a file named by the SHA-1 of its key, holding its
+    expiry time and blob. File mtime tracks last use, for eviction.
+    """
+
+    path = None
+    used = 0
+
+    def __init__(self, path, **kwargs):
+        """
+        Returns a DirCache object.
+
+        Arguments:
+        - path: <str> cache directory (made if missing)
+
+        Optional keyword arguments as for DiskCache.
+        """
+        super(DirCache, self).__init__(**kwargs)
+        self.path = path
+        if not os.path.isdir(path) and not self.readonly:
+            os.makedirs(path)
+        self.used = sum(os.path.getsize(x) for x in self._files())
+
+    def _delete(self, key):
+        fname = self._fname(key)
+        if os.path.exists(fname):
+            self.used -= os.path.getsize(fname)
+            os.remove(fname)
+
+    def _evict(self):
+        removed = 0
+        for fname in sorted(self._files(), key=os.path.getmtime):
+            if self.used <= self.maxbytes:
+                break
+            self.used -= os.path.getsize(fname)
+            os.remove(fname)
+            removed += 1
+        return removed
+
+    def _files(self):
+        """
+        returns paths of all entry files
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, x) for x in os.listdir(self.path)
+                if x.endswith('.entry')]
+
+    def _fname(self, key):
+        """
+        returns path of entry file for key
+        """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.entry')
+
+    def _read(self, key):
+        fname = self._fname(key)
+        try:
+            with open(fname, 'rb') as fh:
+                expires, blob = fh.read().split(b'\n', 1)
+        except (IOError, OSError, ValueError):
+            return
+        if not self.readonly:
+            os.utime(fname, None)
+        return blob, float(expires)
+
+    def _write(self, key, blob, expires):
+        self._delete(key)
+        fname = self._fname(key)
+        tmp = "%s.%d" % (fname, os.getpid())
+        with open(tmp, 'wb') as fh:
+            fh.write(repr(expires).encode('ascii') + b'\n' + blob)
+        os.rename(tmp, fname)
+        self.used += os.path.getsize(fname)
+
+    def clear(self):
+        with self.lock:
+            for fname in self._files():
+                os.remove(fname)
+            self.used = 0
+
+    def size(self):
+        return self.used
+
+
+class SQLiteCache(DiskCache):
+    """
+    Persistent response cache in a SQLite database
+
+    The size of entries is kept as a running total (used), summed from
+    the database once when it is opened.
+    """
+
+    conn = None
+    path = None
+    used = 0
+
+    def __init__(self, path, **kwargs):
+        """
+        Returns a SQLiteCache object.
+
+        Arguments:
+        - path: <str> database file (made if missing)
+
+        Optional keyword arguments as for DiskCache.
+        """
+        super(SQLiteCache, self).__init__(**kwargs)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, blob BLOB, expires REAL, "
+                "used REAL, size INTEGER)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        row = self.conn.execute("SELECT SUM(size) FROM entries").fetchone()
+        self.used = row[0] or 0
+
+    def _delete(self, key):
+        self.used -= self._size(key)
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self):
+        keys = []
+        for key, size in self.conn.execute(
+                "SELECT key, size FROM entries ORDER BY used"):
+            if self.used <= self.maxbytes:
+                break
+            keys.append((key,))
+            self.used -= size
+        with self.conn:
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+        return len(keys)
+
+    def _read(self, key):
+        row = self.conn.execute(
+            "SELECT blob, expires FROM entries WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return
+        if not self.readonly:
+            with self.conn:
+                self.conn.execute("UPDATE entries SET used = ? WHERE key = ?",
+                                  (time.time(), key))
+        return bytes(row[0]), row[1]
+
+    def _size(self, key):
+        """
+        returns size of entry for key (bytes), or 0 if missing
+        """
+        row = self.conn.execute(
+            "SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _write(self, key, blob, expires):
+        self.used += len(blob) - self._size(key)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(blob), expires, time.time(), len(blob)))
+
+    def clear(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM entries")
+            self.used = 0
+
+    def close(self):
+        """
+        close the database
+        """
+        with self.lock:
+            self.conn.close()
+
+    def size(self):
+        return self.used
+
+
+def url_key(url):
+    """
+    returns cache key for URL: lowercase scheme and host, sorted query
+    parameters, no fragment
+    """
+    if isinstance(url, bytes):
+        url = url.decode('utf-8')
+    parts = urlparse(url)
+    query = '&'.join(sorted(x for x in parts.query.split('&') if x))
+    return urlunparse((parts.scheme.lower(), parts.netloc.lower(),
+                       parts.path, parts.params, query, ''))
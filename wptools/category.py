@@ -5,9 +5,26 @@ WPTools Category module
 ~~~~~~~~~~~~~~~~~~~~~~~
 
 Support for getting Mediawiki category info.
+
+get_members() captures the first batch (cmlimit) of members only,
+iter_members() streams them all, following continuation, and crawl()
+streams the articles of a category tree. iter_pages() streams members
+as pages with get_query() data, many per request.
 """
 
+try:  # python2
+    from urllib import urlencode
+except ImportError:  # python3
+    from urllib.parse import urlencode
+
 from . import core
+from . import request
+from . import utils
+
+from .batch import response_data
+from .page import WPToolsPage
+from .query import WPToolsQuery
+from .utils import iter_generated
 
 
 class WPToolsCategory(core.WPTools):
@@ -28,10 +45,12 @@ class WPToolsCategory(core.WPTools):
         - [lang]: <str> Mediawiki language code (default=en)
         - [namespace]: <int> filter members (0=article, 14=category)
         - [pageid]: <int> category pageid
+        - [scheme]: <str> of all queries (default=https)
         - [variant]: <str> Mediawiki language variant
         - [wiki]: <str> alternative wiki site (default=wikipedia.org)
 
         Optional keyword {flags}:
+        - [reservoir]: <bool> get random title from a shared reservoir
         - [silent]: <bool> do not echo page data if True
         - [skip]: <list> skip actions in this list
         - [verbose]: <bool> verbose output to stderr if True
@@ -95,6 +114,148 @@ class WPToolsCategory(core.WPTools):
             self.data.update(data)
             self.params.update(data)
 
+    def _crawl(self, emit, proxy, timeout, depth, maxnodes, maxconn):
+        """
+        emit articles of category tree, requesting members (following
+        continuation) of up to maxnodes categories concurrently
+        """
+        qobj = WPToolsQuery(lang=self.params['lang'],
+                            variant=self.params.get('variant'),
+                            wiki=self.params.get('wiki'),
+                            scheme=self.params.get('scheme'))
+        multi = request.WPToolsMulti(self._request(proxy, timeout), maxconn)
+
+        title = self.params.get('title')
+        visited = set([title or self.params.get('pageid')])
+        seen = set()
+
+        def expand(category, pageid, level):
+            """
+            queue members request of category
+            """
+            qstr = qobj.category(category, pageid, namespace=[0, 14])
+            status = qobj.status
+
+            def landed(response, info):
+                """
+                emit new articles, expand new subcategories, continue
+                """
+                data = response_data(response, info, qstr)
+                members = (data.get('query') or {}).get('categorymembers')
+                for member in members or []:
+                    name = member.get('title')
+                    if member.get('ns') == 14:
+                        if level < depth and name not in visited:
+                            if len(visited) < maxnodes:
+                                visited.add(name)
+                                expand(name, None, level + 1)
+                    elif member.get('ns') == 0 and name not in seen:
+                        seen.add(name)
+                        emit(dict(member, category=category or pageid,
+                                  depth=level))
+
+                cont = data.get('continue')
+                if cont and cont.get('cmcontinue'):
+                    multi.add(qstr + '&' + urlencode(sorted(cont.items())),
+                              status, landed)
+
+            multi.add(qstr, status, landed)
+
+        expand(title, self.params.get('pageid'), 0)
+        multi.run()
+
+    def _iter_batches(self, proxy, timeout, limit):
+        """
+        yields lists of category members, one request (of up to limit
+        members) after another, following continue (cmcontinue)
+        """
+        qobj = WPToolsQuery(lang=self.params['lang'],
+                            variant=self.params.get('variant'),
+                            wiki=self.params.get('wiki'),
+                            scheme=self.params.get('scheme'))
+        qstr = qobj.category(self.params.get('title'),
+                             self.params.get('pageid'), limit,
+                             self.params.get('namespace'))
+        req = self._request(proxy, timeout)
+
+        cont = {}
+        while True:
+            url = qstr
+            if cont:
+                url += '&' + urlencode(sorted(cont.items()))
+
+            data = utils.json_loads(req.get(url, qobj.status))
+            if data.get('error'):
+                utils.stderr("API error: %s" % data.get('error'))
+                raise LookupError(url)
+
+            yield (data.get('query') or {}).get('categorymembers') or []
+
+            cont = data.get('continue')
+            if not cont or not cont.get('cmcontinue'):
+                return
+
+    def _iter_page_batches(self, proxy, timeout, limit):
+        """
+        yields lists of (page, query, info) of up to limit members per
+        generator batch (see utils.iter_generated)
+        """
+        qobj = WPToolsQuery(lang=self.params['lang'],
+                            variant=self.params.get('variant'),
+                            wiki=self.params.get('wiki'),
+                            scheme=self.params.get('scheme'))
+        qstr = qobj.categorypages(self.params.get('title'),
+                                  self.params.get('pageid'), limit,
+                                  self.params.get('namespace', 0))
+        return iter_generated(self._request(proxy, timeout), qstr,
+                              qobj.status)
+
+    def aget_members(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_members() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise LookupError("needs category title or pageid")
+        return self._aio().get(self, 'category', show, proxy, timeout)
+
+    def aget_random(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_random() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        return self._aio().get_random(self, show, proxy, timeout)
+
+    def crawl(self, proxy=None, timeout=0, depth=1, maxnodes=1000,
+              maxconn=request.MAXCONN, buffer=500):
+        """
+        Returns iterator of articles (ns=0 members, each once) in the
+        category tree [{ns, pageid, title, category, depth}], as found
+        while subcategories (ns=14) are expanded concurrently
+        https://www.mediawiki.org/wiki/API:Categorymembers
+
+        Required {params}: title OR pageid
+        - title: <str> article title
+        - pageid: <int> Wikipedia database ID
+
+        Optional arguments:
+        - [proxy]: <str> use this HTTP proxy
+        - [timeout]: <int> timeout in seconds (0=wait forever)
+        - [depth]: <int> subcategory levels to expand (0=none)
+        - [maxnodes]: <int> most categories to expand (with this one)
+        - [maxconn]: <int> maximum concurrent requests
+        - [buffer]: <int> most articles found ahead of the consumer
+
+        Each category is expanded once, so cycles end, and crawling
+        pauses while buffer articles wait, and stops when the iterator
+        is closed.
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise LookupError("needs category title or pageid")
+
+        return utils.stream(lambda emit: self._crawl(
+            emit, proxy, timeout, depth, maxnodes, maxconn), buffer)
+
     def get_members(self, show=True, proxy=None, timeout=0):
         """
         GET Mediawiki:API (action=query) category members
@@ -110,7 +271,8 @@ class WPToolsCategory(core.WPTools):
         - [timeout]: <int> timeout in seconds (0=wait forever)
 
         Data captured:
-        - members: <list> category members [{ns, pageid, title}]
+        - members: <list> category members [{ns, pageid, title}],
+          the first 500 only (see iter_members)
         """
         title = self.params.get('title')
         pageid = self.params.get('pageid')
@@ -122,6 +284,69 @@ class WPToolsCategory(core.WPTools):
 
         return self
 
+    def iter_members(self, proxy=None, timeout=0, limit=500, prefetch=1):
+        """
+        Returns iterator of all category members [{ns, pageid, title}],
+        requesting batches of up to limit members, following
+        continuation (cmcontinue), and the next batch while the current
+        is consumed
+        https://www.mediawiki.org/wiki/API:Categorymembers
+
+        Required {params}: title OR pageid
+        - title: <str> article title
+        - pageid: <int> Wikipedia database ID
+
+        Optional arguments:
+        - [proxy]: <str> use this HTTP proxy
+        - [timeout]: <int> timeout in seconds (0=wait forever)
+        - [limit]: <int> members per request (max 500)
+        - [prefetch]: <int> batches requested ahead (0=none)
+
+        Members are not captured (see get_members), so memory holds a
+        few batches at most, however big the category.
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise LookupError("needs category title or pageid")
+
+        batches = self._iter_batches(proxy, timeout, limit)
+        return (member for batch in utils.prefetch(batches, prefetch)
+                for member in batch)
+
+    def iter_pages(self, proxy=None, timeout=0, limit=20, prefetch=1):
+        """
+        Returns iterator of category members (in namespace, default=0)
+        as WPToolsPage objects with get_query() data, requesting up to
+        limit pages at a time (generator=categorymembers), following
+        continuation, and the next batch while the current is consumed
+        https://www.mediawiki.org/wiki/API:Query#Generators
+
+        Required {params}: title OR pageid
+        - title: <str> article title
+        - pageid: <int> Wikipedia database ID
+
+        Optional arguments:
+        - [proxy]: <str> use this HTTP proxy
+        - [timeout]: <int> timeout in seconds (0=wait forever)
+        - [limit]: <int> pages per request (extracts max 20)
+        - [prefetch]: <int> batches requested ahead (0=none)
+
+        Pages get lang, variant, wiki and flags of the category.
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise LookupError("needs category title or pageid")
+
+        kwargs = dict(self.flags)
+        for param in ('lang', 'variant', 'wiki'):
+            kwargs[param] = self.params.get(param)
+
+        batches = self._iter_page_batches(proxy, timeout, limit)
+        return (WPToolsPage.from_query(page['title'],
+                                       {'query': {'pages': [page]}},
+                                       {'query': url, 'info': info},
+                                       **kwargs)
+                for batch in utils.prefetch(batches, prefetch)
+                for page, url, info in batch)
+
     def get_random(self, show=True, proxy=None, timeout=0):
         """
         GET MediaWiki:API (action=query) for random category
@@ -137,7 +362,18 @@ class WPToolsCategory(core.WPTools):
         Data captured:
         - pageid: <int> Wikipedia database ID
         - title: <str> article title
+
+        With the reservoir flag, the title comes from a reservoir of
+        random categories (see wptools.reservoir) without a request.
         """
+        if self.flags.get('reservoir'):
+            data = self._reserved(14, proxy, timeout)
+            self.data.update(data)
+            self.params.update(data)
+            if show:
+                self.show()
+            return self
+
         self._get('random', show, proxy, timeout)
 
         # flush cache to allow repeated random requests
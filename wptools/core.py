@@ -10,8 +10,14 @@ Support for accessing Wikimedia foundation APIs.
 from wptools.query import WPToolsQuery
 
 from . import request
+from . import reservoir
 from . import utils
 
+from .tracing import TRACER
+
+# wptools.aio (python3.5+), set by wptools when it can be imported
+AIO = None
+
 
 class WPTools(object):
     """
@@ -46,6 +52,12 @@ class WPTools(object):
         if len(args) > 0 and args[0]:  # first positional arg is title
             self.params.update({'title': args[0]})
 
+        if kwargs.get('reservoir'):
+            self.flags.update({'reservoir': True})
+
+        if kwargs.get('scheme'):
+            self.params.update({'scheme': kwargs.get('scheme')})
+
         if kwargs.get('skip'):
             self.flags.update({'skip': kwargs.get('skip')})
 
@@ -55,37 +67,26 @@ class WPTools(object):
         if kwargs.get('wiki'):
             self.params.update({'wiki': kwargs.get('wiki')})
 
+    @staticmethod
+    def _aio():
+        """
+        returns wptools.aio, or raises RuntimeError without asyncio
+        """
+        if AIO is None:
+            raise RuntimeError("asyncio needs python3.5+")
+        return AIO
+
     def _get(self, action, show, proxy, timeout):
         """
         make HTTP request and cache response
         """
-        silent = self.flags['silent']
-
-        if action in self.cache:
-            if action != 'imageinfo':
-                utils.stderr("+ %s results in cache" % action, silent)
-                return
-        else:
-            self.cache[action] = {}
-
-        if self.flags.get('skip') and action in self.flags['skip']:
-            if not self.flags['silent']:
-                utils.stderr("+ skipping %s" % action)
+        qobj = self._prepare(action)
+        if qobj is None:
             return
 
-        # make the request
-        qobj = WPToolsQuery(lang=self.params['lang'],
-                            variant=self.params.get('variant'),
-                            wiki=self.params.get('wiki'))
-        qstr = self._query(action, qobj)
-        self.cache[action]['query'] = qstr
-
         req = self._request(proxy, timeout)
-        response = req.get(qstr, qobj.status)
-        self.cache[action]['response'] = response
-        self.cache[action]['info'] = req.info
-
-        self._set_data(action)
+        response = req.get(self.cache[action]['query'], qobj.status)
+        self._set_response(action, response, req.info)
 
         if show:
             self.show()
@@ -100,10 +101,12 @@ class WPTools(object):
         if not response:
             raise ValueError("Empty response: %s" % self.params)
 
-        try:
-            data = utils.json_loads(response)
-        except ValueError:
-            raise ValueError(_query)
+        with TRACER.span('decode', action, self.params.get('title'),
+                         len(response)):
+            try:
+                data = utils.json_loads(response)
+            except ValueError:
+                raise ValueError(_query)
 
         if data.get('warnings'):
             utils.stderr("API warning: %s" % data.get('warnings'))
@@ -125,6 +128,34 @@ class WPTools(object):
 
         return data
 
+    def _prepare(self, action):
+        """
+        caches query string for action and returns its WPToolsQuery
+        object, or None if action is cached or skipped
+        """
+        silent = self.flags['silent']
+
+        if action in self.cache:
+            if action != 'imageinfo':
+                utils.stderr("+ %s results in cache" % action, silent)
+                return
+        else:
+            self.cache[action] = {}
+
+        if self.flags.get('skip') and action in self.flags['skip']:
+            if not self.flags['silent']:
+                utils.stderr("+ skipping %s" % action)
+            return
+
+        qobj = WPToolsQuery(lang=self.params['lang'],
+                            variant=self.params.get('variant'),
+                            wiki=self.params.get('wiki'),
+                            scheme=self.params.get('scheme'))
+        with TRACER.span('query', action, self.params.get('title')):
+            self.cache[action]['query'] = self._query(action, qobj)
+
+        return qobj
+
     def _query(self, action, qobj):
         """
         Abstract method that returns WPToolsQuery string
@@ -139,12 +170,33 @@ class WPTools(object):
                                       self.flags['verbose'],
                                       proxy, timeout)
 
+    def _reserved(self, namespace, proxy, timeout):
+        """
+        returns random {pageid, title} in namespace from the shared
+        reservoir of this wiki (see wptools.reservoir)
+        """
+        return reservoir.shared(self.params['lang'], self.params.get('wiki'),
+                                namespace, proxy=proxy, timeout=timeout,
+                                variant=self.params.get('variant'),
+                                scheme=self.params.get('scheme')).get()
+
     def _set_data(self, action):
         """
         Abstract method to capture API response data
         """
         raise NotImplementedError("A subclass must implement this method.")
 
+    def _set_response(self, action, response, info):
+        """
+        cache API response (and request info) and capture its data
+        """
+        self.cache[action]['response'] = response
+        self.cache[action]['info'] = info
+
+        with TRACER.span('marshal', action, self.params.get('title'),
+                         len(response or '')):
+            self._set_data(action)
+
     def info(self, action=None):
         """
         returns cached request info for given action,
@@ -0,0 +1,180 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Metrics module
+~~~~~~~~~~~~~~~~~~~~~~
+
+Process-wide request metrics, to tell whether time goes to the network
+(dns, connect, tls) or to the API (ttfb), per action and per host:
+
+    >>> wptools.metrics.METRICS.summary()['action']['parse']
+    {'requests': 3, 'errors': 0, 'bytes': 41234, 'decoded': 201837,
+     'total': {'p50': 0.31, 'p95': 0.52, 'p99': 0.52, ...}, ...}
+"""
+
+import math
+import re
+import threading
+
+try:  # python2
+    from urlparse import urlparse
+except ImportError:  # python3
+    from urllib.parse import urlparse
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer', 'total')
+
+# "{domain} ({action}) {target}" see WPToolsQuery.set_status()
+STATUS_RE = re.compile(r'^\S+ \(([^)]+)\) ?(.*)$')
+
+
+class Histogram(object):
+    """
+    Latency histogram with log-scale buckets (about 5% wide) from
+    100 microseconds, in constant memory
+    """
+
+    GROWTH = 1.05
+    LOWEST = 0.0001
+
+    buckets = None
+    count = 0
+    maximum = 0
+    total = 0
+
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, value):
+        """
+        count a value (seconds)
+        """
+        index = 0
+        if value > self.LOWEST:
+            index = int(math.ceil(math.log(value / self.LOWEST)
+                                  / math.log(self.GROWTH)))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, percent):
+        """
+        returns (upper bound of bucket of) value at percent, or None
+        """
+        if not self.count:
+            return
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.maximum, self.LOWEST * self.GROWTH ** index)
+        return self.maximum
+
+    def summary(self):
+        """
+        returns {count, mean, max, p50, p95, p99}
+        """
+        return {'count': self.count,
+                'max': self.maximum,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99)}
+
+
+class Metrics(object):
+    """
+    Thread-safe aggregate of request counts, bytes, errors and phase
+    latency histograms, by action and by host
+    """
+
+    lock = None
+    stats = None
+
+    def __init__(self):
+        """
+        Returns a Metrics object.
+        """
+        self.lock = threading.Lock()
+        self.clear()
+
+    def _entry(self, kind, name):
+        """
+        returns counters and histograms of (kind, name)
+        """
+        group = self.stats[kind]
+        if name not in group:
+            group[name] = {'bytes': 0, 'cached': 0, 'decoded': 0,
+                           'errors': 0, 'requests': 0,
+                           'phases': dict((x, Histogram()) for x in PHASES)}
+        return group[name]
+
+    def clear(self):
+        """
+        forget all metrics
+        """
+        with self.lock:
+            self.stats = {'action': {}, 'host': {}}
+
+    def record(self, info, status=None):
+        """
+        count request info (see request.curl_info()), by the action of
+        its status line and the host of its URL
+        """
+        action = status_action(status)
+        host = urlparse(info.get('url') or '').netloc or 'local'
+        timing = info.get('timing') or {}
+
+        with self.lock:
+            for entry in (self._entry('action', action),
+                          self._entry('host', host)):
+                if info.get('cache') == 'hit':
+                    entry['cached'] += 1
+                    continue
+                entry['requests'] += 1
+                if info.get('error') or info.get('status', 0) >= 400:
+                    entry['errors'] += 1
+                entry['bytes'] += info.get('bytes') or 0
+                entry['decoded'] += info.get('decoded') or 0
+                for phase in timing:
+                    entry['phases'][phase].add(timing[phase])
+
+    def summary(self):
+        """
+        returns {'action': {name: stats}, 'host': {name: stats}} where
+        stats has counts (bytes, cached, decoded, errors, requests) and
+        a latency summary (p50, p95, p99, ...) for each phase
+        """
+        summary = {}
+        with self.lock:
+            for kind in self.stats:
+                summary[kind] = {}
+                for name, entry in self.stats[kind].items():
+                    stats = dict((x, entry[x]) for x in entry
+                                 if x != 'phases')
+                    for phase, hist in entry['phases'].items():
+                        stats[phase] = hist.summary()
+                    summary[kind][name] = stats
+        return summary
+
+
+METRICS = Metrics()
+
+
+def status_action(status):
+    """
+    returns action of a request status line, or 'other'
+    """
+    return status_parts(status)[0]
+
+
+def status_parts(status):
+    """
+    returns (action, target) of a request status line, or ('other',
+    status)
+    """
+    match = STATUS_RE.match(status or '')
+    if match:
+        return match.group(1), match.group(2) or None
+    return 'other', status
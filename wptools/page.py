@@ -17,15 +17,55 @@ See also:
 - https://www.mediawiki.org/wiki/Manual:Page_table
 """
 
+import collections
+import json
+
 import html2text
 
 from . import core
+from . import request
 from . import utils
 
 from .restbase import WPToolsRESTBase
 from .wikidata import WPToolsWikidata
 
 
+# sources of data fields, cheapest first: action, or (action, query prop)
+FIELDS = {
+    'aliases': ['wikidata'],
+    'categories': ['querymore'],
+    'claims': ['wikidata'],
+    'contributors': ['querymore'],
+    'description': [('query', 'pageterms'), 'restbase', 'wikidata'],
+    'exhtml': ['restbase'],
+    'exrest': ['restbase'],
+    'extext': [('query', 'extracts')],
+    'extract': [('query', 'extracts')],
+    'files': ['querymore'],
+    'image': [('query', 'pageimages')],
+    'infobox': ['parse'],
+    'label': [('query', 'pageterms'), 'wikidata'],
+    'languages': ['querymore'],
+    'length': [('query', 'info')],
+    'links': ['parse'],
+    'modified': [('query', 'info'), 'restbase', 'wikidata'],
+    'pageid': ['query', 'parse', 'restbase', 'wikidata'],
+    'parsetree': ['parse'],
+    'properties': ['wikidata'],
+    'random': [('query', 'random')],
+    'title': ['query', 'parse', 'restbase', 'wikidata'],
+    'url': [('query', 'info'), 'restbase'],
+    'url_raw': [('query', 'info'), 'restbase'],
+    'views': ['querymore'],
+    'watchers': [('query', 'info')],
+    'what': ['claims'],
+    'wikibase': [('query', 'pageprops'), 'parse', 'restbase', 'wikidata'],
+    'wikidata': ['claims'],
+    'wikidata_url': [('query', 'pageprops'), 'parse', 'restbase',
+                     'wikidata'],
+    'wikitext': ['parse']}
+
+
 class WPToolsPage(WPToolsRESTBase,
                   WPToolsWikidata,
                   core.WPTools):
@@ -33,6 +73,8 @@ class WPToolsPage(WPToolsRESTBase,
     WPtools Page class, derived from wptools.core
     """
 
+    planned = None
+
     def __init__(self, *args, **kwargs):
         """
         Returns a WPToolsPage object
@@ -46,11 +88,16 @@ class WPToolsPage(WPToolsRESTBase,
         - [endpoint]: <str> RESTBase entry point (default=summary)
         - [lang]: <str> Mediawiki language code (default=en)
         - [pageid]: <int> Mediawiki pageid
+        - [parse]: <str> action=parse profile (default=full): lean
+          (without rendered HTML, often most of the response), lead
+          (lean, of section 0 only: infobox, but not all wikitext)
+        - [scheme]: <str> of all queries (default=https)
         - [variant]: <str> Mediawiki language variant
         - [wiki]: <str> alternative wiki site (default=wikipedia.org)
         - [wikibase]: <str> Wikidata database ID (e.g. 'Q1')
 
         Optional keyword {flags}:
+        - [reservoir]: <bool> get random title from a shared reservoir
         - [silent]: <bool> do not echo page data if True
         - [skip]: <list> skip actions in this list
         - [verbose]: <bool> verbose output to stderr if True
@@ -68,6 +115,10 @@ class WPToolsPage(WPToolsRESTBase,
         if pageid:
             self.params.update({'pageid': pageid})
 
+        parse = kwargs.get('parse')
+        if parse:
+            self.params.update({'parse': parse})
+
         wikibase = kwargs.get('wikibase')
         if wikibase:
             self.params.update({'wikibase': wikibase})
@@ -104,6 +155,129 @@ class WPToolsPage(WPToolsRESTBase,
                     if image.get('kind') != 'query-thumbnail':
                         self.data['image'][i].update(info)
 
+    def _get_graph(self, order, proxy, timeout):
+        """
+        requests actions concurrently, each as soon as it has what it
+        needs, and captures responses in the given order (as if they
+        were requested one after another)
+        """
+        multi = request.WPToolsMulti(self._request(proxy, timeout))
+        try:
+            self._get_queue(order, multi)
+            multi.run()
+        finally:
+            multi.abort()  # land flights led, if queueing failed
+
+    def _get_needs(self, action):
+        """
+        returns what action needs before it can be requested, or None
+        """
+        title = self.params.get('title')
+        pageid = self.params.get('pageid')
+
+        if action in ('parse', 'query', 'querymore'):
+            if not title and not pageid:
+                return 'title or pageid'
+        elif action == 'restbase':
+            if not title:
+                return 'title'
+        elif action == 'wikidata':
+            if not self.params.get('wikibase'):
+                return 'wikibase'
+        elif action == 'claims':
+            if not self.data.get('claims'):
+                return 'claims'
+
+    def _get_order(self):
+        """
+        returns actions of get() in the order they are captured
+        """
+        if self.params.get('wikibase'):
+            return ['wikidata', 'claims', 'query', 'parse', 'restbase']
+        return ['query', 'parse', 'wikidata', 'claims', 'restbase']
+
+    def _get_queue(self, order, multi, done=None):
+        """
+        queues the actions of _get_graph() on multi, and calls done()
+        when all responses are captured
+        """
+        order = list(order)
+        finished = []
+        landed = {}
+        started = set()
+
+        def arrive(action, response, info):
+            """
+            capture response, then start what it makes possible
+            """
+            request.curl_error(info)
+            landed[action] = (response, info)
+            advance()
+
+        def advance():
+            """
+            capture landed responses in order and start ready actions
+            """
+            progress = True
+            while progress:
+                progress = False
+
+                while order and order[0] in landed:
+                    action = order.pop(0)
+                    result = landed.pop(action)
+                    if result:
+                        self._set_response(action, *result)
+                    progress = True
+
+                for action in order:
+                    if action in started or self._get_needs(action):
+                        continue
+                    started.add(action)
+                    if not self._get_start(action, multi, arrive):
+                        landed[action] = None
+                        progress = True
+
+                # nothing left to provide what the next action needs
+                if order and order[0] not in started:
+                    action = order.pop(0)
+                    if action not in ('claims', 'wikidata'):
+                        raise ValueError("get_%s needs %s"
+                                         % (action, self._get_needs(action)))
+                    progress = True
+
+            if not order and done and not finished:
+                finished.append(True)
+                done()
+
+        advance()
+
+    def _get_start(self, action, multi, callback):
+        """
+        queues request for action on multi, returns False if cached
+        """
+        if action == 'claims' and 'claims' not in self.cache:
+            if not self._missing_claims():
+                self._set_claims_labels()
+                return False
+
+        if action == 'restbase':
+            endpoint = self._parse_endpoint('summary', self.params['title'])
+            self.params.update({'endpoint': endpoint})
+
+        qobj = self._prepare(action)
+        if qobj is None:
+            return False
+
+        if action == 'claims':
+            self._add_claims(qobj, multi, lambda response, info:
+                             callback(action, response, info))
+            return True
+
+        multi.add(self.cache[action]['query'], qobj.status,
+                  lambda response, info: callback(action, response, info))
+
+        return True
+
     def _missing_imageinfo(self):
         """
         returns page images missing info
@@ -125,15 +299,15 @@ class WPToolsPage(WPToolsRESTBase,
         if action == 'random':
             qstr = qobj.random()
         elif action == 'query':
-            qstr = qobj.query(title, pageid)
+            qstr = qobj.query(title, pageid, self.params.get('query_props'))
         elif action == 'querymore':
             qstr = qobj.querymore(title, pageid)
         elif action == 'parse':
-            qstr = qobj.parse(title, pageid)
+            qstr = qobj.parse(title, pageid, self.params.get('parse'))
         elif action == 'imageinfo':
             qstr = qobj.imageinfo(self.__get_image_files())
         elif action == 'claims':
-            qstr = qobj.claims(self.data['claims'].keys())
+            qstr = qobj.claims(self._missing_claims())
         elif action == 'wikidata':
             qstr = qobj.wikidata(title, wikibase)
         elif action == 'restbase':
@@ -160,7 +334,7 @@ class WPToolsPage(WPToolsRESTBase,
             self._set_claims_data()
         elif action == 'wikidata':
             self._set_wikidata()
-            if self.data.get('claims'):
+            if self.data.get('claims') and not self.flags.get('defer_claims'):
                 self.get_claims(show=False)
         elif action == 'restbase':
             self._set_restbase_data()
@@ -234,7 +408,7 @@ class WPToolsPage(WPToolsRESTBase,
         data = self._load_response(action)
         page = data['query']['pages'][0]
 
-        if action == 'query':
+        if action == 'query' and data['query'].get('random'):
             self.data['random'] = data['query']['random'][0]["title"]
 
         self._set_query_data_fast_1(page)  # avoid pylint too-many-branches
@@ -388,50 +562,152 @@ class WPToolsPage(WPToolsRESTBase,
         if self.data.get('wikibase'):
             self.params['wikibase'] = self.data.get('wikibase')
 
-    def get(self, show=True, proxy=None, timeout=0):
+    def aget(self, show=True, proxy=None, timeout=0):
         """
-        Make Mediawiki, RESTBase, and Wikidata requests for page data
-        some sequence of:
-        - get_parse()
-        - get_query()
-        - get_restbase()
-        - get_wikidata()
+        Awaitable get() on the asyncio event loop (python 3.5+)
+        see wptools.aio
         """
-        wikibase = self.params.get('wikibase')
+        return self._aio().get_page(self, show, proxy, timeout)
 
-        if wikibase:
+    def aget_imageinfo(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_imageinfo() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.data.get('image'):
+            raise ValueError("get_imageinfo needs a page image")
 
-            self.flags['defer_imageinfo'] = True
+        actions = ['imageinfo']
+        if not self._missing_imageinfo() and 'imageinfo' in self.cache:
+            utils.stderr("complete imageinfo in cache", self.flags['silent'])
+            actions = []
 
-            self.get_wikidata(False, proxy, timeout)
-            self.get_query(False, proxy, timeout)
-            self.get_parse(False, proxy, timeout)
+        return self._aio().get(self, actions, show, proxy, timeout)
 
-            self.flags['defer_imageinfo'] = False
+    def aget_more(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_more() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        return self.aget_querymore(show, proxy, timeout)
 
-            self.get_restbase('summary', False, proxy, timeout)
+    def aget_parse(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_parse() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise ValueError("get_parse needs title or pageid")
 
-            if show:
-                self.show()
+        return self._aio().get(self, 'parse', show, proxy, timeout)
 
-        else:
+    def aget_query(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_query() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise ValueError("get_query needs title or pageid")
+
+        return self._aio().get(self, 'query', show, proxy, timeout)
+
+    def aget_querymore(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_querymore() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.params.get('title') and not self.params.get('pageid'):
+            raise ValueError("get_query needs title or pageid")
+
+        return self._aio().get(self, 'querymore', show, proxy, timeout)
+
+    def aget_random(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_random() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        return self._aio().get_random(self, show, proxy, timeout)
 
-            self.flags['defer_imageinfo'] = True
+    @classmethod
+    def from_query(cls, title, data, cache=None, **kwargs):
+        """
+        Returns a WPToolsPage object with get_query() data captured
+        from (a slice of) an action=query response for many pages
+
+        Arguments:
+        - title: <str> Mediawiki page title
+        - data: <dict> action=query response with only this page
+        - [cache]: <dict> query (string) and info to cache with it
+
+        Optional keyword {params} and {flags} as for WPToolsPage()
+        """
+        obj = cls(title, **kwargs)
 
-            self.get_query(False, proxy, timeout)
-            self.get_parse(False, proxy, timeout)
+        obj.cache['query'] = dict(cache or {})
+        obj.cache['query']['response'] = json.dumps(data)
 
-            if not self.data.get('wikibase'):
-                self.flags['skip'] = ['wikidata']
+        obj._set_query_data('query')
+        obj._update_params()
 
-            self.get_wikidata(False, proxy, timeout)
+        return obj
 
+    def get(self, show=True, proxy=None, timeout=0, fields=None):
+        """
+        Make Mediawiki, RESTBase, and Wikidata requests for page data
+        concurrently, each as soon as it has what it needs:
+        - get_query(), get_parse(): title or pageid
+        - get_restbase('summary'): title
+        - get_wikidata(): wikibase (given, or from query or parse)
+        - get_claims(): claims from wikidata
+        - get_imageinfo(): last and once, for images missing info
+
+        Optional arguments:
+        - [show]: <bool> echo page data if true
+        - [proxy]: <str> use this HTTP proxy
+        - [timeout]: <int> timeout in seconds (0=wait forever)
+        - [fields]: <list> only get these data fields, with the fewest
+          requests (see plan()), e.g. ['extract', 'image', 'wikibase']
+
+        With fields, the requests made are kept in planned, as
+        {action: query string}, and action=parse is lean (see parse
+        param) unless given.
+        """
+        order = self._get_order()
+        profile = None
+        if fields is not None:
+            plan = self.plan(fields)
+            order = list(plan)
+            if 'query' in plan:
+                self.params['query_props'] = plan['query']
+            if 'parse' in plan and not self.params.get('parse'):
+                profile = 'lean'
+                if not set(fields) & set(['links', 'parsetree', 'wikitext']):
+                    profile = 'lead'
+                self.params['parse'] = profile
+
+        self.flags['defer_claims'] = True
+        self.flags['defer_imageinfo'] = True
+
+        try:
+            self._get_graph(order, proxy, timeout)
+        finally:
+            self.flags['defer_claims'] = False
             self.flags['defer_imageinfo'] = False
+            self.params.pop('query_props', None)
+            if profile:
+                self.params.pop('parse')
 
-            self.get_restbase('summary', False, proxy, timeout)
+        if fields is None or 'image' in fields:
+            if self._missing_imageinfo():
+                self.get_imageinfo(False, proxy, timeout)
+                order.append('imageinfo')
 
-            if show:
-                self.show()
+        if fields is not None:
+            self.planned = collections.OrderedDict(
+                (x, self.query(x)) for x in order if x in self.cache)
+
+        if show:
+            self.show()
 
         return self
 
@@ -576,11 +852,20 @@ class WPToolsPage(WPToolsRESTBase,
         Data captured:
         - pageid: <int> Wikipedia database ID
         - title: <str> article title
+
+        With the reservoir flag, the title comes from a reservoir of
+        random titles (see wptools.reservoir) without a request.
         """
-        self._get('random', show, proxy, timeout)
+        if self.flags.get('reservoir'):
+            self.data.update(self._reserved(0, proxy, timeout))
+            self._update_params()
+            if show:
+                self.show()
+        else:
+            self._get('random', show, proxy, timeout)
 
-        # flush cache to allow repeated random requests
-        del self.cache['random']
+            # flush cache to allow repeated random requests
+            del self.cache['random']
 
         return self
 
@@ -598,3 +883,52 @@ class WPToolsPage(WPToolsRESTBase,
         for img in self.data['image']:
             if token in img.get('kind'):
                 return img
+
+    def plan(self, fields):
+        """
+        Returns {action: query props (or None)} of the fewest requests
+        to get data fields, in the order get() captures them
+
+        Each field comes from its cheapest source (see FIELDS), or one
+        already planned, or wikidata given a wikibase. Props are added
+        to a single action=query.
+        """
+        unknown = [x for x in fields if x not in FIELDS]
+        if unknown:
+            raise ValueError("unknown fields: %s" % ', '.join(unknown))
+
+        plan = {}
+        for field in sorted(fields, key=lambda x: len(FIELDS[x])):
+            sources = [x if isinstance(x, tuple) else (x, None)
+                       for x in FIELDS[field]]
+            if self.params.get('wikibase'):  # wikidata goes first
+                sources.sort(key=lambda x: x[0] != 'wikidata')
+            planned = [x for x in sources if x[0] in plan]
+            action, prop = (planned or sources)[0]
+            plan.setdefault(action, set())
+            if prop:
+                plan[action].add(prop)
+
+        if 'claims' in plan:
+            plan.setdefault('wikidata', set())
+
+        if 'wikidata' in plan and not self.params.get('wikibase'):
+            if not set(plan) & set(['parse', 'restbase']):
+                plan.setdefault('query', set()).add('pageprops')
+
+        if not self.params.get('title') and not self.params.get('pageid'):
+            if set(plan) & set(['parse', 'query', 'querymore', 'restbase']):
+                plan.setdefault('wikidata', set())
+
+        order = self._get_order() + ['querymore']
+        return collections.OrderedDict(
+            (x, sorted(plan[x]) if x == 'query' else None)
+            for x in order if x in plan)
+
+    def set_entity(self, entity, cache=None):
+        """
+        Capture Wikidata from an entity (of a wbgetentities response
+        for many items) as get_wikidata() does, without get_claims()
+        """
+        super(WPToolsPage, self).set_entity(entity, cache)
+        self._update_params()
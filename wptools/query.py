@@ -25,18 +25,38 @@ from string import Template
 import random
 
 
+# action=parse props by profile: lean drops rendered HTML (text) and
+# displaytitle, never captured; lead is lean for section 0 (infobox)
+PARSE_PROFILES = {
+    'full': 'text|iwlinks|parsetree|wikitext|displaytitle|properties',
+    'lead': 'iwlinks|parsetree|wikitext|properties',
+    'lean': 'iwlinks|parsetree|wikitext|properties'}
+
+# params of each prop (or list) of WPToolsQuery.QUERY
+QUERY_PROPS = {'extracts': ('&exintro', '&exlimit=max'),
+               'info': ('&inprop=url|watchers',),
+               'pageimages': ('&pithumbsize=240',),
+               'pageprops': ('&ppprop=wikibase_item',),
+               'pageterms': (),
+               'random': ('&list=random', '&rnlimit=1', '&rnnamespace=0')}
+
+
 class WPToolsQuery(object):
     """
     WPToolsQuery class
     """
 
+    MAXLAG = 5  # seconds of replica lag beyond which the API refuses
+    MAXTITLES = 50  # titles (or ids) per request
     MAXWIDTH = 72
     RPAD = 4
+    SITES = None  # site.SiteMatrix to reject unknown wikis
 
     IMAGEINFO = Template((
         "${WIKI}/w/api.php?action=query"
         "&format=json"
         "&formatversion=2"
+        "&maxlag=${MAXLAG}"
         "&iiprop=size|url|timestamp"
         "&prop=imageinfo"
         "&titles=${FILES}"))
@@ -45,12 +65,14 @@ class WPToolsQuery(object):
         "${WIKI}/w/api.php?action=query"
         "&format=json"
         "&formatversion=2"
+        "&maxlag=${MAXLAG}"
         "&list=${LIST}"))
 
     PARSE = Template((
         "${WIKI}/w/api.php?action=parse"
         "&format=json"
         "&formatversion=2"
+        "&maxlag=${MAXLAG}"
         "&contentmodel=text"
         "&disableeditsection="
         "&disablelimitreport="
@@ -64,6 +86,7 @@ class WPToolsQuery(object):
         "&exintro"
         "&format=json"
         "&formatversion=2"
+        "&maxlag=${MAXLAG}"
         "&inprop=url|watchers"
         "&list=random"
         "&pithumbsize=240"
@@ -80,6 +103,7 @@ class WPToolsQuery(object):
         "&clshow=!hidden"
         "&format=json"
         "&formatversion=2"
+        "&maxlag=${MAXLAG}"
         "&imlimit=500"
         "&lllimit=500"
         "&pclimit=500"
@@ -91,16 +115,18 @@ class WPToolsQuery(object):
         "${WIKI}/w/api.php?action=wbgetentities"
         "&format=json"
         "&formatversion=2"
+        "&maxlag=${MAXLAG}"
         "&languages=${LANG}"
         "&props=${PROPS}"
         "&redirects=yes"))
 
     lang = None
+    scheme = 'https'
     status = None
     variant = None
     wiki = None
 
-    def __init__(self, lang='en', variant=None, wiki=None):
+    def __init__(self, lang='en', variant=None, wiki=None, scheme=None):
         """
         Returns a WPToolsQuery object
 
@@ -108,24 +134,34 @@ class WPToolsQuery(object):
         - [lang=en]: <str> Mediawiki language code
         - [variant=None]: <str> language variant
         - [wiki=None]: <str> alternative wiki site
+        - [scheme=https]: <str> of all queries, e.g. http to reach a
+          local stand-in via proxy (a wiki given as URL keeps its own)
         """
         self.lang = lang
         self.variant = variant
+        self.scheme = scheme or self.scheme
 
         self.wiki = wiki or "%s.wikipedia.org" % self.lang
         self.domain = domain_name(self.wiki)
         self.uri = self.wiki_uri(self.wiki)
 
+        if self.SITES is not None and not self.SITES.find(self.domain):
+            raise ValueError("unknown wiki: %s" % self.domain)
+
     def category(self, title, pageid=None, limit=500, namespace=None):
         """
-        Returns category query string
+        Returns category query string, of members in namespace (or
+        list of namespaces) if given
         """
-        query = self.LIST.substitute(WIKI=self.uri, LIST='categorymembers')
+        query = self.LIST.substitute(WIKI=self.uri, LIST='categorymembers',
+                                     MAXLAG=self.MAXLAG)
 
         if limit:
             query += "&cmlimit=%d" % limit
 
-        if namespace is not None:
+        if isinstance(namespace, (list, tuple)):
+            query += "&cmnamespace=" + '|'.join(str(x) for x in namespace)
+        elif namespace is not None:
             query += "&cmnamespace=%d" % namespace
 
         if title and pageid:
@@ -141,6 +177,37 @@ class WPToolsQuery(object):
 
         return query
 
+    def categorypages(self, title, pageid=None, limit=20, namespace=0):
+        """
+        Returns action=query query string for QUERY props of category
+        members (generator=categorymembers), limit pages at a time
+        """
+        query = self.QUERY.substitute(WIKI=self.uri, TITLES='',
+                                      MAXLAG=self.MAXLAG)
+        query = query_props(query, [x for x in QUERY_PROPS if x != 'random'])
+        query = query.replace('&titles=', '&exlimit=max'
+                              '&generator=categorymembers'
+                              '&gcmlimit=%d' % limit)
+
+        if namespace is not None:
+            query += "&gcmnamespace=%d" % namespace
+
+        if title and pageid:
+            title = None
+
+        if title:
+            query += "&gcmtitle=" + safequote(title)
+
+        if pageid:
+            query += "&gcmpageid=%d" % pageid
+
+        if self.variant:
+            query += '&variant=' + self.variant
+
+        self.set_status('categorypages', pageid or title)
+
+        return query
+
     def claims(self, qids):
         """
         Returns Wikidata claims query string
@@ -151,6 +218,7 @@ class WPToolsQuery(object):
         query = self.WIKIDATA.substitute(
             WIKI=self.uri,
             LANG=self.variant or self.lang,
+            MAXLAG=self.MAXLAG,
             PROPS='labels')
 
         qids = '|'.join(qids)
@@ -168,14 +236,26 @@ class WPToolsQuery(object):
 
         self.set_status('imageinfo', files)
 
-        return self.IMAGEINFO.substitute(WIKI=self.uri, FILES=files)
+        return self.IMAGEINFO.substitute(WIKI=self.uri, FILES=files,
+                                         MAXLAG=self.MAXLAG)
 
-    def parse(self, title, pageid=None):
+    def parse(self, title, pageid=None, profile=None):
         """
-        Returns Mediawiki action=parse query string
+        Returns Mediawiki action=parse query string, with props of
+        profile (of PARSE_PROFILES, default=full)
         """
+        if profile not in PARSE_PROFILES and profile is not None:
+            raise ValueError("unknown parse profile: %s" % profile)
+
         qry = self.PARSE.substitute(WIKI=self.uri,
-                                    PAGE=safequote(title) or pageid)
+                                    PAGE=safequote(title) or pageid,
+                                    MAXLAG=self.MAXLAG)
+
+        if profile and profile != 'full':
+            qry = qry.replace(PARSE_PROFILES['full'],
+                              PARSE_PROFILES[profile])
+            if profile == 'lead':
+                qry += '&section=0'
 
         if pageid and not title:
             qry = qry.replace('&page=', '&pageid=').replace('&redirects', '')
@@ -187,12 +267,21 @@ class WPToolsQuery(object):
 
         return qry
 
-    def query(self, titles, pageids=None):
+    def query(self, titles, pageids=None, props=None):
         """
         Returns MediaWiki action=query query string
+        for a title, or list of up to MAXTITLES titles,
+        with only props (of QUERY_PROPS) if given
         """
-        query = self.QUERY.substitute(WIKI=self.uri,
-                                      TITLES=safequote(titles) or pageids)
+        if isinstance(titles, list):
+            titles = '|'.join([safequote(x) for x in titles])
+            query = self.QUERY.substitute(WIKI=self.uri, TITLES=titles,
+                                          MAXLAG=self.MAXLAG)
+            query += '&exlimit=max'
+        else:
+            query = self.QUERY.substitute(WIKI=self.uri,
+                                          TITLES=safequote(titles) or pageids,
+                                          MAXLAG=self.MAXLAG)
 
         if pageids and not titles:
             query = query.replace('&titles=', '&pageids=')
@@ -200,6 +289,9 @@ class WPToolsQuery(object):
         if self.variant:
             query += '&variant=' + self.variant
 
+        if props is not None:
+            query = query_props(query, props)
+
         self.set_status('query', titles or pageids)
 
         return query
@@ -211,7 +303,8 @@ class WPToolsQuery(object):
         """
         query = self.QUERYMORE.substitute(
             WIKI=self.uri,
-            TITLES=safequote(titles) or pageids)
+            TITLES=safequote(titles) or pageids,
+            MAXLAG=self.MAXLAG)
 
         if pageids and not titles:
             query = query.replace('&titles=', '&pageids=')
@@ -223,12 +316,13 @@ class WPToolsQuery(object):
 
         return query
 
-    def random(self, namespace=0):
+    def random(self, namespace=0, limit=1):
         """
-        Returns query string for random page
+        Returns query string for (limit) random pages
         """
-        query = self.LIST.substitute(WIKI=self.uri, LIST='random')
-        query += "&rnlimit=1&rnnamespace=%d" % namespace
+        query = self.LIST.substitute(WIKI=self.uri, LIST='random',
+                                     MAXLAG=self.MAXLAG)
+        query += "&rnlimit=%d&rnnamespace=%d" % (limit, namespace)
 
         emoji = [
             u'\U0001f32f',  # burrito or wrap
@@ -249,6 +343,26 @@ class WPToolsQuery(object):
 
         return query
 
+    def randompages(self, namespace=0, limit=20):
+        """
+        Returns action=query query string for QUERY props of limit
+        random pages (generator=random)
+        """
+        query = self.QUERY.substitute(WIKI=self.uri, TITLES='',
+                                      MAXLAG=self.MAXLAG)
+        query = query_props(query, [x for x in QUERY_PROPS if x != 'random'])
+        query = query.replace('&titles=', '&exlimit=max'
+                              '&generator=random'
+                              '&grnlimit=%d' % limit)
+        query += "&grnnamespace=%d" % namespace
+
+        if self.variant:
+            query += '&variant=' + self.variant
+
+        self.set_status('randompages', namespace)
+
+        return query
+
     def restbase(self, endpoint):
         """
         Returns RESTBase query string
@@ -301,7 +415,7 @@ class WPToolsQuery(object):
             query += '&pvisdays=%d' % viewdays  # meta=siteviews
             self.set_status('query', 'siteviews:uniques')
 
-        query += '&format=json&formatversion=2'
+        query += '&format=json&formatversion=2&maxlag=%d' % self.MAXLAG
 
         if not query:
             raise ValueError("Could not form query")
@@ -314,11 +428,12 @@ class WPToolsQuery(object):
         """
         if wiki.startswith('http'):
             return wiki
-        return "https://" + self.domain
+        return "%s://%s" % (self.scheme, self.domain)
 
     def wikidata(self, title, wikibase=None):
         """
         Returns Wikidata query string
+        for a title or wikibase, or list of up to MAXTITLES of either
         """
         self.domain = 'www.wikidata.org'
         self.uri = self.wiki_uri(self.domain)
@@ -326,12 +441,19 @@ class WPToolsQuery(object):
         query = self.WIKIDATA.substitute(
             WIKI=self.uri,
             LANG=self.variant or self.lang,
+            MAXLAG=self.MAXLAG,
             PROPS="aliases|info|claims|descriptions|labels|sitelinks")
 
+        if isinstance(wikibase, list):
+            wikibase = '|'.join(wikibase)
+        if isinstance(title, list):
+            title = '|'.join([safequote(x) for x in title])
+        elif title:
+            title = safequote(title)
+
         if wikibase:
             query += "&ids=%s" % wikibase
         elif title:
-            title = safequote(title)
             query += "&sites=%swiki" % self.lang
             query += "&titles=%s" % title
 
@@ -349,6 +471,23 @@ def domain_name(wiki):
     return wiki.split('/')[0]
 
 
+def query_props(query, props):
+    """
+    Returns action=query query string (QUERY) with only props, and
+    without the params of the others
+    """
+    for prop in QUERY_PROPS:
+        if prop not in props:
+            for param in QUERY_PROPS[prop]:
+                query = query.replace(param, '')
+
+    prop = '|'.join(x for x in sorted(props) if x != 'random')
+    prop = "&prop=%s" % prop if prop else ''
+
+    return query.replace('&prop=extracts|info|pageimages|pageprops|pageterms',
+                         prop)
+
+
 def safequote(string):
     """
     Try to UTF-8 encode and urllib quote string
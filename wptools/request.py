@@ -11,12 +11,228 @@ from __future__ import print_function
 
 from io import BytesIO
 
+import collections
 import sys
+import threading
+import time
+
+try:  # python2
+    from urlparse import urlparse
+except ImportError:  # python3
+    from urllib.parse import urlparse
 
 import certifi
 import pycurl
 
 from . import __title__, __contact__, __version__
+from . import cache
+from . import throttle
+
+from .metrics import METRICS, status_parts
+from .tracing import TRACER
+
+ENCODING = ''  # accept any encoding libcurl decodes, e.g. gzip, br
+MAXCONN = 8
+MAXIDLE = 8
+
+
+class CurlPool(object):
+    """
+    Thread-safe pool of pycurl handles keyed by host and settings
+
+    Each handle keeps its connections alive between transfers, so
+    borrowing a pooled handle for the same host skips the TCP and
+    TLS handshakes.
+    """
+
+    counts = None
+    idle = None
+    lock = None
+    maxidle = MAXIDLE
+
+    def __init__(self, maxidle=MAXIDLE):
+        """
+        Returns a CurlPool object.
+
+        Arguments:
+        - [maxidle]: <int> idle handles to keep per key
+        """
+        self.maxidle = maxidle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.counts = {'borrowed': 0,
+                       'connected': 0,
+                       'created': 0,
+                       'reused': 0}
+
+    @staticmethod
+    def key(url, proxy=None, timeout=0, verbose=False):
+        """
+        returns pool key (host, proxy, timeout, verbose) for URL
+        """
+        if isinstance(url, bytes):
+            url = url.decode('utf-8')
+        url = urlparse(url)
+        host = "%s://%s" % (url.scheme, url.netloc)
+        return (host, proxy, timeout or 0, bool(verbose))
+
+    def acquire(self, key):
+        """
+        returns an idle handle for key, or a new one
+        """
+        with self.lock:
+            self.counts['borrowed'] += 1
+            handles = self.idle.get(key)
+            if handles:
+                return handles.pop()
+            self.counts['created'] += 1
+        return curl_handle(*key[1:])
+
+    def clear(self):
+        """
+        close and forget all idle handles
+        """
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for handles in idle.values():
+            for crl in handles:
+                crl.close()
+
+    def release(self, key, crl):
+        """
+        return handle to the pool, or close it if the pool is full
+        """
+        with self.lock:
+            handles = self.idle.setdefault(key, [])
+            if len(handles) < self.maxidle:
+                handles.append(crl)
+                return
+        crl.close()
+
+    def stats(self):
+        """
+        returns pool counters:
+        - borrowed: handles handed out
+        - connected: new connections made (TCP+TLS handshakes)
+        - created: handles created
+        - idle: handles waiting in the pool
+        - reused: transfers over a kept-alive connection
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats['idle'] = sum(len(x) for x in self.idle.values())
+        return stats
+
+    def tally(self, crl):
+        """
+        count new versus reused connections after a transfer
+        """
+        connects = crl.getinfo(pycurl.NUM_CONNECTS)
+        with self.lock:
+            if connects:
+                self.counts['connected'] += connects
+            else:
+                self.counts['reused'] += 1
+
+
+POOL = CurlPool()
+
+
+class Flight(object):
+    """
+    A request in flight, and its outcome once landed
+    """
+
+    body = None
+    error = None
+    event = None
+    info = None
+    key = None
+    notify = None
+    thread = None
+
+    def __init__(self, key=None):
+        self.key = key
+        self.event = threading.Event()
+        self.notify = []
+        self.thread = threading.current_thread().ident
+
+    def result(self):
+        """
+        returns (body, own copy of info) of landed flight, or raises
+        its error
+        """
+        if self.error is not None:
+            raise self.error
+        info = dict(self.info or {})
+        info['coalesced'] = True
+        return self.body, info
+
+
+class Flights(object):
+    """
+    Thread-safe registry of requests in flight by (normalized) URL, so
+    identical requests made at the same time share one transfer
+    """
+
+    counts = None
+    flights = None
+    lock = None
+
+    def __init__(self):
+        """
+        Returns a Flights object.
+        """
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.counts = {'coalesced': 0, 'flights': 0}
+
+    def join(self, url, notify=None, blocking=False):
+        """
+        returns (flight, True) if caller is to make (and land) the
+        request, or (flight, False) if it is in flight already, calling
+        notify() when it lands. Blocking callers do not join flights
+        of their own thread.
+        """
+        key = cache.url_key(url)
+        with self.lock:
+            flight = self.flights.get(key)
+            ident = threading.current_thread().ident
+            if flight is None or (blocking and flight.thread == ident):
+                flight = Flight(key)
+                self.flights.setdefault(key, flight)
+                self.counts['flights'] += 1
+                return flight, True
+            if notify:
+                flight.notify.append(notify)
+            self.counts['coalesced'] += 1
+            return flight, False
+
+    def land(self, flight, body=None, info=None, error=None):
+        """
+        set outcome of flight, and wake its followers
+        """
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            flight.body = body
+            flight.info = info
+            flight.error = error
+            flight.event.set()
+        for notify in flight.notify:
+            notify()
+
+    def stats(self):
+        """
+        returns counters: flights (transfers made), coalesced (requests
+        that shared one), and active (in flight now)
+        """
+        with self.lock:
+            return dict(self.counts, active=len(self.flights))
+
+
+FLIGHTS = Flights()
 
 
 class WPToolsRequest(object):
@@ -24,28 +240,67 @@ class WPToolsRequest(object):
     WPToolsRequest class
     """
 
+    _cobj = None
+    cassette = None
+    disk = None
+    flights = None
     info = None
+    metrics = None
+    pool = None
+    proxy = None
+    scheduler = None
     silent = False
+    timeout = None
+    ttl = None
 
-    def __init__(self, silent=False, verbose=False, proxy=None, timeout=None):
+    def __init__(self, silent=False, verbose=False, proxy=None, timeout=None,
+                 pool=None, disk=None, scheduler=None, flights=None,
+                 metrics=None, cassette=None, ttl=None):
         """
         Returns a WPToolsRequest object.
 
         Arguments:
+        - [cassette]: <Cassette> record/replay (default=cache.CASSETTE)
+        - [disk]: <DiskCache> response cache (default=cache.DISK)
+        - [flights]: <Flights> coalescing (default=request.FLIGHTS)
+        - [metrics]: <Metrics> recorder (default=metrics.METRICS)
+        - [pool]: <CurlPool> handle pool (default=request.POOL)
+        - [scheduler]: <Scheduler> pacing (default=throttle.SCHEDULER)
         - [proxy]: <str> HTTP proxy to use
         - [silent]: <bool> silent if True
         - [timeout]: <int> connection timeout (0=wait forever)
+        - [ttl]: <int> seconds responses stay fresh on disk
+          (default=disk ttl)
         - [verbose]: <bool> verbose if True
         """
         self.silent = silent
         self.verbose = verbose
-        self.curl_setup(proxy, timeout)
+        self.proxy = proxy
+        self.timeout = timeout
+        self.pool = pool or POOL
+        self.flights = flights or FLIGHTS
+        self.metrics = metrics or METRICS
+        self.disk = disk if disk is not None else cache.DISK
+        self.cassette = cassette if cassette is not None else cache.CASSETTE
+        self.scheduler = (scheduler if scheduler is not None
+                          else throttle.SCHEDULER)
+        self.ttl = ttl
 
     def __del__(self):
         """
-        Close HTTP request
+        Close HTTP request (pooled handles stay open)
         """
-        self.cobj.close()
+        if self._cobj is not None:
+            self._cobj.close()
+
+    @property
+    def cobj(self):
+        """
+        returns (unpooled) pycurl handle, set up on first use
+        """
+        if self._cobj is None:
+            self.curl_setup(self.proxy, self.timeout)
+        return self._cobj
 
     def get(self, url, status):
         """
@@ -58,70 +313,565 @@ class WPToolsRequest(object):
         #                  headers={'User-Agent': self.user_agent})
         # return r.text
 
-        crl = self.cobj
+        entry = self.cached(url, status)
+        if entry and entry['fresh']:
+            self.info = entry['info']
+            return entry['body']
+
+        flight, leader = self.flights.join(url, blocking=True)
+        if not leader:
+            flight.event.wait()
+            body, self.info = flight.result()
+            return body
+
+        try:
+            body = self.transfer(url, status, entry)
+        except BaseException as exc:
+            self.flights.land(flight, error=exc)
+            raise
+
+        self.flights.land(flight, body, self.info)
+
+        return body
+
+    def get_many(self, urls, status=None, maxconn=MAXCONN):
+        """
+        GET many URLs concurrently (in this thread) via pycurl.CurlMulti
+        returns list of (body, info) in the order of urls
+
+        Arguments:
+        - urls: <list> URLs to GET
+        - [status]: <list> status line to echo for each URL
+        - [maxconn]: <int> maximum concurrent transfers
+
+        A failed transfer has body None and info['error'] set
+        (see curl_error()).
+        """
+        results = [None] * len(urls)
+
+        multi = WPToolsMulti(self, maxconn)
+        for i, url in enumerate(urls):
+            multi.add(url, status[i] if status else url,
+                      lambda body, info, i=i: results.__setitem__(
+                          i, (body, info)))
+        multi.run()
+
+        return results
+
+    def admit(self, url):
+        """
+        returns 0 if a transfer to url may start now (see scheduler),
+        or else seconds to wait
+        """
+        if self.scheduler is None:
+            return 0
+        return self.scheduler.admit(url)
+
+    def borrow(self, url, status=None, entry=None):
+        """
+        returns (pool key, pooled handle) set up to GET url, only if
+        modified since (stale disk cache) entry
+        """
+        key = self.pool.key(url, self.proxy, self.timeout,
+                            self.verbose and not self.silent)
+        crl = self.pool.acquire(key)
 
         try:
             crl.setopt(pycurl.URL, url)
         except UnicodeEncodeError:
             crl.setopt(pycurl.URL, url.encode('utf-8'))
 
+        crl.setopt(pycurl.HTTPHEADER, conditions(entry))
+
         if not self.silent:
             print(status, file=sys.stderr)
 
-        return self.curl_perform(crl)
+        return key, crl
 
-    def curl_perform(self, crl):
+    def cached(self, url, status=None):
         """
-        performs HTTP GET and returns body of response
+        returns replayed (cassette) or disk cache entry {body, info,
+        fresh} for url, or None; raises LookupError if replaying or
+        offline and url is not there
         """
-        bfr = BytesIO()
-        crl.setopt(crl.WRITEFUNCTION, bfr.write)
-        crl.perform()
-        info = curl_info(crl)
+        if self.cassette is not None and not self.cassette.recording:
+            return self.replay(url, status)
+
+        if self.disk is None:
+            return
+
+        entry = self.disk.get(url, stale=True)
+        if entry is None:
+            if self.disk.offline:
+                raise LookupError("offline: %s" % url)
+            return
+
+        entry['fresh'] = self.disk.offline or entry['expires'] > time.time()
+        if entry['fresh']:
+            if not self.silent:
+                print("%s (cached)" % status, file=sys.stderr)
+            entry['info']['cache'] = 'hit'
+            self.measure(entry['info'], status)
+            if self.cassette is not None:
+                self.cassette.record(url, entry['body'], entry['info'])
+
+        return entry
+
+    def curl_done(self, crl, bfr, hdr=None):
+        """
+        captures info (and headers) of finished transfer and returns
+        body of response
+        """
+        self.pool.tally(crl)
+        body = bfr.getvalue()
+        bfr.close()
+        info = curl_info(crl, curl_headers(hdr.getvalue()) if hdr else None,
+                         len(body))
         if info:
             if self.verbose and not self.silent:
                 for item in sorted(info):
                     print("  %s: %s" % (item, info[item]), file=sys.stderr)
             self.info = info
-        body = bfr.getvalue()
-        bfr.close()
         return body
 
+    def curl_perform(self, crl):
+        """
+        performs HTTP GET and returns body of response
+        """
+        bfr = BytesIO()
+        hdr = BytesIO()
+        crl.setopt(crl.WRITEFUNCTION, bfr.write)
+        crl.setopt(crl.HEADERFUNCTION, hdr.write)
+        crl.perform()
+        return self.curl_done(crl, bfr, hdr)
+
     def curl_setup(self, proxy=None, timeout=0):
         """
         set curl options
         """
+        if self._cobj is not None:
+            self._cobj.close()
+        self._cobj = curl_handle(proxy, timeout,
+                                 self.verbose and not self.silent)
 
-        crl = pycurl.Curl()
-        crl.setopt(pycurl.USERAGENT, user_agent())
-        crl.setopt(pycurl.FOLLOWLOCATION, True)
-        crl.setopt(pycurl.CAINFO, certifi.where())
+    def measure(self, info, status=None):
+        """
+        records info of finished transfer (or cache hit) in metrics,
+        and traces transfer (see tracing)
+        """
+        if self.metrics is not None:
+            self.metrics.record(info, status)
+
+        if TRACER.hooks and info.get('cache') != 'hit':
+            action, target = status_parts(status)
+            TRACER.stop('request', (info.get('timing') or {}).get('total', 0),
+                        action, target, info.get('bytes'))
+
+    def retry(self, url, info, body=None, attempt=0):
+        """
+        counts finished transfer (see scheduler), returns True if it
+        was throttled and is to be retried
+        """
+        if self.scheduler is None:
+            return False
+
+        delay = self.scheduler.done(url, info, body, attempt)
+        if delay is None or attempt >= throttle.MAXRETRY:
+            return False
+
+        self.scheduler.retried(url)
+        if not self.silent:
+            print("+ retry in %.1fs (%s) %s"
+                  % (delay, info.get('status'), url), file=sys.stderr)
+        return True
+
+    def replay(self, url, status=None):
+        """
+        returns cassette entry {body, info, fresh} for url, raises
+        LookupError if it is missing
+        """
+        found = self.cassette.get(url)
+        if found is None:
+            raise LookupError("not in cassette: %s" % url)
+
+        if not self.silent:
+            print("%s (replay)" % status, file=sys.stderr)
+
+        body, info = found
+        info['cache'] = 'replay'
+
+        return {'body': body, 'fresh': True, 'info': info}
+
+    def settle(self, url, body, info, entry=None):
+        """
+        returns (body, info) of response, and records it (cassette)
+        """
+        body, info = self.store(url, body, info, entry)
+
+        if self.cassette is not None and info and not info.get('error'):
+            self.cassette.record(url, body, info)
+
+        return body, info
+
+    def store(self, url, body, info, entry=None):
+        """
+        returns (body, info) of response, the (stale) disk cache entry
+        body if not modified, and keeps successful responses on disk
+        """
+        if self.disk is None or not info or info.get('error'):
+            return body, info
+
+        if entry and info.get('status') == 304:
+            cinfo = dict(entry['info'])
+            cinfo['headers'] = dict(cinfo.get('headers') or {},
+                                    **info.get('headers') or {})
+            cinfo.pop('cache', None)
+            self.disk.set(url, entry['body'], cinfo, self.ttl)
+            info['cache'] = 'revalidated'
+            return entry['body'], info
+
+        if throttle.backoff(info, body) is not None:
+            return body, info
+
+        if info.get('status') in (0, 200):  # 0: not HTTP, e.g. file://
+            self.disk.set(url, body, info, self.ttl)
+
+        return body, info
 
-        if proxy:
-            crl.setopt(pycurl.PROXY, proxy)
-        if timeout:  # 0 = wait forever
-            crl.setopt(pycurl.CONNECTTIMEOUT, timeout)
-            crl.setopt(pycurl.TIMEOUT, timeout)
-        if self.verbose and not self.silent:
-            crl.setopt(pycurl.VERBOSE, True)
+    def transfer(self, url, status, entry=None):
+        """
+        GET url (with retries), returns body of response
+        """
+        attempt = 0
+        while True:
+            if self.scheduler is not None:
+                self.scheduler.wait(url)
+
+            key, crl = self.borrow(url, status, entry)
+
+            try:
+                body = self.curl_perform(crl)
+            except pycurl.error as exc:
+                info = {'error': str(exc), 'url': url}
+                self.measure(info, status)
+                self.retry(url, info)
+                raise
+            finally:
+                self.pool.release(key, crl)
 
-        self.cobj = crl
+            self.measure(self.info, status)
+            if not self.retry(url, self.info, body, attempt):
+                break
+            attempt += 1
+
+        body, self.info = self.settle(url, body, self.info, entry)
+
+        return body
 
 
-def curl_info(crl):
+class WPToolsMulti(object):
     """
-    returns curl (response) info from Pycurl object
+    Runs many transfers concurrently in one thread via pycurl.CurlMulti
+
+    Transfers are queued with add() and performed by run(). Each
+    callback(body, info) runs as its transfer finishes, and may add()
+    more transfers, e.g. requests that depend on an earlier response.
+    """
+
+    active = None
+    cmulti = None
+    following = None
+    maxconn = MAXCONN
+    pending = None
+    ready = None
+    req = None
+    wait = None
+
+    def __init__(self, req, maxconn=MAXCONN):
+        """
+        Returns a WPToolsMulti object.
+
+        Arguments:
+        - req: <WPToolsRequest> request (settings, pool) to use
+        - [maxconn]: <int> maximum concurrent transfers
+        """
+        self.req = req
+        self.maxconn = maxconn
+        self.cmulti = pycurl.CurlMulti()
+        self.active = {}
+        self.pending = collections.deque()
+        self.ready = collections.deque()
+        self.following = []
+
+    def _deliver(self):
+        """
+        call back with responses found in disk cache, or of requests
+        (in flight elsewhere) that have landed
+        """
+        for flight, callback in list(self.following):
+            if flight.event.is_set():
+                self.following.remove((flight, callback))
+                try:
+                    body, info = flight.result()
+                except pycurl.error as exc:
+                    body, info = None, {'errno': exc.args[0],
+                                        'error': exc.args[-1]}
+                self.ready.append((callback, body, info))
+
+        while self.ready:
+            callback, body, info = self.ready.popleft()
+            if callback:
+                callback(body, info)
+
+    def _done(self, crl, errno=None, error=None):
+        """
+        remove finished transfer and call its callback
+        """
+        key, bfr, hdr, item = self.active.pop(crl)
+        url, status, callback, entry, attempt, flight = item
+        self.cmulti.remove_handle(crl)
+
+        try:
+            if error:
+                info = curl_info(crl)
+                info['errno'] = errno
+                info['error'] = error
+                body = None
+                bfr.close()
+            else:
+                body = self.req.curl_done(crl, bfr, hdr)
+                info = dict(self.req.info)
+        finally:
+            self.req.pool.release(key, crl)
+
+        self.req.measure(info, status)
+        if self.req.retry(url, info, body, attempt):
+            self.pending.append((url, status, callback, entry, attempt + 1,
+                                 flight))
+            return
+
+        if not error:
+            body, info = self.req.settle(url, body, info, entry)
+
+        self.req.flights.land(flight, body, info)
+
+        if callback:
+            callback(body, info)
+
+    def _finish(self):
+        """
+        handle transfers that have finished
+        """
+        while True:
+            queued, done, failed = self.cmulti.info_read()
+            for crl in done:
+                self._done(crl)
+            for crl, errno, errmsg in failed:
+                self._done(crl, errno, errmsg)
+            if not queued:
+                break
+
+    def _perform(self):
+        """
+        drive active transfers as far as they can go without blocking
+        """
+        while True:
+            ret, _ = self.cmulti.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+    def _start(self):
+        """
+        start pending transfers up to maxconn, as the scheduler admits
+        them, setting wait to seconds until the next may be admitted
+        """
+        self.wait = None
+        for _ in range(len(self.pending)):
+            if len(self.active) >= self.maxconn:
+                break
+
+            item = self.pending.popleft()
+            delay = self.req.admit(item[0])
+            if delay:
+                self.pending.append(item)
+                self.wait = min(self.wait or delay, delay)
+                continue
+
+            key, crl = self.req.borrow(item[0], item[1], item[3])
+            bfr = BytesIO()
+            hdr = BytesIO()
+            crl.setopt(pycurl.WRITEFUNCTION, bfr.write)
+            crl.setopt(pycurl.HEADERFUNCTION, hdr.write)
+            self.active[crl] = (key, bfr, hdr, item)
+            self.cmulti.add_handle(crl)
+
+    def abort(self):
+        """
+        remove active and pending transfers (without calling back),
+        landing their flights as failed
+        """
+        aborted = {'errno': pycurl.E_ABORTED_BY_CALLBACK, 'error': 'aborted'}
+
+        for crl in list(self.active):
+            key, _, _, item = self.active.pop(crl)
+            self.cmulti.remove_handle(crl)
+            self.req.pool.release(key, crl)
+            if self.req.scheduler is not None:
+                self.req.scheduler.cancel(item[0])
+            self.req.flights.land(item[-1], None, aborted)
+
+        while self.pending:
+            self.req.flights.land(self.pending.popleft()[-1], None, aborted)
+
+    def add(self, url, status=None, callback=None):
+        """
+        queue GET url, callback(body, info) when finished
+        """
+        entry = self.req.cached(url, status or url)
+        if entry and entry['fresh']:
+            self.ready.append((callback, entry['body'], entry['info']))
+            return
+
+        flight, leader = self.req.flights.join(url, self.notify)
+        if not leader:
+            self.following.append((flight, callback))
+            return
+
+        self.pending.append((url, status or url, callback, entry, 0, flight))
+
+    def notify(self):
+        """
+        called (from any thread) when a followed request has landed
+        """
+
+    def run(self):
+        """
+        perform all queued transfers (and any added meanwhile)
+        """
+        try:
+            while (self.pending or self.active or self.ready
+                   or self.following):
+                self._deliver()
+                self._start()
+                self._perform()
+                self._finish()
+
+                timeout = min(self.wait or 1.0, 1.0)
+                if self.following:  # landing elsewhere
+                    timeout = min(timeout, 0.05)
+
+                if self.active:
+                    self.cmulti.select(timeout)
+                elif self.following and not self.ready:
+                    self.following[0][0].event.wait(timeout)
+                elif self.pending and self.wait:
+                    time.sleep(self.wait)
+        finally:
+            self.abort()
+
+
+def curl_error(info):
+    """
+    raises pycurl.error if info is from a failed (multi) transfer
+    """
+    if info.get('error'):
+        raise pycurl.error(info.get('errno'), info['error'])
+
+
+def conditions(entry):
+    """
+    returns conditional request headers to revalidate disk cache entry
+    by its ETag or Last-Modified response headers
+    """
+    headers = (entry or {}).get('info', {}).get('headers') or {}
+    found = []
+    if headers.get('etag'):
+        found.append("If-None-Match: %s" % headers['etag'])
+    if headers.get('last-modified'):
+        found.append("If-Modified-Since: %s" % headers['last-modified'])
+    return found
+
+
+def curl_handle(proxy=None, timeout=0, verbose=False):
+    """
+    returns new pycurl handle with wptools options set
+    """
+    crl = pycurl.Curl()
+    crl.setopt(pycurl.USERAGENT, user_agent())
+    crl.setopt(pycurl.FOLLOWLOCATION, True)
+    crl.setopt(pycurl.CAINFO, certifi.where())
+    crl.setopt(pycurl.TCP_KEEPALIVE, 1)
+    crl.setopt(pycurl.ENCODING, ENCODING)
+
+    if proxy:
+        crl.setopt(pycurl.PROXY, proxy)
+    if timeout:  # 0 = wait forever
+        crl.setopt(pycurl.CONNECTTIMEOUT, timeout)
+        crl.setopt(pycurl.TIMEOUT, timeout)
+    if verbose:
+        crl.setopt(pycurl.VERBOSE, True)
+
+    return crl
+
+
+def curl_headers(raw):
+    """
+    returns {name: value} of (last) response headers, names lowercase
+    """
+    headers = {}
+    for line in raw.decode('iso-8859-1').splitlines():
+        if line.startswith('HTTP/'):  # new response (e.g. redirected)
+            headers = {}
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def curl_info(crl, headers=None, decoded=None):
+    """
+    returns curl (response) info from Pycurl object, with response
+    headers and decoded (body) bytes if given; bytes are as received
+    (compressed) over the wire
     """
     kbps = crl.getinfo(crl.SPEED_DOWNLOAD) / 1000.0
     url = crl.getinfo(crl.EFFECTIVE_URL)
     url = url.replace("&format=json", '').replace("&formatversion=2", '')
-    return {"url": url,
+    info = {"url": url,
             "user-agent": user_agent(),
             "content": crl.getinfo(crl.CONTENT_TYPE),
             "status": crl.getinfo(crl.RESPONSE_CODE),
             "bytes": crl.getinfo(crl.SIZE_DOWNLOAD),
             "seconds": "%5.3f" % crl.getinfo(crl.TOTAL_TIME),
             "kB/s": "%3.1f" % kbps}
+    if headers is not None:
+        info['headers'] = headers
+        info['encoding'] = headers.get('content-encoding')
+    if decoded is not None:
+        info['decoded'] = decoded
+    info['timing'] = curl_timing(crl)
+    return info
+
+
+def curl_timing(crl):
+    """
+    returns seconds spent in each phase of (last) transfer: dns, connect
+    (TCP), tls (handshake), ttfb (request sent to first byte), transfer
+    (first to last byte) and total; a reused connection spends none in
+    dns, connect or tls
+    """
+    dns = crl.getinfo(pycurl.NAMELOOKUP_TIME)
+    connect = crl.getinfo(pycurl.CONNECT_TIME)
+    tls = crl.getinfo(pycurl.APPCONNECT_TIME)
+    pretransfer = crl.getinfo(pycurl.PRETRANSFER_TIME)
+    start = crl.getinfo(pycurl.STARTTRANSFER_TIME)
+    total = crl.getinfo(pycurl.TOTAL_TIME)
+    return {'dns': dns,
+            'connect': max(0, connect - dns),
+            'tls': max(0, tls - connect) if tls else 0,
+            'ttfb': max(0, start - pretransfer),
+            'transfer': max(0, total - start) if start else 0,
+            'total': total}
 
 
 def user_agent():
@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Reservoir module
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Random pages of a wiki namespace, got in bulk and handed out without
+a request each: titles (list=random, 500 per request) or pages of a
+given class with get_query() data (generator=random, 20 per request).
+A reservoir is refilled in the background when fewer than low are
+left, so takes wait only when it runs dry.
+
+Reservoirs are shared by (wiki, namespace, pages, variant, proxy), see
+shared():
+
+    >>> wptools.reservoir.shared('fr').get()
+    {'pageid': 1234, 'title': 'Paris'}
+    >>> wptools.reservoir.shared('fr', pages=wptools.page).get()
+    <wptools.page.WPToolsPage object at 0x...>
+    >>> wptools.page(lang='fr', reservoir=True)  # get_random() from it
+"""
+
+import collections
+import threading
+
+from . import request
+from . import utils
+
+from .query import WPToolsQuery
+from .utils import iter_generated
+
+LOCK = threading.Lock()
+RESERVOIRS = {}
+
+
+class Reservoir(object):
+    """
+    Thread-safe supply of random pages of a wiki namespace, refilled
+    in the background
+    """
+
+    error = None
+    items = None
+    limit = None
+    low = None
+    namespace = 0
+    pages = None
+    params = None
+    proxy = None
+    ready = None
+    thread = None
+    timeout = 0
+
+    def __init__(self, lang='en', wiki=None, namespace=0, pages=None,
+                 limit=None, low=None, proxy=None, timeout=0,
+                 variant=None, scheme=None):
+        """
+        Returns a Reservoir object (filled on first get)
+
+        Optional arguments:
+        - [lang]: <str> Mediawiki language code (default=en)
+        - [wiki]: <str> alternative wiki site (default=wikipedia.org)
+        - [namespace]: <int> of pages (0=article, 14=category)
+        - [pages]: <class> hand out pages of this class (e.g.
+          wptools.page) made with from_query(), not titles
+        - [limit]: <int> pages per request (default=500, pages=20)
+        - [low]: <int> refill when fewer are left (default=limit/5)
+        - [proxy]: <str> use this HTTP proxy
+        - [timeout]: <int> timeout in seconds (0=wait forever)
+        - [variant]: <str> Mediawiki language variant
+        - [scheme]: <str> of all queries (default=https)
+        """
+        self.params = {'lang': lang, 'variant': variant, 'wiki': wiki,
+                       'scheme': scheme}
+        self.namespace = namespace
+        self.pages = pages
+        self.limit = limit or (20 if pages else 500)
+        self.low = self.limit // 5 if low is None else low
+        self.proxy = proxy
+        self.timeout = timeout
+        self.items = collections.deque()
+        self.ready = threading.Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    def _fetch(self):
+        """
+        returns list of random {pageid, title} or pages, one request
+        (and any continuation of props) at a time
+        """
+        qobj = WPToolsQuery(**self.params)
+        req = request.WPToolsRequest(True, False, self.proxy, self.timeout)
+
+        if not self.pages:
+            qstr = qobj.random(self.namespace, self.limit)
+            data = utils.json_loads(req.get(qstr, qobj.status))
+            if data.get('error'):
+                utils.stderr("API error: %s" % data.get('error'))
+                raise LookupError(qstr)
+            return [{'pageid': x.get('id'), 'title': x.get('title')}
+                    for x in data['query']['random']]
+
+        qstr = qobj.randompages(self.namespace, self.limit)
+        batch = next(iter_generated(req, qstr, qobj.status))
+        return [self.pages.from_query(page['title'],
+                                      {'query': {'pages': [page]}},
+                                      {'query': url, 'info': info},
+                                      silent=True, **self.params)
+                for page, url, info in batch]
+
+    def _refill(self):
+        """
+        add a bulk of random pages (in background thread)
+        """
+        items, error = [], None
+        try:
+            items = self._fetch()
+            if not items:  # e.g. empty namespace
+                raise LookupError("no random pages in namespace %d"
+                                  % self.namespace)
+        except Exception as exc:  # pylint: disable=broad-except
+            error = exc
+
+        with self.ready:
+            self.items.extend(items)
+            self.error = error
+            self.thread = None
+            self.ready.notify_all()
+
+    def _start(self):
+        """
+        start refill unless running (holding ready)
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._refill)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def fill(self):
+        """
+        start refill in the background (unless running), returns self
+        """
+        with self.ready:
+            self._start()
+        return self
+
+    def wait(self):
+        """
+        waits for a refill (if running) to finish, returns self
+        """
+        with self.ready:
+            while self.thread is not None:
+                self.ready.wait()
+        return self
+
+    def get(self):
+        """
+        returns a random {pageid, title} (or page if pages),
+        waiting for a refill only if there are none left, and raises
+        its error if it failed
+        """
+        with self.ready:
+            while not self.items:
+                if self.error is not None:
+                    error, self.error = self.error, None
+                    raise error
+                self._start()
+                self.ready.wait()
+
+            item = self.items.popleft()
+            if len(self.items) < self.low:
+                self._start()
+
+        return item
+
+
+def shared(lang='en', wiki=None, namespace=0, pages=None, **kwargs):
+    """
+    returns Reservoir of (wiki, namespace, pages, variant, proxy)
+    shared in process, made with kwargs (e.g. timeout) the first time
+    """
+    uri = WPToolsQuery(lang=lang, wiki=wiki,
+                       scheme=kwargs.get('scheme')).uri
+    key = (uri, namespace, pages, kwargs.get('variant'), kwargs.get('proxy'))
+    with LOCK:
+        if key not in RESERVOIRS:
+            RESERVOIRS[key] = Reservoir(lang, wiki, namespace, pages,
+                                        **kwargs)
+        return RESERVOIRS[key]
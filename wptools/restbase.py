@@ -181,6 +181,17 @@ class WPToolsRESTBase(core.WPTools):
                 img.update({'url': thumbnail.get('source')})
             self.data['image'].append(img)
 
+    def aget_restbase(self, endpoint=None, show=True, proxy=None,
+                      timeout=0):
+        """
+        Awaitable get_restbase() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if endpoint:
+            endpoint = self._parse_endpoint(endpoint, self.params.get('title'))
+            self.params.update({'endpoint': endpoint})
+        return self._aio().get(self, 'restbase', show, proxy, timeout)
+
     def get_restbase(self, endpoint=None, show=True, proxy=None, timeout=0):
         """
         GET RESTBase /page/ endpoints needing only {title}
@@ -5,13 +5,117 @@ WPTools Site module
 ~~~~~~~~~~~~~~~~~~~
 
 Support for getting Mediawiki site info.
+
+SiteMatrix indexes Wikimedia sites by dbname, language, family and
+URL host. sitematrix() loads the index once per process, from the
+disk cache (fresh for MATRIX_TTL) or commons, so wikis can be checked
+locally, e.g. before any request (see WPToolsQuery.SITES). The disk
+cache is only used if set (cache.DISK, default None), otherwise each
+process gets the sitematrix from commons again:
+
+    >>> wptools.cache.DISK = wptools.cache.DirCache('~/.wptools')
+
+    >>> from wptools.site import sitematrix
+    >>> WPToolsQuery.SITES = sitematrix()
+    >>> wptools.page('Paris', lang='xx')
+    ValueError: unknown wiki: xx.wikipedia.org
 """
 
 from __future__ import print_function
 
 import random
+import threading
+
+try:  # python2
+    from urlparse import urlparse
+except ImportError:  # python3
+    from urllib.parse import urlparse
 
 from . import core
+from . import request
+from . import utils
+
+from .query import WPToolsQuery, domain_name
+
+LOCK = threading.Lock()
+MATRIX = None
+MATRIX_TTL = 30 * 24 * 60 * 60
+
+
+class SiteMatrix(object):
+    """
+    Index of Wikimedia sites of an API:SiteMatrix response by dbname,
+    language code, family (e.g. wiktionary.org) and URL host. Closed,
+    fishbowl and private sites are left out.
+    """
+
+    cache = None
+    dbnames = None
+    families = None
+    hosts = None
+    langs = None
+    sites = None
+
+    def __init__(self, matrix):
+        """
+        Returns a SiteMatrix object.
+
+        Arguments:
+        - matrix: <dict> sitematrix of API:SiteMatrix response
+        """
+        self.cache = {}
+        self.dbnames = {}
+        self.families = {}
+        self.hosts = {}
+        self.langs = {}
+        self.sites = []
+
+        for item in matrix:
+            lang, sites = None, []
+            if isinstance(matrix[item], list):  # specials
+                sites = matrix[item]
+            elif isinstance(matrix[item], dict):
+                lang, sites = matrix[item].get('code'), matrix[item]['site']
+
+            for site in sites:
+                if len(site.keys()) > 4:  # closed, fishbowl, private
+                    continue
+                host = urlparse(site['url']).netloc
+                self.dbnames[site['dbname']] = site
+                self.hosts[host] = site
+                self.sites.append(site)
+                family = host.split('.', 1)[-1]
+                if '.' not in family:  # e.g. wikisource.org
+                    family = host
+                self.families.setdefault(family, []).append(site)
+                if lang:
+                    self.langs.setdefault(lang, []).append(site)
+
+    def __contains__(self, wiki):
+        return self.find(wiki) is not None
+
+    def __len__(self):
+        return len(self.sites)
+
+    def find(self, wiki):
+        """
+        returns site {url, dbname, code, sitename, ...} of wiki host
+        (e.g. en.wikipedia.org), URL or dbname (e.g. enwiki), or None
+        """
+        if '://' in wiki:
+            wiki = urlparse(wiki).netloc
+        return self.hosts.get(domain_name(wiki)) or self.dbnames.get(wiki)
+
+    def urls(self, domain=None):
+        """
+        returns URLs of (listed) sites, of family (or in URL) domain
+        if given
+        """
+        if not domain:
+            return [x['url'] for x in self.sites]
+        if domain in self.families:
+            return [x['url'] for x in self.families[domain]]
+        return [x['url'] for x in self.sites if domain in x['url']]
 
 
 class WPToolsSite(core.WPTools):
@@ -27,6 +131,7 @@ class WPToolsSite(core.WPTools):
 
         Optional keyword {params}:
         - [lang]: <str> Mediawiki language code (default=en)
+        - [scheme]: <str> of all queries (default=https)
         - [wiki]: <str> alternative wiki site (default=wikipedia.org)
 
         Optional keyword {flags}:
@@ -92,12 +197,19 @@ class WPToolsSite(core.WPTools):
         """
         data = self._load_response('sitematrix')
 
-        self.params.update({'title': self.COMMONS})
-
         matrix = data.get('sitematrix')
         if matrix:
-            self.data['sites'] = self._sitelist(matrix)
-            self.data['random'] = random.choice(self.data['sites'])
+            self._set_sites(SiteMatrix(matrix))
+
+    def _set_sites(self, matrix):
+        """
+        capture sites of SiteMatrix (in domain) in data attribute
+        """
+        self.params.update({'title': self.COMMONS})
+
+        sites = matrix.urls(self.params.get('domain'))
+        self.data['sites'] = sites
+        self.data['random'] = random.choice(sites)
 
     def _set_sitevisitors(self):
         """
@@ -113,31 +225,24 @@ class WPToolsSite(core.WPTools):
             else:
                 self.data['visitors'] = 0
 
-    def _sitelist(self, matrix):
+    def aget_info(self, wiki=None, show=True, proxy=None, timeout=0):
         """
-        Returns a list of sites from a SiteMatrix, optionally filtered
-        by 'domain' param
+        Awaitable get_info() on the asyncio event loop (python 3.5+)
+        see wptools.aio
         """
-        _list = []
-        for item in matrix:
-            sites = []
-
-            if isinstance(matrix[item], list):
-                sites = matrix[item]
-            elif isinstance(matrix[item], dict):
-                sites = matrix[item]['site']
+        if wiki:
+            self.params.update({'wiki': wiki})
 
-            for site in sites:
-                if len(site.keys()) > 4:  # closed, fishbowl, private
-                    continue
-                domain = self.params.get('domain')
-                if domain:
-                    if domain in site['url']:
-                        _list.append(site['url'])
-                else:
-                    _list.append(site['url'])
+        return self._aio().get(self, ['siteinfo', 'sitevisitors'], show,
+                               proxy, timeout)
 
-        return _list
+    def aget_sites(self, domain=None, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_sites() on the asyncio event loop (python 3.5+),
+        run in the executor, see wptools.aio
+        """
+        return self._aio().call(self.get_sites, domain, show, proxy,
+                                timeout)
 
     def get_info(self, wiki=None, show=True, proxy=None, timeout=0):
         """
@@ -184,15 +289,26 @@ class WPToolsSite(core.WPTools):
         Data captured:
         - random: randomly selected wiki site
         - sites: <list> of wiki sites (hundreds) from commons SiteMatrix
+
+        The SiteMatrix is shared in process (see sitematrix()), and its
+        response cached here as usual.
         """
         if domain:
             self.params.update({'domain': domain})
 
-        self.params.update({'wiki': self.COMMONS})
-
-        self._get('sitematrix', show, proxy, timeout)
+        if 'sitematrix' in self.cache:
+            utils.stderr("+ sitematrix results in cache",
+                         self.flags['silent'])
+        else:
+            matrix = sitematrix(proxy, timeout,
+                                scheme=self.params.get('scheme'),
+                                silent=self.flags['silent'],
+                                verbose=self.flags['verbose'])
+            self.cache['sitematrix'] = dict(matrix.cache)
+            self._set_sites(matrix)
 
-        del self.params['wiki']
+        if show:
+            self.show()
 
         return self
 
@@ -224,3 +340,30 @@ class WPToolsSite(core.WPTools):
                                        "{:,}".format(item['count'])))
             if count >= limit:
                 break
+
+
+def sitematrix(proxy=None, timeout=0, refresh=False, scheme=None,
+               silent=True, verbose=False):
+    """
+    returns SiteMatrix of Wikimedia sites shared in process, loaded
+    once (or again if refresh) from the disk cache, where it stays
+    fresh for MATRIX_TTL, or from commons (by scheme, default=https).
+    Without a disk cache (cache.DISK=None), each process loads it from
+    commons. Its cache has the query, response and request info.
+    """
+    global MATRIX  # pylint: disable=global-statement
+
+    with LOCK:
+        if MATRIX is None or refresh:
+            qobj = WPToolsQuery(wiki=WPToolsSite.COMMONS, scheme=scheme)
+            qstr = qobj.site('sitematrix')
+            req = request.WPToolsRequest(silent, verbose, proxy, timeout,
+                                         ttl=MATRIX_TTL)
+            response = req.get(qstr, qobj.status)
+            data = utils.json_loads(response)
+            if not data.get('sitematrix'):
+                raise LookupError(qstr)
+            MATRIX = SiteMatrix(data['sitematrix'])
+            MATRIX.cache = {'query': qstr, 'response': response,
+                            'info': req.info}
+        return MATRIX
@@ -0,0 +1,324 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Throttle module
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Paces requests to each host so sustained throughput stays near what
+Wikimedia allows without tripping its throttles:
+
+- token buckets limit the request rate per host (see RATES)
+- an AIMD controller adapts concurrent transfers per host, adding one
+  per window of good responses and halving on errors, throttling or
+  rising latency
+- Retry-After (429, 503) and maxlag responses block the host for the
+  time asked (or an exponential backoff), then are retried
+
+All requests share SCHEDULER unless given another (or None).
+"""
+
+import email.utils
+import json
+import threading
+import time
+
+try:  # python2
+    from urlparse import urlparse
+except ImportError:  # python3
+    from urllib.parse import urlparse
+
+BACKOFF = 1.0
+DECREASE = 0.5
+MAXBACKOFF = 60.0
+MAXCONN = 32
+MAXRETRY = 3
+SLOW = 3.0
+STARTCONN = 8
+
+# requests per second (and burst) by host suffix
+RATES = {'commons.wikimedia.org': 50,
+         'wikipedia.org': 50,
+         'www.wikidata.org': 50}
+
+
+class TokenBucket(object):
+    """
+    Allows rate events per second, up to burst at once
+    """
+
+    burst = None
+    rate = None
+    stamp = None
+    tokens = None
+
+    def __init__(self, rate, burst=None):
+        """
+        Returns a TokenBucket object.
+
+        Arguments:
+        - rate: <float> tokens added per second
+        - [burst]: <float> most tokens held (default=rate)
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.stamp = time.time()
+
+    def _refill(self, now):
+        """
+        add tokens accrued since last refill
+        """
+        elapsed = max(0, now - self.stamp)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.stamp = now
+
+    def delay(self, now=None):
+        """
+        returns seconds until a token is available
+        """
+        self._refill(now or time.time())
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        """
+        take a token, returns seconds to wait if there was none
+        """
+        wait = self.delay(now)
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class Host(object):
+    """
+    Scheduling state of a host
+    """
+
+    active = 0
+    blocked = 0
+    bucket = None
+    counts = None
+    latency = None
+    limit = STARTCONN
+
+    def __init__(self, rate=None, limit=STARTCONN):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.limit = float(limit)
+        self.counts = {'errors': 0, 'requests': 0, 'retries': 0,
+                       'throttled': 0}
+
+
+class Scheduler(object):
+    """
+    Thread-safe per-host request scheduler (rate, concurrency, backoff)
+    """
+
+    hosts = None
+    lock = None
+    maxconn = MAXCONN
+    minconn = 1
+    rates = None
+    slow = SLOW
+    startconn = STARTCONN
+
+    def __init__(self, rates=None, startconn=STARTCONN, maxconn=MAXCONN,
+                 slow=SLOW):
+        """
+        Returns a Scheduler object.
+
+        Arguments:
+        - [maxconn]: <int> most concurrent transfers per host
+        - [rates]: <dict> requests per second by host suffix (RATES)
+        - [slow]: <float> latency (times average) that counts as slow
+        - [startconn]: <int> initial concurrent transfers per host
+        """
+        self.rates = RATES if rates is None else rates
+        self.startconn = startconn
+        self.maxconn = maxconn
+        self.slow = slow
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _decrease(self, host):
+        """
+        multiplicative decrease of host concurrency
+        """
+        host.limit = max(self.minconn, host.limit * DECREASE)
+
+    def _host(self, url):
+        """
+        returns Host of url, or None if it is not scheduled (not HTTP)
+        """
+        name = hostname(url)
+        if not name:
+            return
+
+        if name not in self.hosts:
+            rate = None
+            for suffix in self.rates:
+                if name == suffix or name.endswith('.' + suffix):
+                    rate = self.rates[suffix]
+            self.hosts[name] = Host(rate, self.startconn)
+
+        return self.hosts[name]
+
+    def admit(self, url, now=None):
+        """
+        returns 0 and counts a transfer to url as started, or else
+        seconds to wait before trying again
+        """
+        now = now or time.time()
+        with self.lock:
+            host = self._host(url)
+            if host is None:
+                return 0
+            if host.blocked > now:
+                return host.blocked - now
+            if host.active >= int(host.limit):
+                return 0.05  # until a transfer finishes
+            if host.bucket:
+                wait = host.bucket.take(now)
+                if wait:
+                    return wait
+            host.active += 1
+            host.counts['requests'] += 1
+        return 0
+
+    def cancel(self, url):
+        """
+        count transfer to url as not finished (aborted)
+        """
+        with self.lock:
+            host = self._host(url)
+            if host is not None:
+                host.active = max(0, host.active - 1)
+
+    def done(self, url, info, body=None, attempt=0):
+        """
+        count finished transfer to url and adapt its host, returns
+        seconds to wait before retrying, or None (no retry)
+        """
+        now = time.time()
+        info = info or {}
+        delay = backoff(info, body, attempt)
+
+        with self.lock:
+            host = self._host(url)
+            if host is None:
+                return delay
+            host.active = max(0, host.active - 1)
+
+            if delay is not None:
+                host.counts['throttled'] += 1
+                host.blocked = max(host.blocked, now + delay)
+                self._decrease(host)
+                return delay
+
+            if info.get('error') or info.get('status', 200) >= 500:
+                host.counts['errors'] += 1
+                self._decrease(host)
+                return
+
+            seconds = float(info.get('seconds') or 0)
+            if host.latency and seconds > self.slow * host.latency:
+                self._decrease(host)
+            else:
+                host.limit = min(self.maxconn, host.limit + 1.0 / host.limit)
+            host.latency = (0.8 * host.latency + 0.2 * seconds
+                            if host.latency else seconds)
+
+    def retried(self, url):
+        """
+        count a retry to url
+        """
+        with self.lock:
+            host = self._host(url)
+            if host is not None:
+                host.counts['retries'] += 1
+
+    def stats(self):
+        """
+        returns {host: {active, limit, latency, blocked, errors, requests,
+        retries, throttled}}
+        """
+        stats = {}
+        with self.lock:
+            for name, host in self.hosts.items():
+                stats[name] = dict(host.counts,
+                                   active=host.active,
+                                   blocked=max(0, host.blocked - time.time()),
+                                   latency=host.latency,
+                                   limit=host.limit)
+        return stats
+
+    def wait(self, url):
+        """
+        block until a transfer to url may start (see admit())
+        """
+        while True:
+            delay = self.admit(url)
+            if not delay:
+                return
+            time.sleep(delay)
+
+
+SCHEDULER = Scheduler()
+
+
+def backoff(info, body=None, attempt=0):
+    """
+    returns seconds to wait before retrying a throttled (429, 503) or
+    lagged (maxlag) response: its Retry-After, else exponential backoff;
+    or None if the response is not to be retried
+    """
+    headers = info.get('headers') or {}
+    throttled = info.get('status') in (429, 503) or maxlag(body)
+    if not throttled:
+        return
+
+    after = retry_after(headers.get('retry-after'))
+    if after is None:
+        after = BACKOFF * 2 ** attempt
+    return min(after, MAXBACKOFF)
+
+
+def hostname(url):
+    """
+    returns lowercase host of HTTP(S) url, or None
+    """
+    if isinstance(url, bytes):
+        url = url.decode('utf-8')
+    parts = urlparse(url)
+    if parts.scheme in ('http', 'https'):
+        return parts.hostname
+
+
+def maxlag(body):
+    """
+    returns True if body is a MediaWiki API maxlag error
+    """
+    if not body or b'maxlag' not in body[:256]:
+        return False
+    try:
+        error = json.loads(body.decode('utf-8')).get('error') or {}
+    except ValueError:
+        return False
+    return error.get('code') == 'maxlag'
+
+
+def retry_after(value):
+    """
+    returns seconds from Retry-After header value (seconds or HTTP
+    date), or None
+    """
+    if not value:
+        return
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    date = email.utils.parsedate_tz(value)
+    if date:
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
@@ -0,0 +1,178 @@
+# -*- coding:utf-8 -*-
+
+"""
+WPTools Tracing module
+~~~~~~~~~~~~~~~~~~~~~~
+
+Hooks to observe where time goes getting a page: building queries
+(query), HTTP requests (request), decoding responses (decode) and
+capturing their data (marshal).
+
+Hooks registered on TRACER are called with events (dicts) that have:
+stage, phase ('start' or 'stop'), action, title, bytes, start (epoch
+seconds), thread, and on stop, duration (seconds). Transfers run
+concurrently are timed by curl, and only emit stop events.
+
+To profile a run in Chrome (chrome://tracing) or Perfetto:
+
+    >>> with wptools.tracing.ChromeTrace('wptools.json'):
+    ...     wptools.page('Gandhi').get()
+"""
+
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+
+class Tracer(object):
+    """
+    Registry of hooks called with start and stop events of stages
+    """
+
+    hooks = None
+    lock = None
+
+    def __init__(self):
+        """
+        Returns a Tracer object.
+        """
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    def emit(self, event):
+        """
+        call hooks with event
+        """
+        for hook in list(self.hooks):
+            hook(event)
+
+    def register(self, hook):
+        """
+        call hook(event) on each event, returns hook
+        """
+        with self.lock:
+            self.hooks = self.hooks + [hook]
+        return hook
+
+    @contextlib.contextmanager
+    def span(self, stage, action=None, title=None, size=None):
+        """
+        context emitting start and stop events of stage, yields the
+        event (e.g. to set its bytes), or None if there are no hooks
+        """
+        if not self.hooks:
+            yield None
+            return
+
+        event = {'action': action,
+                 'bytes': size,
+                 'stage': stage,
+                 'start': time.time(),
+                 'thread': threading.current_thread().ident,
+                 'title': title}
+        self.emit(dict(event, phase='start'))
+
+        try:
+            yield event
+        finally:
+            event['duration'] = time.time() - event['start']
+            self.emit(dict(event, phase='stop'))
+
+    def stop(self, stage, duration, action=None, title=None, size=None):
+        """
+        emit stop event of stage that just finished, taking duration
+        """
+        if not self.hooks:
+            return
+
+        self.emit({'action': action,
+                   'bytes': size,
+                   'duration': duration,
+                   'phase': 'stop',
+                   'stage': stage,
+                   'start': time.time() - duration,
+                   'thread': threading.current_thread().ident,
+                   'title': title})
+
+    def unregister(self, hook):
+        """
+        stop calling hook
+        """
+        with self.lock:
+            self.hooks = [x for x in self.hooks if x != hook]
+
+
+class ChromeTrace(object):
+    """
+    Hook collecting stop events as Chrome trace events (JSON Object
+    Format), in context registered on tracer and saved to path
+    """
+
+    events = None
+    lock = None
+    path = None
+    tracer = None
+
+    def __init__(self, path=None, tracer=None):
+        """
+        Returns a ChromeTrace object.
+
+        Arguments:
+        - [path]: <str> file to save trace to on leaving context
+        - [tracer]: <Tracer> to register on (default=TRACER)
+        """
+        self.path = path
+        self.tracer = tracer or TRACER
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        if event['phase'] != 'stop':
+            return
+
+        args = dict((x, event[x]) for x in ('action', 'bytes', 'title')
+                    if event.get(x) is not None)
+
+        name = event['stage']
+        if event.get('action'):
+            name = "%s (%s)" % (name, event['action'])
+
+        with self.lock:
+            self.events.append({'args': args,
+                                'cat': event['stage'],
+                                'dur': int(event['duration'] * 1e6),
+                                'name': name,
+                                'ph': 'X',
+                                'pid': os.getpid(),
+                                'tid': event['thread'],
+                                'ts': int(event['start'] * 1e6)})
+
+    def __enter__(self):
+        self.tracer.register(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.unregister(self)
+        if self.path:
+            self.save(self.path)
+
+    def dumps(self):
+        """
+        returns trace as JSON string
+        """
+        with self.lock:
+            events = sorted(self.events, key=lambda x: x['ts'])
+        return json.dumps({'displayTimeUnit': 'ms', 'traceEvents': events})
+
+    def save(self, path):
+        """
+        write trace (JSON) to path
+        """
+        with io.open(path, 'w', encoding='utf-8') as fh:
+            fh.write(u"%s" % self.dumps())  # py2 dumps() is (ascii) str
+
+
+TRACER = Tracer()
@@ -6,7 +6,9 @@ WPTools Utilities module.
 
 from __future__ import print_function
 
+import collections
 import sys
+import threading
 
 import json
 
@@ -18,6 +20,27 @@ import lxml.html
 
 from lxml.etree import tostring
 
+try:  # python2
+    from Queue import Full, Queue
+    from urllib import urlencode
+except ImportError:  # python3
+    from queue import Full, Queue
+    from urllib.parse import urlencode
+
+
+class _Closed(Exception):
+    """
+    raised by emit() of stream() once its consumer has closed
+    """
+
+
+def chunks(items, size):
+    """
+    returns list of items in lists of (at most) size
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 
 def get_infobox(ptree):
     """
@@ -61,6 +84,37 @@ def isfilename(name):
     return False
 
 
+def iter_generated(req, qstr, status=None):
+    """
+    yields lists of (page, query, info) of action=query generator
+    batches, following continuation of props (e.g. excontinue) within
+    a batch, then of the generator (g...continue) to the next
+    """
+    cont = {}
+    responses = []
+    while True:
+        url = qstr
+        if cont:
+            url += '&' + urlencode(sorted(cont.items()))
+
+        responses.append(json_loads(req.get(url, status or url)))
+        last, cont = cont, responses[-1].get('continue') or {}
+
+        if cont != last:  # else no progress, e.g. unknown continue
+            if [x for x in cont if x != 'continue' and x[0] != 'g']:
+                continue  # same batch, more props
+        else:
+            cont = {}
+
+        found = split_query(responses, url)
+        yield [(found[x], url, dict(req.info)) for x in found
+               if found[x].get('title') == x]
+        responses = []
+
+        if not cont:
+            return
+
+
 def json_loads(data):
     """
     python-version safe json.loads
@@ -68,6 +122,24 @@ def json_loads(data):
     return json.loads(data, encoding='utf-8')
 
 
+def prefetch(items, size=1):
+    """
+    returns iterator of iterable items, advanced up to size items ahead
+    in a background thread (see stream), or as consumed if size is 0
+    """
+    if size < 1:
+        return iter(items)
+
+    def produce(emit):
+        """
+        emit items
+        """
+        for item in items:
+            emit(item)
+
+    return stream(produce, size)
+
+
 def pretty(data):
     """
     return pretty JSON
@@ -78,6 +150,44 @@ def pretty(data):
                       separators=(',', ': '))
 
 
+def split_query(responses, query=None):
+    """
+    returns {title: page} from action=query responses for many titles,
+    merging continued responses, and mapping normalized or redirected
+    titles to their page; raises LookupError on API error
+    """
+    _pages = collections.OrderedDict()
+    aliases = {}
+
+    for data in responses:
+        if data.get('error'):
+            stderr("API error: %s" % data.get('error'))
+            raise LookupError(query)
+
+        qdata = data.get('query') or {}
+
+        for item in qdata.get('normalized', []) + qdata.get('redirects', []):
+            aliases[item['from']] = item['to']
+
+        for page in qdata.get('pages', []):
+            if page.get('missing') or page.get('invalid'):
+                continue
+            merged = _pages.setdefault(page['title'], {})
+            for key in page:
+                merged.setdefault(key, page[key])
+
+    for alias in aliases:
+        title = alias
+        for _ in range(len(aliases)):
+            if title not in aliases:
+                break
+            title = aliases[title]
+        if title in _pages:
+            _pages[alias] = _pages[title]
+
+    return _pages
+
+
 def stderr(msg, silent=False):
     """
     write msg to stderr if not silent
@@ -86,6 +196,60 @@ def stderr(msg, silent=False):
         print(msg, file=sys.stderr)
 
 
+def stream(produce, size=1):
+    """
+    yields items that produce(emit) emits in a background thread, up
+    to size items ahead of the consumer (emit blocks meanwhile). Its
+    exceptions are raised here, and once the generator is closed,
+    emit raises to stop it.
+    """
+    done = object()
+    queue = Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(entry):
+        """
+        queue (item, exception) entry unless closed
+        """
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.05)
+                return
+            except Full:
+                pass
+        raise _Closed()
+
+    def run():
+        """
+        produce items, then done (or exception)
+        """
+        try:
+            produce(lambda item: put((item, None)))
+            put((done, None))
+        except _Closed:
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            try:
+                put((done, exc))
+            except _Closed:
+                return
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item, exc = queue.get()
+            if exc is not None:
+                raise exc
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
 def template_to_dict(tree):
     """
     returns wikitext template as dict (one deep)
@@ -10,17 +10,27 @@ https://www.wikidata.org/wiki/Wikidata:Data_access
 """
 
 import collections
+import json
 import re
 
 from . import core
+from . import request
 from . import utils
 
+from .cache import LRUCache
+from .query import WPToolsQuery
+
+MISSING = object()
+
 
 class WPToolsWikidata(core.WPTools):
     """
     WPToolsWikidata class
     """
 
+    # process-wide claim labels by (QID, variant or lang)
+    LABEL_CACHE = LRUCache()
+
     # user-defined property labels
     LABELS = {'P17': 'country',
               'P18': 'image',
@@ -71,6 +81,7 @@ class WPToolsWikidata(core.WPTools):
 
         Optional keyword {params}:
         - [lang]: <str> Mediawiki language code (default='en')
+        - [scheme]: <str> of all queries (default=https)
         - [variant]: <str> Mediawiki language variant
         - [wikibase]: <str> Wikidata database ID (e.g. 'Q1')
 
@@ -85,6 +96,53 @@ class WPToolsWikidata(core.WPTools):
         if wikibase:
             self.params.update({'wikibase': wikibase})
 
+    def _add_claims(self, qobj, multi, callback):
+        """
+        queue claims labels requests on multi, and callback(response,
+        info) with their merged result when all have landed
+        """
+        queries = self._claims_queries(qobj)
+        results = [None] * len(queries)
+
+        def landed(i, response, info):
+            """
+            collect chunk result, callback when it was the last
+            """
+            results[i] = (response, info)
+            if None not in results:
+                callback(*merge_entities(results))
+
+        for i, (qstr, status) in enumerate(queries):
+            multi.add(qstr, status,
+                      lambda response, info, i=i: landed(i, response, info))
+
+    def _claims_queries(self, qobj):
+        """
+        returns [(query, status)] for claims missing labels, one per
+        chunk of WPToolsQuery.MAXTITLES, as cached by _query()
+        """
+        cached = self.cache['claims']
+        if 'queries' not in cached:
+            return [(cached['query'], qobj.status)]
+        return list(zip(cached['queries'], cached['status']))
+
+    def _get_claims(self, show, proxy, timeout):
+        """
+        request claims labels (in chunks, concurrently) and cache the
+        merged response
+        """
+        qobj = self._prepare('claims')
+        if qobj is None:
+            return
+
+        multi = request.WPToolsMulti(self._request(proxy, timeout))
+        self._add_claims(qobj, multi, lambda response, info:
+                         self._set_response('claims', response, info))
+        multi.run()
+
+        if show:
+            self.show()
+
     def _get_entity_prop(self, entity, prop):
         """
         returns Wikidata entity property value
@@ -115,12 +173,29 @@ class WPToolsWikidata(core.WPTools):
                 else:
                     self._update_wikidata(label, val)
 
+    def _missing_claims(self):
+        """
+        returns claims (QIDs) without a cached label
+        """
+        lang = self.params.get('variant') or self.params['lang']
+        return [x for x in self.data['claims']
+                if (x, lang) not in self.LABEL_CACHE]
+
     def _query(self, action, qobj):
         """
         returns wikidata query string
         """
         if action == 'claims':
-            return qobj.claims(self.data['claims'].keys())
+            # all chunks from one list, as labels may be added meanwhile
+            chunks = utils.chunks(self._missing_claims(),
+                                  WPToolsQuery.MAXTITLES)
+            queries, status = [], []
+            for chunk in reversed(chunks or [[]]):  # qobj.status of first
+                queries.insert(0, qobj.claims(chunk))
+                status.insert(0, qobj.status)
+            self.cache['claims'].update({'queries': queries,
+                                         'status': status})
+            return queries[0]
         elif action == 'wikidata':
             return qobj.wikidata(self.params.get('title'),
                                  self.params.get('wikibase'))
@@ -135,7 +210,7 @@ class WPToolsWikidata(core.WPTools):
         if action == 'wikidata':
             self._set_wikidata()
 
-            if self.data.get('claims'):
+            if self.data.get('claims') and not self.flags.get('defer_claims'):
                 self.get_claims(show=False)
 
     def _set_claims_data(self):
@@ -144,10 +219,29 @@ class WPToolsWikidata(core.WPTools):
         """
         data = self._load_response('claims')
         entities = data.get('entities')
+
+        labels = {}
         for item in entities:
-            attr = self.data['claims'][item]
-            value = self._get_entity_prop(entities[item], 'labels')
-            self._update_wikidata(attr, value)
+            labels[item] = self._get_entity_prop(entities[item], 'labels')
+
+        self._set_claims_labels(labels)
+
+    def _set_claims_labels(self, labels=None):
+        """
+        set property claim labels from LABEL_CACHE, or else labels
+        (from response), which are then cached
+        """
+        lang = self.params.get('variant') or self.params['lang']
+        labels = labels or {}
+
+        for item in self.data['claims']:
+            value = self.LABEL_CACHE.get((item, lang), MISSING)
+            if value is MISSING:
+                value = labels.get(item, MISSING)
+                if value is MISSING:
+                    continue
+                self.LABEL_CACHE.set((item, lang), value)
+            self._update_wikidata(self.data['claims'][item], value)
 
         self.data['what'] = self.data['wikidata'].get('instance')
 
@@ -263,6 +357,24 @@ class WPToolsWikidata(core.WPTools):
 
         return dict(props)
 
+    def aget_claims(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_claims() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.data['claims']:
+            raise LookupError("get_claims needs claims")
+        return self._aio().get_claims(self, show, proxy, timeout)
+
+    def aget_wikidata(self, show=True, proxy=None, timeout=0):
+        """
+        Awaitable get_wikidata() on the asyncio event loop (python 3.5+)
+        see wptools.aio
+        """
+        if not self.params.get('wikibase') and not self.params.get('title'):
+            raise LookupError("get_wikidata needs wikibase or title")
+        return self._aio().get(self, 'wikidata', show, proxy, timeout)
+
     def get_claims(self, show=True, proxy=None, timeout=0):
         """
         GET Wikidata:API (action=wbgetentities) claims labels
@@ -275,11 +387,22 @@ class WPToolsWikidata(core.WPTools):
         e.g. wikidata: {'country': 'Chile'}
 
         Use wikidata.get_wikidata() to populate data['claims']
+
+        Labels are served from LABEL_CACHE where possible, and only
+        claims missing from it are requested, WPToolsQuery.MAXTITLES
+        per request, concurrently.
         """
         if not self.data['claims']:
             raise LookupError("get_claims needs claims")
 
-        self._get('claims', show, proxy, timeout)
+        if 'claims' not in self.cache and not self._missing_claims():
+            utils.stderr("+ claims labels in cache", self.flags['silent'])
+            self._set_claims_labels()
+            if show:
+                self.show()
+            return self
+
+        self._get_claims(show, proxy, timeout)
 
         return self
 
@@ -327,8 +450,49 @@ class WPToolsWikidata(core.WPTools):
 
         return self
 
+    def set_entity(self, entity, cache=None):
+        """
+        Capture Wikidata from an entity (of a wbgetentities response
+        for many items) as get_wikidata() does, without get_claims()
+
+        Arguments:
+        - entity: <dict> Wikidata entity
+        - [cache]: <dict> query (string) and info to cache with it
+        """
+        data = {'entities': {entity.get('id'): entity}}
+
+        self.cache['wikidata'] = dict(cache or {})
+        self.cache['wikidata']['response'] = json.dumps(data)
+
+        self._set_wikidata()
+
     def update_labels(self, labels):
         """
         Update wikidata property labels to capture
         """
         self.LABELS.update(labels)
+
+
+def merge_entities(results):
+    """
+    returns (response, info) merging wbgetentities results (body, info)
+    of chunked requests in order, raises pycurl.error on failed request
+    """
+    for _, info in results:
+        request.curl_error(info)
+
+    if len(results) == 1:
+        return results[0]
+
+    entities = collections.OrderedDict()
+    for body, info in results:
+        data = utils.json_loads(body)
+        if data.get('error'):
+            return body, info
+        entities.update(data.get('entities') or {})
+
+    info = dict(results[0][1])
+    info['bytes'] = sum(x[1].get('bytes') or 0 for x in results)
+    info['chunks'] = len(results)
+
+    return json.dumps({'entities': entities}), info